@@ -1,3 +1,74 @@
-from django.test import TestCase
+from datetime import timedelta
 
-# Create your tests here.
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from patients.models import Notification, PressureData, PressureFrame
+
+from . import views
+
+User = get_user_model()
+
+
+@override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cache')
+class PatientListTests(TestCase):
+
+    def setUp(self):
+        self.clinician = User.objects.create_user('clin', password='pw', role='clinician')
+        self.client.force_login(self.clinician)
+
+    def add_patients(self, count, clinician=None):
+        now = timezone.now()
+        patients = []
+        for i in range(count):
+            patient = User.objects.create_user(f'p{User.objects.count()}', role='patient', clinician=clinician or self.clinician)
+            PressureFrame.from_grid(patient, now - timedelta(minutes=i), np.full((2, 2), 50 + i, dtype='<f4')).save()
+            PressureData.objects.create(patient=patient, timestamp=now - timedelta(hours=1), sensor_location='left_hip', pressure_value=10)
+            Notification.objects.create(patient=patient, message='m', is_read=bool(i % 2))
+            patients.append(patient)
+        return patients
+
+    def query_count(self, **params):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('patient_list'), params)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response
+
+    def test_constant_number_of_queries(self):
+        self.add_patients(3)
+        self.query_count()  # the first request also loads the user into the per-process cache
+        few, _ = self.query_count()
+        self.add_patients(views.PATIENTS_PER_PAGE + 5)
+        many, _ = self.query_count()
+        alerts_only, _ = self.query_count(filter_alerts='on')
+        self.assertEqual(few, many)
+        self.assertEqual(few, alerts_only)
+
+    def test_annotations_and_scoping(self):
+        mine = self.add_patients(2)
+        other = User.objects.create_user('clin2', password='pw', role='clinician')
+        self.add_patients(1, clinician=other)
+        _, response = self.query_count()
+        patients = response.context['patients']
+        self.assertEqual([p.id for p in patients], [p.id for p in mine])
+        self.assertEqual([p.alerts for p in patients], [1, 0])
+        self.assertEqual(patients[1].latest_peak, 51.0)  # newest frame beats the older named reading
+
+        _, response = self.query_count(filter_alerts='on')
+        self.assertEqual([p.id for p in response.context['patients']], [mine[0].id])
+
+    def test_keyset_pagination(self):
+        patients = self.add_patients(views.PATIENTS_PER_PAGE + 3)
+        _, first = self.query_count()
+        self.assertEqual(len(first.context['patients']), views.PATIENTS_PER_PAGE)
+        self.assertIsNone(first.context['previous_before'])
+        _, second = self.query_count(after=first.context['next_after'])
+        self.assertEqual([p.id for p in second.context['patients']], [p.id for p in patients[-3:]])
+        self.assertIsNone(second.context['next_after'])
+        _, back = self.query_count(before=second.context['previous_before'])
+        self.assertEqual([p.id for p in back.context['patients']], [p.id for p in first.context['patients']])
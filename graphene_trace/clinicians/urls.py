@@ -6,5 +6,7 @@ urlpatterns = [
     path('patient/<int:patient_id>/', views.patient_detail, name='patient_detail'),
     path('patient/<int:patient_id>/history/', views.patient_history, name='patient_history'),
     path('patient/<int:patient_id>/comments/', views.patient_comments, name='patient_comments'),
+    path('api/patient/<int:patient_id>/history/', views.patient_history_json, name='clinician_patient_history'),
     path('api/patient/<int:patient_id>/live-grid/', views.patient_live_grid_json, name='clinician_patient_live_grid'),
+    path('api/patient/<int:patient_id>/live-stream/', views.patient_live_stream, name='clinician_patient_live_stream'),
 ]
\ No newline at end of file
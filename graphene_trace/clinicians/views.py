@@ -1,26 +1,70 @@
-from django.shortcuts import render, get_object_or_404, redirect
+from django.shortcuts import render, get_object_or_404, aget_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.conf import settings
 from django.http import JsonResponse
-from patients.models import PressureData, Comment, Notification
+from django.db.models import Count, Exists, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from patients.models import PressureData, PressureFrame, Comment, Notification
 from django.contrib.auth import get_user_model
 from patients.forms import CommentForm
+from patients import cache as live_cache
+from patients.history import default_range, history, params_from_query
+from patients.rollups import summary
+from datetime import timedelta
+from patients.stream import stream_response
+from patients.wire import negotiate
 
 User = get_user_model()
 
+PATIENTS_PER_PAGE = 50
+
+
+def _latest(model, field):
+    # Correlated subquery: newest `field` of `model` for the outer patient (one index seek)
+    return Subquery(model.objects.filter(patient=OuterRef('pk')).order_by('-timestamp').values(field)[:1])
+
+
 @login_required
 def patient_list(request):
     if request.user.role != 'clinician':
         return render(request, '403.html')
     filter_alerts = request.GET.get('filter_alerts', False)
-    patients = User.objects.filter(role='patient')
+    unread = Notification.objects.filter(patient=OuterRef('pk'), is_read=False)
+    patients = request.user.assigned_patients.filter(role='patient').annotate(
+        alerts=Coalesce(Subquery(unread.order_by().values('patient').annotate(n=Count('pk')).values('n')), 0),
+        frame_at=_latest(PressureFrame, 'timestamp'),
+        frame_peak=_latest(PressureFrame, 'peak_value'),
+        reading_at=_latest(PressureData, 'timestamp'),
+        reading_value=_latest(PressureData, 'pressure_value'),
+    )
     if filter_alerts:
-        patients = patients.filter(notifications__is_read=False).distinct()
-    patients_with_alerts = []
-    for patient in patients:
-        alerts = Notification.objects.filter(patient=patient, is_read=False).count()
-        patients_with_alerts.append((patient, alerts))
-    return render(request, 'clinicians/patient_list.html', {'patients': patients_with_alerts, 'filter_alerts': filter_alerts})
+        patients = patients.filter(Exists(unread))
+
+    # Keyset pagination on id: ?after=<id> for the next page, ?before=<id> for the previous one
+    after, before = request.GET.get('after', ''), request.GET.get('before', '')
+    if before.isdigit():
+        page = list(patients.filter(id__lt=int(before)).order_by('-id')[:PATIENTS_PER_PAGE + 1])
+        has_previous, has_next = len(page) > PATIENTS_PER_PAGE, True
+        page = page[:PATIENTS_PER_PAGE][::-1]
+    else:
+        if after.isdigit():
+            patients = patients.filter(id__gt=int(after))
+        page = list(patients.order_by('id')[:PATIENTS_PER_PAGE + 1])
+        has_previous, has_next = after.isdigit(), len(page) > PATIENTS_PER_PAGE
+        page = page[:PATIENTS_PER_PAGE]
+
+    for patient in page:
+        # Latest reading is whichever of the newest frame / named-sensor reading is newer
+        if patient.frame_at and (patient.reading_at is None or patient.frame_at >= patient.reading_at):
+            patient.last_reading_at, patient.latest_peak = patient.frame_at, patient.frame_peak
+        else:
+            patient.last_reading_at, patient.latest_peak = patient.reading_at, patient.reading_value
+    return render(request, 'clinicians/patient_list.html', {
+        'patients': page,
+        'filter_alerts': filter_alerts,
+        'previous_before': page[0].id if has_previous and page else None,
+        'next_after': page[-1].id if has_next and page else None,
+    })
 
 @login_required
 def patient_detail(request, patient_id):
@@ -28,22 +72,36 @@ def patient_detail(request, patient_id):
         return render(request, '403.html')
     patient = get_object_or_404(User, id=patient_id, role='patient')
     recent_data = PressureData.objects.filter(patient=patient).order_by('-timestamp')[:50]
-    return render(request, 'clinicians/patient_detail.html', {'patient': patient, 'recent_data': recent_data})
+    # Per-sensor summary of the latest day of data, read from the hourly rollups
+    start, end = default_range(patient, timedelta(days=1))
+    return render(request, 'clinicians/patient_detail.html', {
+        'patient': patient,
+        'recent_data': recent_data,
+        'summary': summary(patient, start, end),
+        'summary_end': end,
+    })
 
 @login_required
 def patient_history(request, patient_id):
     if request.user.role != 'clinician':
         return render(request, '403.html')
     patient = get_object_or_404(User, id=patient_id, role='patient')
+    # The chart loads its range from patient_history_json; this lists the latest rows
     data = PressureData.objects.filter(patient=patient).order_by('-timestamp')[:100]
-    labels = [d.timestamp.strftime('%Y-%m-%d %H:%M') for d in reversed(data)]
-    values = [d.pressure_value for d in reversed(data)]
-    return render(request, 'clinicians/patient_history.html', {
-        'patient': patient,
-        'data': data,
-        'labels': labels,
-        'values': values,
-    })
+    return render(request, 'clinicians/patient_history.html', {'patient': patient, 'data': data})
+
+
+@login_required
+def patient_history_json(request, patient_id):
+    # Clinician API: downsampled pressure history over ?start=&end=
+    if request.user.role != 'clinician':
+        return JsonResponse({'error': 'forbidden'}, status=403)
+    patient = get_object_or_404(User, id=patient_id, role='patient')
+    try:
+        params = params_from_query(request.GET, patient)
+    except ValueError as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+    return JsonResponse(history(patient, **params))
 
 @login_required
 def patient_comments(request, patient_id):
@@ -70,65 +128,19 @@ def patient_live_grid_json(request, patient_id):
     # Clinician API: return latest grid for patient
     if request.user.role != 'clinician':
         return JsonResponse({'error': 'forbidden'}, status=403)
-    patient = get_object_or_404(User, id=patient_id, role='patient')
-    latest = PressureData.objects.filter(patient=patient).order_by('-timestamp').values_list('timestamp', flat=True).first()
-    if not latest:
-        return JsonResponse({'cells': []})
-    rows = PressureData.objects.filter(patient=patient, timestamp=latest)
-    cells = []
-    import re
-    coord_re = re.compile(r'^r(\d+)_c(\d+)$')
-    for p in rows:
-        m = coord_re.match(p.sensor_location)
-        if m:
-            r = int(m.group(1))
-            c = int(m.group(2))
-            cells.append({'r': r, 'c': c, 'value': p.pressure_value})
-        else:
-            cells.append({'label': p.sensor_location, 'value': p.pressure_value})
-    return JsonResponse({'cells': cells, 'timestamp': latest.isoformat()})
-    # Simple repositioning heuristic similar to patient endpoint
-    reposition = None
-    try:
-        recent_timestamps = PressureData.objects.filter(patient=patient).order_by('-timestamp').values_list('timestamp', flat=True).distinct()[:3]
-        top_locations = []
-        for ts in recent_timestamps:
-            rows_ts = PressureData.objects.filter(patient=patient, timestamp=ts)
-            if not rows_ts:
-                continue
-            top = max(rows_ts, key=lambda p: p.pressure_value)
-            top_locations.append(top.sensor_location)
-        if top_locations:
-            from collections import Counter
-            cnt = Counter(top_locations)
-            loc, count = cnt.most_common(1)[0]
-            current_top = max(rows, key=lambda p: p.pressure_value)
-            if count >= 2 and current_top.pressure_value > 80:
-                import re
-                coord_re = re.compile(r'^r(\d+)_c(\d+)$')
-                numeric_cells = [p for p in rows if coord_re.match(p.sensor_location)]
-                if numeric_cells:
-                    maxC = max([int(coord_re.match(p.sensor_location).group(2)) for p in numeric_cells])
-                    mm = coord_re.match(loc)
-                    if mm:
-                        col = int(mm.group(2))
-                        if col < (maxC / 2.0):
-                            action = 'roll_right'
-                            message = f"Suggest roll to the right — persistent high pressure at {loc}"
-                        elif col > (maxC / 2.0):
-                            action = 'roll_left'
-                            message = f"Suggest roll to the left — persistent high pressure at {loc}"
-                        else:
-                            action = 'adjust_position'
-                            message = f"Suggest adjust position — persistent high pressure at {loc}"
-                    else:
-                        action = 'adjust_position'
-                        message = f"Suggest adjust position — persistent high pressure at {loc}"
-                else:
-                    action = 'adjust_position'
-                    message = f"Suggest adjust position — persistent high pressure at {loc}"
-                reposition = {'action': action, 'reason': message, 'location': loc, 'confidence': round(min(0.95, 0.5 + (count-1)*0.2), 2)}
-    except Exception:
-        reposition = None
-
-    return JsonResponse({'cells': cells, 'timestamp': latest.isoformat(), 'reposition': reposition})
+    fmt = negotiate(request)
+    entry = live_cache.peek('grid', patient_id, fmt)
+    if entry is None:
+        patient = get_object_or_404(User, id=patient_id, role='patient')
+        entry = live_cache.get('grid', patient, fmt)
+    return live_cache.respond(request, entry)
+
+
+@login_required
+async def patient_live_stream(request, patient_id):
+    # Clinician API: Server-Sent Events stream of a patient's live grid/series
+    user = await request.auser()
+    if user.role != 'clinician':
+        return JsonResponse({'error': 'forbidden'}, status=403)
+    patient = await aget_object_or_404(User, id=patient_id, role='patient')
+    return stream_response(request, patient)
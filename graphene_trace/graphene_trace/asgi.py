@@ -14,3 +14,19 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'graphene_trace.settings')
 
 application = get_asgi_application()
+
+# The live dashboards stream over Server-Sent Events (patients/stream.py),
+# which needs an ASGI server, e.g. `uvicorn graphene_trace.asgi:application`.
+# Serve static files here too in development, as runserver would.
+from django.conf import settings  # noqa: E402
+
+if settings.DEBUG:
+    from django.contrib.staticfiles.handlers import ASGIStaticFilesHandler
+
+    application = ASGIStaticFilesHandler(application)
+
+# Run queued and orphaned CSV imports in this process (patients/jobs.py)
+if settings.IMPORT_IN_PROCESS:
+    from patients import jobs
+
+    jobs.start_worker()
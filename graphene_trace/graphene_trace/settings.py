@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -47,6 +48,7 @@ INSTALLED_APPS = [
 AUTH_USER_MODEL = 'users.User'
 
 MIDDLEWARE = [
+    'patients.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -54,6 +56,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'patients.profiling.ProfilingMiddleware',  # last, so it wraps only the view
 ]
 
 ROOT_URLCONF = 'graphene_trace.urls'
@@ -78,19 +81,158 @@ WSGI_APPLICATION = 'graphene_trace.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
-
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-        'OPTIONS': {
-            'timeout': 20,  # Increase timeout to 20 seconds 
-        },               
+# GRAPHENE_DB picks the profile:
+#   sqlite        (default) WAL journal plus SQLITE_PRAGMAS, applied to every
+#                 new connection by patients/db.py; connections are reused
+#   sqlite-plain  stock rollback-journal SQLite, for comparison
+#   postgres      psycopg 3 with Django's connection pool; imports use COPY.
+#                 Needs `pip install "psycopg[binary,pool]"` and
+#                 GRAPHENE_DB_NAME/_USER/_PASSWORD/_HOST/_PORT.
+
+DATABASE_PROFILE = os.environ.get('GRAPHENE_DB', 'sqlite')
+
+if DATABASE_PROFILE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('GRAPHENE_DB_NAME', 'graphene_trace'),
+            'USER': os.environ.get('GRAPHENE_DB_USER', ''),
+            'PASSWORD': os.environ.get('GRAPHENE_DB_PASSWORD', ''),
+            'HOST': os.environ.get('GRAPHENE_DB_HOST', ''),
+            'PORT': os.environ.get('GRAPHENE_DB_PORT', ''),
+            'OPTIONS': {
+                # The pool replaces persistent connections (CONN_MAX_AGE must stay 0)
+                'pool': {'min_size': 2, 'max_size': int(os.environ.get('GRAPHENE_DB_POOL', 10))},
+            },
+        }
+    }
+    SQLITE_PRAGMAS = {}
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {
+                'timeout': 20,  # Increase timeout to 20 seconds
+            },
+        }
     }
+    if DATABASE_PROFILE == 'sqlite-plain':
+        SQLITE_PRAGMAS = {'journal_mode': 'DELETE'}
+    else:
+        DATABASES['default'].update(CONN_MAX_AGE=600, CONN_HEALTH_CHECKS=True)
+        # Writers take the write lock when their transaction begins, so they
+        # wait out `timeout` instead of failing with "database is locked"
+        DATABASES['default']['OPTIONS']['transaction_mode'] = 'IMMEDIATE'
+        SQLITE_PRAGMAS = {
+            'journal_mode': 'WAL',  # readers and the writer don't block each other
+            'synchronous': 'NORMAL',  # durable with WAL; fsync at checkpoints only
+            'mmap_size': 256 * 2**20,
+            'cache_size': -64 * 1024,  # negative = KiB, so 64 MiB per connection
+            'temp_store': 'MEMORY',
+        }
+
+# Sessions
+# Sessions are stored in the database with a copy in the 'sessions' cache:
+# in memory by default, or in Redis, shared by every process, when
+# GRAPHENE_REDIS_URL is set (see Caches below). With the in-memory cache a
+# logout only reaches the other processes once the session expires, so
+# multi-process deployments should set GRAPHENE_REDIS_URL. users/middleware.py
+# keeps logged-in users in memory for USER_CACHE_TIMEOUT seconds. A live poll
+# therefore reads no file and runs no session or auth query.
+# GRAPHENE_SESSIONS=file restores file sessions and uncached users.
+
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+SESSION_CACHE_ALIAS = 'sessions'
+SESSION_FILE_PATH = BASE_DIR / "session_data"
+USER_CACHE_TIMEOUT = 30  # seconds
+USER_CACHE_MAX = 10000
+
+if os.environ.get('GRAPHENE_SESSIONS') == 'file':
+    SESSION_ENGINE = 'django.contrib.sessions.backends.file'
+else:
+    MIDDLEWARE[MIDDLEWARE.index('django.contrib.auth.middleware.AuthenticationMiddleware')] = (
+        'users.middleware.CachedAuthenticationMiddleware'
+    )
+
+# Metrics
+# patients.metrics times every request per view (wall and database time,
+# queries, response size, cache hits) and serves the totals to admins at
+# /accounts/metrics/ as JSON or Prometheus text. Requests slower than
+# METRICS_SLOW_REQUEST_MS log their slowest queries. GRAPHENE_METRICS=off
+# removes the middleware.
+
+METRICS_SLOW_REQUEST_MS = 500
+METRICS_SLOW_QUERIES = 5  # queries logged per slow request
+METRICS_SLOW_SAMPLES = 50  # slow requests kept for the metrics page
+
+if os.environ.get('GRAPHENE_METRICS') == 'off':
+    MIDDLEWARE.remove('patients.metrics.MetricsMiddleware')
+
+# Profiling
+# Admins can have matching requests (by URL name/path and/or user) run under
+# cProfile from /accounts/profiles/, or send PROFILE_HEADER with the token
+# shown there. Profiles are saved in PROFILE_DIR (see patients/profiling.py).
+
+PROFILE_DIR = BASE_DIR / 'profiles'
+PROFILE_HEADER = 'X-Graphene-Profile'
+PROFILE_TOKEN_MAX_AGE = 3600  # seconds a header token stays valid
+PROFILE_RULES_TTL = 5  # seconds each process caches the active rules
+
+# Caches
+# The 'live' cache holds the per-patient live grid/graph payloads (see
+# patients/cache.py). It is in memory by default. Every process that writes
+# frames (web workers, run_import_worker, run_device_gateway) invalidates it,
+# so when those are separate processes it must be shared:
+# GRAPHENE_LIVE_CACHE=file keeps it in files under CACHE_DIR, and
+# GRAPHENE_REDIS_URL puts it (and the 'sessions' cache) in Redis.
+
+CACHE_DIR = Path(os.environ.get('GRAPHENE_CACHE_DIR', BASE_DIR / 'cache_data'))
+REDIS_URL = os.environ.get('GRAPHENE_REDIS_URL')
+LIVE_CACHE_BACKEND = os.environ.get('GRAPHENE_LIVE_CACHE') or ('redis' if REDIS_URL else 'locmem')
+
+
+def _cache(name, backend, **options):
+    if backend == 'redis':
+        return {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': REDIS_URL, 'KEY_PREFIX': name, **options}
+    if backend == 'file':
+        return {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': CACHE_DIR / name, **options}
+    return {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': f'graphene-trace-{name}', **options}
+
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'graphene-trace',
+    },
+    'live': _cache('live', LIVE_CACHE_BACKEND, OPTIONS={'MAX_ENTRIES': 50000}),  # 5 per patient (see patients/cache.py)
+    # One per signed-in browser; never file-backed, which would put every poll back on disk
+    'sessions': _cache('sessions', 'redis' if REDIS_URL else 'locmem', OPTIONS={'MAX_ENTRIES': 10000}),
 }
 
-SESSION_ENGINE = 'django.contrib.sessions.backends.file'
-SESSION_FILE_PATH = BASE_DIR / "session_data"
+LIVE_CACHE_ALIAS = 'live'
+LIVE_CACHE_TIMEOUT = 300  # seconds; ingest invalidates entries before this
+
+# Bedside devices push binary frame records to /api/frames/ with a bearer
+# token (see patients/devices.py; tokens are issued by `manage.py add_device`).
+DEVICE_MAX_REQUEST_BYTES = 16 * 1024 * 1024
+DEVICE_MAX_CELLS = 256 * 256  # largest mat accepted
+DEVICE_CLOCK_SKEW = 300  # seconds a frame's timestamp may be ahead of the server
+
+# Hubs can instead stream frames over TCP to `manage.py run_device_gateway`
+# (patients/gateway.py), which writes them in micro-batches.
+GATEWAY_HOST = '127.0.0.1'
+GATEWAY_PORT = 9750
+GATEWAY_BATCH_FRAMES = 500  # most frames written per transaction
+GATEWAY_BATCH_DELAY = 0.05  # seconds a batch waits to fill after its first frame
+GATEWAY_QUEUE_FRAMES = 5000  # frames queued before connections stop being read
+
+# CSV uploads are spooled here and imported in the background (patients.jobs).
+# By default a thread in the web process runs them; with
+# GRAPHENE_IMPORT_WORKER=command they wait for `manage.py run_import_worker`.
+IMPORT_SPOOL_DIR = BASE_DIR / 'import_spool'
+IMPORT_IN_PROCESS = os.environ.get('GRAPHENE_IMPORT_WORKER', 'thread') != 'command'
+IMPORT_JOB_TIMEOUT = 600  # seconds without progress before a running job is requeued
 
 
 # Password validation
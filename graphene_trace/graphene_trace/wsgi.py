@@ -14,3 +14,11 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'graphene_trace.settings')
 
 application = get_wsgi_application()
+
+# Run queued and orphaned CSV imports in this process (patients/jobs.py)
+from django.conf import settings  # noqa: E402
+
+if settings.IMPORT_IN_PROCESS:
+    from patients import jobs
+
+    jobs.start_worker()
@@ -1,6 +1,10 @@
 from django.contrib import admin
-from .models import PressureData, Comment, Notification
+from .models import AlertEmail, Device, ImportJob, PressureData, PressureFrame, Comment, Notification
 
 admin.site.register(PressureData)
+admin.site.register(PressureFrame)
 admin.site.register(Comment)
 admin.site.register(Notification)
+admin.site.register(AlertEmail)
+admin.site.register(ImportJob)
+admin.site.register(Device)
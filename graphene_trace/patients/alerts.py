@@ -0,0 +1,110 @@
+"""
+High-pressure alerts, evaluated once per ingested batch.
+
+Readings that share a timestamp form one event: a frame, or the named
+sensors uploaded together. An event above THRESHOLD raises at most one
+Notification. The notification names the peak and says how many cells or
+sensors were above the threshold.
+
+A patient is alerted at most once per COOLDOWN of reading time. Events
+inside an earlier alert's window are folded into it, so a run of bad frames
+produces one notification rather than hundreds. Each notification is queued
+for email in the outbox (patients.outbox).
+"""
+from bisect import bisect_left, insort
+from collections import defaultdict
+from datetime import timedelta
+
+import numpy as np
+from django.contrib.auth import get_user_model
+
+from .frames import DTYPE
+from . import outbox
+from .models import Notification, PressureFrame
+
+THRESHOLD = 100  # mmHg
+COOLDOWN = timedelta(minutes=5)
+
+
+def _frame_events(frames):
+    # The stored peak rules most frames out without touching the grid
+    candidates = defaultdict(list)
+    for frame in frames:
+        if frame.peak_value is not None and frame.peak_value > THRESHOLD:
+            candidates[(frame.rows, frame.cols)].append(frame)
+    events = []
+    for (rows, cols), group in candidates.items():
+        grids = np.frombuffer(b''.join(bytes(f.data) for f in group), dtype=DTYPE).reshape(len(group), rows * cols)
+        above = np.count_nonzero(grids > THRESHOLD, axis=1)  # NaN (no reading) compares False
+        for frame, count in zip(group, above.tolist()):
+            events.append((frame.patient_id, frame.timestamp, frame.peak_value, frame.peak_location, count, 'cells'))
+    return events
+
+
+def _reading_events(readings):
+    values = np.fromiter((r.pressure_value for r in readings), dtype=np.float64, count=len(readings))
+    groups = defaultdict(list)
+    for i in np.flatnonzero(values > THRESHOLD).tolist():
+        groups[(readings[i].patient_id, readings[i].timestamp)].append(readings[i])
+    events = []
+    for (patient_id, timestamp), group in groups.items():
+        peak = max(group, key=lambda r: r.pressure_value)
+        events.append((patient_id, timestamp, peak.pressure_value, peak.sensor_location, len(group), 'sensors'))
+    return events
+
+
+def _message(peak, location, count, unit, folded):
+    message = f"High pressure detected at {location}: {round(float(peak), 1)} ({count} {unit} above {THRESHOLD} mmHg)"
+    if folded:
+        minutes = int(COOLDOWN.total_seconds() // 60)
+        message += f"; {folded} more high-pressure readings within {minutes} minutes"
+    return message
+
+
+def evaluate(sender, instances):
+    """
+    Raise coalesced alerts for newly created PressureData or PressureFrame rows.
+
+    Returns the Notifications created.
+    """
+    events = _frame_events(instances) if sender is PressureFrame else _reading_events(instances)
+    if not events:
+        return []
+    by_patient = defaultdict(list)
+    for event in events:
+        by_patient[event[0]].append(event)
+
+    created = []
+    for patient_id, patient_events in by_patient.items():
+        patient_events.sort(key=lambda e: e[1])
+        # Alerts already raised near this batch, in reading time
+        anchors = sorted(Notification.objects.filter(
+            patient_id=patient_id,
+            reading_timestamp__gte=patient_events[0][1] - COOLDOWN,
+            reading_timestamp__lte=patient_events[-1][1] + COOLDOWN,
+        ).values_list('reading_timestamp', flat=True))
+        batch = {}  # anchor timestamp -> [event, folded count] for alerts raised here
+        for event in patient_events:
+            timestamp = event[1]
+            i = bisect_left(anchors, timestamp)
+            near = [a for a in anchors[max(i - 1, 0):i + 1] if abs(a - timestamp) < COOLDOWN]
+            if not near:
+                insort(anchors, timestamp)
+                batch[timestamp] = [event, 0]
+            elif near[0] in batch:
+                batch[near[0]][1] += 1
+        for timestamp, (event, folded) in sorted(batch.items()):
+            _, _, peak, location, count, unit = event
+            created.append(Notification(
+                patient_id=patient_id,
+                reading_timestamp=timestamp,
+                message=_message(peak, location, count, unit, folded),
+            ))
+
+    if not created:
+        return []
+    Notification.objects.bulk_create(created)
+    # Emails go through the outbox so ingest never waits on the mail server
+    emails = dict(get_user_model().objects.filter(id__in=by_patient).exclude(email='').values_list('id', 'email'))
+    outbox.enqueue(created, emails)
+    return created
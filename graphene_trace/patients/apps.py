@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class PatientsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'patients'
+
+    def ready(self):
+        from .db import apply_sqlite_pragmas
+        from .metrics import instrument
+        connection_created.connect(apply_sqlite_pragmas, dispatch_uid='patients.sqlite_pragmas')
+        connection_created.connect(instrument, dispatch_uid='patients.metrics')
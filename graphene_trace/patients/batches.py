@@ -0,0 +1,98 @@
+"""
+Undoing upload batches (see UploadBatch).
+
+Rows are deleted a chunk at a time, one short transaction each, so live
+polls and ingest keep running during a large undo. `manage.py undo_upload`
+and the import job queue (patients.jobs, for a crashed import's partial
+batch) both go through undo().
+
+Frames and named readings that other uploads also wrote carry one layer per
+upload (FrameLayer, ReadingLayer). Those are not deleted: the batch's layer
+is dropped and the rest are stacked again, so the other uploads' data stays.
+"""
+import time
+from functools import reduce
+
+from django.db import transaction
+from django.db.models import Max, Min
+
+from . import cache as live_cache
+from . import reposition, rollups
+from .frames import overlay
+from .models import FrameLayer, PressureData, PressureFrame, ReadingLayer
+
+CHUNK_SIZE = 5000
+
+
+def delete_in_chunks(qs, chunk_size=CHUNK_SIZE, pause=0.0):
+    """
+    Delete the rows of a queryset chunk_size at a time, one short transaction each.
+
+    The write lock is released between chunks (and held off for `pause`
+    seconds), so live polls and ingest keep running during a large undo.
+    """
+    deleted = 0
+    while True:
+        ids = list(qs.order_by().values_list('id', flat=True)[:chunk_size])
+        if not ids:
+            return deleted
+        with transaction.atomic():
+            qs.model.objects.filter(id__in=ids).delete()
+        deleted += len(ids)
+        if pause:
+            time.sleep(pause)
+
+
+def _restack(batch, chunk_size=CHUNK_SIZE):
+    """Take a batch's layers off the frames and readings it shares; returns (frames, readings) restacked."""
+    frames = []
+    ids = list(FrameLayer.objects.filter(batch=batch).values_list('frame_id', flat=True).distinct())
+    for i in range(0, len(ids), chunk_size):
+        with transaction.atomic():
+            FrameLayer.objects.filter(batch=batch, frame_id__in=ids[i:i + chunk_size]).delete()
+            chunk = list(PressureFrame.objects.filter(id__in=ids[i:i + chunk_size]).prefetch_related('layers'))
+            for frame in chunk:
+                layers = sorted(frame.layers.all(), key=lambda layer: layer.pk)
+                update = PressureFrame.from_grid(None, frame.timestamp, reduce(overlay, [layer.grid for layer in layers]))
+                for name in ('rows', 'cols', 'data', 'peak_value', 'peak_location'):
+                    setattr(frame, name, getattr(update, name))
+                frame.batch_id = layers[0].batch_id
+                if len(layers) == 1:
+                    layers[0].delete()  # back to a single upload's frame
+            PressureFrame.objects.bulk_update(chunk, ['rows', 'cols', 'data', 'peak_value', 'peak_location', 'batch'])
+        frames += chunk
+    readings = []
+    ids = list(ReadingLayer.objects.filter(batch=batch).values_list('reading_id', flat=True).distinct())
+    for i in range(0, len(ids), chunk_size):
+        with transaction.atomic():
+            ReadingLayer.objects.filter(batch=batch, reading_id__in=ids[i:i + chunk_size]).delete()
+            chunk = list(PressureData.objects.filter(id__in=ids[i:i + chunk_size]).prefetch_related('layers'))
+            for reading in chunk:
+                layers = sorted(reading.layers.all(), key=lambda layer: layer.pk)
+                reading.pressure_value = layers[-1].pressure_value
+                reading.batch_id = layers[0].batch_id
+                if len(layers) == 1:
+                    layers[0].delete()
+            PressureData.objects.bulk_update(chunk, ['pressure_value', 'batch'])
+        readings += chunk
+    return frames, readings
+
+
+def undo(batch, chunk_size=CHUNK_SIZE, pause=0.0):
+    """Delete a batch's readings and frames, then the batch; returns (readings, frames) deleted."""
+    restacked_frames, restacked_readings = _restack(batch, chunk_size)
+    bounds = [
+        b for model in (PressureData, PressureFrame)
+        for b in model.objects.filter(batch=batch).aggregate(first=Min('timestamp'), last=Max('timestamp')).values()
+        if b is not None
+    ] + [row.timestamp for row in restacked_frames + restacked_readings]
+    readings = delete_in_chunks(PressureData.objects.filter(batch=batch), chunk_size, pause)
+    frames = delete_in_chunks(PressureFrame.objects.filter(batch=batch), chunk_size, pause)
+    if bounds:
+        rollups.rebuild(batch.patient, min(bounds), max(bounds))
+    if frames or restacked_frames:
+        # The suggestion may rest on the deleted or restacked frames
+        reposition.rebuild(batch.patient)
+    live_cache.invalidate(batch.patient_id)
+    batch.delete()
+    return readings, frames
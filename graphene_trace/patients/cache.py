@@ -0,0 +1,116 @@
+"""
+Per-patient cache of the live grid and graph payloads.
+
+An entry holds the serialised payload plus its ETag and Last-Modified values.
+It is built on the first poll after an ingest and dropped by the post_save
+receivers in patients.models, so a poll with unchanged data is one cache
+lookup and, when the client sends a matching If-None-Match, a 304.
+
+Each payload is cached as JSON and, for clients that ask for it, in the
+binary format of patients.wire.
+
+Every invalidation also stores a fresh change marker for the patient, which
+live-stream watchers in other processes compare (see patients.stream).
+"""
+import hashlib
+import json
+import secrets
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+from . import metrics, wire
+from .live import latest_grid, recent_series
+from .reposition import current_suggestion
+
+KINDS = ('grid', 'series')
+
+
+def _cache():
+    return caches[settings.LIVE_CACHE_ALIAS]
+
+
+def _key(kind, patient_id, fmt='json'):
+    return f'live:{kind}:{fmt}:{patient_id}'
+
+
+def _version_key(patient_id):
+    return f'live:version:{patient_id}'
+
+
+def _build_grid(patient, fmt):
+    latest, cells, frame = latest_grid(patient, with_cells=fmt == 'json')
+    reposition = current_suggestion(patient) if frame is not None else None
+    if fmt == 'binary':
+        return latest, wire.encode_grid(latest, frame, cells, reposition)
+    if not latest:
+        return None, json.dumps({'cells': []}).encode()
+    return latest, json.dumps({'cells': cells, 'timestamp': latest.isoformat(), 'reposition': reposition}).encode()
+
+
+def _build_series(patient, fmt):
+    points = recent_series(patient)
+    latest = points[-1][0] if points else None
+    if fmt == 'binary':
+        return latest, wire.encode_series(points)
+    return latest, json.dumps({'data': [{'timestamp': ts.isoformat(), 'value': value} for ts, value in points]}).encode()
+
+
+BUILDERS = {'grid': _build_grid, 'series': _build_series}
+CONTENT_TYPES = {'json': 'application/json', 'binary': wire.CONTENT_TYPE}
+
+
+def peek(kind, patient_id, fmt='json'):
+    """Return the cached entry for a patient, or None."""
+    return _cache().get(_key(kind, patient_id, fmt))
+
+
+def get(kind, patient, fmt='json'):
+    """Return the cached entry for a patient, building it on a miss."""
+    entry = peek(kind, patient.pk, fmt)
+    metrics.count_cache('live', entry is not None)
+    if entry is None:
+        latest, content = BUILDERS[kind](patient, fmt)
+        entry = {
+            'content': content,
+            'content_type': CONTENT_TYPES[fmt],
+            'etag': f'"{kind}-{fmt}-{hashlib.md5(content).hexdigest()}"',
+            'last_modified': int(latest.timestamp()) if latest else None,
+        }
+        _cache().set(_key(kind, patient.pk, fmt), entry, settings.LIVE_CACHE_TIMEOUT)
+    return entry
+
+
+def versions(patient_ids):
+    """Return {patient id: change marker}; None for patients not written since the cache was cleared."""
+    found = _cache().get_many([_version_key(pid) for pid in patient_ids])
+    return {pid: found.get(_version_key(pid)) for pid in patient_ids}
+
+
+def invalidate(patient_id):
+    """Drop a patient's entries, mark them changed and wake their open live streams."""
+    # A random marker rather than a counter: concurrent writers can't lose an update
+    marker = secrets.token_hex(8)
+    cache = _cache()
+    cache.delete_many([_key(kind, patient_id, fmt) for kind in KINDS for fmt in wire.FORMATS])
+    cache.set(_version_key(patient_id), marker, None)
+    from .stream import hub
+    hub.publish(patient_id, marker)
+
+
+def respond(request, entry):
+    """Return a 304 if the client's copy is current, else the cached payload."""
+    response = get_conditional_response(request, etag=entry['etag'], last_modified=entry['last_modified'])
+    if response is None:
+        response = HttpResponse(entry['content'], content_type=entry['content_type'])
+    response.headers['ETag'] = entry['etag']
+    patch_vary_headers(response, ['Accept'])
+    if entry['last_modified'] is not None:
+        response.headers['Last-Modified'] = http_date(entry['last_modified'])
+    # Always revalidate: data timestamps can be old, which would otherwise
+    # let browsers heuristically cache a live payload.
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
@@ -0,0 +1,17 @@
+"""
+Per-connection database tuning.
+
+SQLite keeps most settings per connection, so settings.SQLITE_PRAGMAS are
+applied by a connection_created receiver (connected in PatientsConfig.ready)
+whenever Django opens a connection. journal_mode=WAL is stored in the
+database file and only has to win once.
+"""
+from django.conf import settings
+
+
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            cursor.execute(f'PRAGMA {name} = {value}')
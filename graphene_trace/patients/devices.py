@@ -0,0 +1,140 @@
+"""
+Frame ingest from bedside devices.
+
+A device authenticates with `Authorization: Bearer <token>`; only the token's
+sha256 is stored (Device.token_hash), and it may send frames for the patients
+assigned to it. A request carries any number of frame records
+(patients.wire.decode_frames). Each frame is checked with array operations,
+then the accepted ones are written in one transaction: bulk_create, plus the
+rollups/alerts (ingest.record) and reposition state the post_save receivers
+would have updated. Each patient's live cache is invalidated once afterwards.
+The HTTP view and the TCP gateway (patients.gateway) both write through here.
+
+Every frame gets an acknowledgement, in request order:
+{'status': 'stored', 'id': ...}, {'status': 'duplicate', 'id': ...} for a
+patient and timestamp that already have a frame (so a device can safely
+resend after a timeout), or {'status': 'rejected', 'error': ...}.
+"""
+import hashlib
+import secrets
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import cache as live_cache
+from . import ingest, reposition
+from .models import Device, PressureFrame
+
+
+def hash_token(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def issue_token(device):
+    """Give a device a new token and return it; only its hash is kept, so show it once."""
+    token = secrets.token_urlsafe(32)
+    device.token_hash = hash_token(token)
+    return token
+
+
+def device_for_token(token):
+    """Return the active Device with this token, or None."""
+    if not token:
+        return None
+    return Device.objects.filter(token_hash=hash_token(token), is_active=True).first()
+
+
+def authenticate(request):
+    """Return the active Device named by the request's bearer token, or None."""
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer':
+        return None
+    return device_for_token(token.strip())
+
+
+def allowed_patients(device):
+    return set(device.patients.values_list('id', flat=True))
+
+
+def check(grid, timestamp, latest):
+    """Return why a frame can't be stored, or None."""
+    if grid.size == 0 or grid.size > settings.DEVICE_MAX_CELLS:
+        return f'mat must have 1 to {settings.DEVICE_MAX_CELLS} cells'
+    if np.isinf(grid).any():
+        return 'cells must be finite or NaN'
+    if (grid < 0).any():
+        return 'cells must not be negative'
+    if np.isnan(grid).all():
+        return 'frame has no readings'
+    if timestamp > latest:
+        return 'timestamp is in the future'
+    return None
+
+
+def store(records, allowed):
+    """
+    Validate and save decoded (patient id, epoch ms, grid) records; return one ack per record.
+
+    `allowed` is the set of patient ids the sender may write for.
+    """
+    latest = timezone.now() + timedelta(seconds=settings.DEVICE_CLOCK_SKEW)
+    acks = [None] * len(records)
+    accepted = {}  # (patient id, timestamp) -> index of the first record for it
+    resent = []  # (index, index of the first record) for repeats within the request
+    for i, (patient_id, epoch_ms, grid) in enumerate(records):
+        if patient_id not in allowed:
+            acks[i] = {'status': 'rejected', 'error': 'patient is not assigned to this device'}
+            continue
+        try:
+            timestamp = datetime.fromtimestamp(epoch_ms / 1000, tz=dt_timezone.utc)
+        except (OverflowError, OSError, ValueError):
+            acks[i] = {'status': 'rejected', 'error': 'timestamp out of range'}
+            continue
+        error = check(grid, timestamp, latest)
+        if error:
+            acks[i] = {'status': 'rejected', 'error': error}
+        elif (patient_id, timestamp) in accepted:
+            resent.append((i, accepted[(patient_id, timestamp)]))
+        else:
+            accepted[(patient_id, timestamp)] = i
+    if not accepted:
+        return acks
+
+    existing = {
+        (patient_id, timestamp): pk
+        for patient_id, timestamp, pk in PressureFrame.objects.filter(
+            patient_id__in={p for p, _ in accepted}, timestamp__in={t for _, t in accepted},
+        ).values_list('patient_id', 'timestamp', 'id')
+    }
+    created = []
+    for key, i in accepted.items():
+        if key in existing:
+            acks[i] = {'status': 'duplicate', 'id': existing[key]}
+            continue
+        frame = PressureFrame.from_grid(None, key[1], records[i][2])
+        frame.patient_id = key[0]
+        created.append((i, frame))
+        acks[i] = {'status': 'stored'}
+    if created:
+        frames = [frame for _, frame in created]
+        by_patient = defaultdict(list)
+        for frame in frames:
+            by_patient[frame.patient_id].append(frame)
+        with transaction.atomic():
+            # bulk_create sends no post_save: do what the receivers would
+            PressureFrame.objects.bulk_create(frames)
+            ingest.record(PressureFrame, frames)
+            for patient_frames in by_patient.values():
+                for frame in sorted(patient_frames, key=lambda f: f.timestamp)[-reposition.WINDOW:]:
+                    reposition.observe(frame)
+        for i, frame in created:
+            acks[i]['id'] = frame.pk
+        for patient_id in by_patient:
+            live_cache.invalidate(patient_id)
+    for i, first in resent:
+        acks[i] = {'status': 'duplicate', 'id': acks[first]['id']}
+    return acks
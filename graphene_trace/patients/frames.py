@@ -0,0 +1,89 @@
+"""
+Helpers for packed pressure-mat frames.
+
+A frame is one full reading of the mat, stored as a row-major little-endian
+float32 buffer. Cells without a reading are NaN.
+"""
+import re
+
+import numpy as np
+
+COORD_RE = re.compile(r'^r(\d+)_c(\d+)$')
+DTYPE = np.dtype('<f4')
+# float32 readings are widened for JSON; round away the float32 noise
+# (12.3 -> 12.300000190734863) at a precision far below sensor resolution.
+DECIMALS = 3
+
+
+def parse_coord(sensor_location):
+    """Return (row, col) for an 'r{r}_c{c}' location, or None for named sensors."""
+    m = COORD_RE.match(sensor_location or '')
+    if not m:
+        return None
+    return int(m.group(1)), int(m.group(2))
+
+
+def coord_label(r, c):
+    return f"r{r}_c{c}"
+
+
+def pack(grid):
+    return np.ascontiguousarray(grid, dtype=DTYPE).tobytes()
+
+
+def unpack(data, rows, cols):
+    return np.frombuffer(bytes(data), dtype=DTYPE).reshape(rows, cols)
+
+
+def grid_from_cells(cells):
+    """Build a grid from (row, col, value) triples; missing cells are NaN."""
+    cells = list(cells)
+    if not cells:
+        return np.empty((0, 0), dtype=DTYPE)
+    rows = max(r for r, _, _ in cells) + 1
+    cols = max(c for _, c, _ in cells) + 1
+    grid = np.full((rows, cols), np.nan, dtype=DTYPE)
+    for r, c, value in cells:
+        grid[r, c] = value
+    return grid
+
+
+def grid_from_rows(rows):
+    """Build a grid from CSV matrix rows (lists of strings); blank or non-numeric cells are NaN."""
+    cells = []
+    for r_idx, row in enumerate(rows):
+        for c_idx, cell in enumerate(row):
+            cell = cell.strip()
+            if cell == '':
+                continue
+            try:
+                cells.append((r_idx, c_idx, float(cell)))
+            except ValueError:
+                continue
+    return grid_from_cells(cells)
+
+
+def overlay(old, new):
+    """Return `old` with the cells present in `new` written over it, grown to fit both."""
+    merged = np.full((max(old.shape[0], new.shape[0]), max(old.shape[1], new.shape[1])), np.nan, dtype=DTYPE)
+    merged[:old.shape[0], :old.shape[1]] = old
+    region = merged[:new.shape[0], :new.shape[1]]
+    filled = ~np.isnan(new)
+    region[filled] = new[filled]
+    return merged
+
+
+def grid_peak(grid):
+    """Return (value, 'r{r}_c{c}') of the highest reading, or (None, '') if the grid is empty."""
+    if grid.size == 0 or np.isnan(grid).all():
+        return None, ''
+    idx = int(np.nanargmax(grid))
+    r, c = divmod(idx, grid.shape[1])
+    return round(float(grid[r, c]), DECIMALS), coord_label(r, c)
+
+
+def grid_cells(grid):
+    """Serialise a grid as [{'r', 'c', 'value'}, ...], skipping NaN cells."""
+    rs, cs = np.nonzero(~np.isnan(grid))
+    values = np.round(grid[rs, cs].astype(np.float64), DECIMALS).tolist()
+    return [{'r': r, 'c': c, 'value': v} for r, c, v in zip(rs.tolist(), cs.tolist(), values)]
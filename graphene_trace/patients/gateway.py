@@ -0,0 +1,231 @@
+"""
+Asyncio TCP gateway for bedside hubs (manage.py run_device_gateway).
+
+Every message, in either direction, is a little-endian uint32 length followed
+by that many bytes:
+
+- The first client message is a device token (see patients.devices). The
+  gateway answers b'OK', or b'ERR <reason>' and closes the connection.
+- Every later client message is one frame record (patients.wire). Frames are
+  numbered from 0 on each connection.
+- The gateway answers with ack messages, each holding one ACK record (frame
+  number, status, frame id) per frame of that connection in a written batch.
+
+Frames from all connections go into one bounded queue. A single writer task
+takes micro-batches off it (up to batch_frames, or whatever arrives within
+batch_delay of the first) and saves each batch with devices.store on one
+database thread, so writes stay sequential on SQLite and PostgreSQL alike.
+When the writer falls behind, the queue fills and connection readers wait on
+it instead of reading their sockets, so TCP flow control slows the hubs down.
+
+devices.store invalidates each patient's entries in the live cache
+(settings.CACHES['live']). When that cache is shared (GRAPHENE_LIVE_CACHE=file
+or Redis), the live-stream watcher of every web process picks up the new
+frames (see patients.stream).
+"""
+import asyncio
+import logging
+import struct
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import devices, wire
+
+logger = logging.getLogger(__name__)
+
+LENGTH = struct.Struct('<I')
+ACK = struct.Struct('<IBq')  # frame number, status, frame id (0 when rejected)
+STORED, DUPLICATE, REJECTED = 0, 1, 2
+STATUS_CODES = {'stored': STORED, 'duplicate': DUPLICATE, 'rejected': REJECTED}
+MAX_TOKEN = 256
+ACK_BUFFER_LIMIT = 1 << 20  # unread ack bytes after which a connection is dropped
+SAMPLES = 10000  # recent batches kept for the latency percentiles
+
+
+def message(payload):
+    return LENGTH.pack(len(payload)) + payload
+
+
+async def read_message(reader, limit):
+    """Read one length-prefixed message; ValueError if it is longer than `limit`."""
+    (length,) = LENGTH.unpack(await reader.readexactly(LENGTH.size))
+    if length > limit:
+        raise ValueError(f'message of {length} bytes exceeds {limit}')
+    return await reader.readexactly(length)
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))], 2)
+
+
+def _in_db_thread(fn, args):
+    # Like a request: drop connections that have outlived CONN_MAX_AGE or failed
+    close_old_connections()
+    return fn(*args)
+
+
+class _Connection:
+    def __init__(self, writer, allowed):
+        self.writer = writer
+        self.allowed = allowed
+        self.next_frame = 0
+
+    def ack(self, records):
+        if self.writer.is_closing():
+            return
+        self.writer.write(message(b''.join(ACK.pack(*record) for record in records)))
+        if self.writer.transport.get_write_buffer_size() > ACK_BUFFER_LIMIT:
+            logger.warning('Dropping a device connection that does not read its acks')
+            self.writer.close()
+
+
+class Stats:
+    """Counters since start, plus recent batches for rates and percentiles."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.acks = dict.fromkeys(STATUS_CODES, 0)
+        self.batches = 0
+        self.connections = 0
+        self.stalls = 0  # frames that waited for room in the full queue
+        self.recent = deque(maxlen=SAMPLES)  # (finished at, frames, write seconds, max queue-to-ack seconds)
+
+    def record(self, frames, write_seconds, latency_seconds):
+        self.batches += 1
+        self.recent.append((time.monotonic(), frames, write_seconds, latency_seconds))
+
+    def report(self, queue_depth, window=10.0):
+        now = time.monotonic()
+        recent = [b for b in self.recent if b[0] >= now - window]
+        span = min(window, now - self.started) or 1.0
+        writes = [1000 * b[2] for b in recent]
+        latencies = [1000 * b[3] for b in recent]
+        return {
+            **self.acks,
+            'connections': self.connections,
+            'queue_depth': queue_depth,
+            'stalled_frames': self.stalls,
+            'batches': self.batches,
+            'frames_per_second': round(sum(b[1] for b in recent) / span, 1),
+            'mean_batch_frames': round(sum(b[1] for b in recent) / len(recent), 1) if recent else None,
+            'write_ms_p50': _percentile(writes, 50),
+            'write_ms_p99': _percentile(writes, 99),
+            'ack_latency_ms_p50': _percentile(latencies, 50),
+            'ack_latency_ms_p99': _percentile(latencies, 99),
+        }
+
+
+class Gateway:
+    def __init__(self, batch_frames=None, batch_delay=None, queue_frames=None):
+        self.batch_frames = batch_frames or settings.GATEWAY_BATCH_FRAMES
+        self.batch_delay = settings.GATEWAY_BATCH_DELAY if batch_delay is None else batch_delay
+        self.queue = asyncio.Queue(maxsize=queue_frames or settings.GATEWAY_QUEUE_FRAMES)
+        self.max_message = wire.FRAME_HEADER.size + settings.DEVICE_MAX_CELLS * wire.DTYPE.itemsize
+        self.stats = Stats()
+        self.server = None
+        self._db_thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix='gateway-db')
+        self._writer_task = None
+        self._handlers = {}  # connection task -> its stream writer
+
+    async def start(self, host, port):
+        """Start listening and writing; returns the asyncio server."""
+        self._writer_task = asyncio.create_task(self._write_batches())
+        self.server = await asyncio.start_server(self._serve, host, port)
+        return self.server
+
+    async def close(self):
+        """Stop accepting frames, write what is queued, then stop."""
+        self.server.close()
+        for writer in self._handlers.values():
+            writer.close()
+        # Readers end once their sockets close; queued frames are still written
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+        await self.server.wait_closed()
+        await self.queue.join()
+        self._writer_task.cancel()
+        self._db_thread.shutdown(wait=True)
+
+    def _db(self, fn, *args):
+        return asyncio.get_running_loop().run_in_executor(self._db_thread, _in_db_thread, fn, args)
+
+    async def _serve(self, reader, writer):
+        task = asyncio.current_task()
+        self._handlers[task] = writer
+        conn = None
+        try:
+            token = (await read_message(reader, MAX_TOKEN)).decode(errors='replace').strip()
+            device = await self._db(devices.device_for_token, token)
+            if device is None:
+                writer.write(message(b'ERR invalid device token'))
+                return
+            conn = _Connection(writer, await self._db(devices.allowed_patients, device))
+            self.stats.connections += 1
+            writer.write(message(b'OK'))
+            while True:
+                payload = await read_message(reader, self.max_message)
+                number = conn.next_frame
+                conn.next_frame += 1
+                try:
+                    records = wire.decode_frames(payload)
+                except ValueError:
+                    records = []
+                if len(records) != 1 or records[0][0] not in conn.allowed:
+                    self.stats.acks['rejected'] += 1
+                    conn.ack([(number, REJECTED, 0)])
+                    continue
+                if self.queue.full():
+                    self.stats.stalls += 1
+                await self.queue.put((conn, number, records[0], time.perf_counter()))
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass  # disconnected, or sent an oversized message
+        finally:
+            if conn is not None:
+                self.stats.connections -= 1
+            del self._handlers[task]
+            writer.close()
+
+    async def _next_batch(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.batch_delay
+        while len(batch) < self.batch_frames:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _write_batches(self):
+        while True:
+            batch = await self._next_batch()
+            records = [record for _, _, record, _ in batch]
+            began = time.perf_counter()
+            try:
+                # Readers only queue frames for their device's patients
+                acks = await self._db(devices.store, records, {record[0] for record in records})
+            except Exception:
+                logger.exception('Writing a batch of %d frames failed', len(batch))
+                acks = [{'status': 'rejected'}] * len(batch)
+            finished = time.perf_counter()
+            by_connection = defaultdict(list)
+            for (conn, number, _, _), ack in zip(batch, acks):
+                self.stats.acks[ack['status']] += 1
+                by_connection[conn].append((number, STATUS_CODES[ack['status']], ack.get('id') or 0))
+            for conn, records in by_connection.items():
+                conn.ack(records)
+            self.stats.record(len(batch), finished - began, finished - min(queued for _, _, _, queued in batch))
+            for _ in batch:
+                self.queue.task_done()
@@ -0,0 +1,223 @@
+"""
+Time-range pressure history, downsampled for charting.
+
+A night or a week of readings is far more points than a chart can draw, so
+the series is reduced server-side to at most `max_points` fixed-width time
+buckets. Each bucket keeps min/max/mean/count, so short pressure peaks
+survive the reduction (a plain average or every-Nth sample would hide them).
+Ranges that already fit are returned as raw points in the same shape.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import rollups
+from .frames import DECIMALS, DTYPE, parse_coord
+from .models import PressureData, PressureFrame
+
+DEFAULT_POINTS = 500
+MAX_POINTS = 2000
+MIN_POINTS = 10
+DEFAULT_SPAN = timedelta(days=1)
+CHUNK_SIZE = 5000
+# Out-of-range bounds are clamped to these; a day inside datetime's limits
+# leaves room for the bucket widening in rollups.load
+EARLIEST = datetime.min.replace(tzinfo=dt_timezone.utc) + timedelta(days=1)
+LATEST = datetime.max.replace(tzinfo=dt_timezone.utc) - timedelta(days=1)
+
+
+def _epoch(timestamps):
+    return np.fromiter((ts.timestamp() for ts in timestamps), dtype=np.float64)
+
+
+def _to_arrays(rows):
+    if not rows:
+        return np.empty(0), np.empty(0)
+    timestamps, values = zip(*rows)
+    return _epoch(timestamps), np.asarray(values, dtype=np.float64)
+
+
+def _cell_points(patient, start, end, row, col):
+    """Read one mat cell out of every frame in the range without unpacking whole grids."""
+    frames = (
+        PressureFrame.objects.filter(patient=patient, timestamp__gte=start, timestamp__lt=end, rows__gt=row, cols__gt=col)
+        .order_by('timestamp').values_list('timestamp', 'cols', 'data')
+    )
+    points = []
+    for timestamp, cols, data in frames.iterator(chunk_size=CHUNK_SIZE):
+        value = float(np.frombuffer(data, dtype=DTYPE, count=1, offset=(row * cols + col) * DTYPE.itemsize)[0])
+        if not np.isnan(value):  # NaN: cell not reported in this frame
+            points.append((timestamp, value))
+    return points
+
+
+def load_series(patient, start, end, sensor_location=None):
+    """
+    Return (epoch seconds, values) arrays for [start, end), oldest first.
+
+    Without a sensor_location each frame contributes its peak and every
+    named-sensor reading is included, matching the live graph. A grid label
+    ('r3_c4') reads that cell from each frame; any other label filters the
+    named-sensor readings.
+    """
+    readings = PressureData.objects.filter(patient=patient, timestamp__gte=start, timestamp__lt=end)
+    if sensor_location:
+        readings = readings.filter(sensor_location=sensor_location)
+    points = list(readings.order_by('timestamp').values_list('timestamp', 'pressure_value').iterator(chunk_size=CHUNK_SIZE))
+
+    coord = parse_coord(sensor_location) if sensor_location else None
+    if coord:
+        points += _cell_points(patient, start, end, *coord)
+    elif not sensor_location:
+        frames = PressureFrame.objects.filter(
+            patient=patient, timestamp__gte=start, timestamp__lt=end, peak_value__isnull=False,
+        )
+        points += list(frames.order_by('timestamp').values_list('timestamp', 'peak_value').iterator(chunk_size=CHUNK_SIZE))
+
+    ts, values = _to_arrays(points)
+    order = np.argsort(ts, kind='stable')
+    return ts[order], values[order]
+
+
+def _rebucket(ts, mins, maxs, sums, counts, start, end, max_points):
+    width = (end - start) / max_points
+    if not len(ts):
+        return width, ts, mins, maxs, sums, counts  # reduceat can't take an empty array
+    buckets = np.clip(((ts - start) // width).astype(np.int64), 0, max_points - 1)
+    # ts is sorted, so each non-empty bucket is one contiguous run of points
+    offsets = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    counts = np.add.reduceat(counts, offsets)
+    return (
+        width,
+        start + buckets[offsets] * width,
+        np.minimum.reduceat(mins, offsets),
+        np.maximum.reduceat(maxs, offsets),
+        np.add.reduceat(sums, offsets) / counts,
+        counts,
+    )
+
+
+def downsample(ts, values, start, end, max_points):
+    """
+    Reduce a sorted series to at most `max_points` buckets over [start, end).
+
+    Returns (bucket_seconds, t, min, max, mean, count) where t is the bucket
+    start in epoch seconds; empty buckets are dropped. bucket_seconds is 0 when
+    the series already fits and is returned point for point.
+    """
+    counts = np.ones(len(ts), dtype=np.int64)
+    if len(ts) <= max_points:
+        return 0, ts, values, values, values, counts
+    return _rebucket(ts, values, values, values, counts, start, end, max_points)
+
+
+def history(patient, start, end, max_points=DEFAULT_POINTS, sensor_location=None):
+    """
+    Return the JSON-ready downsampled history of a patient over [start, end).
+
+    When a chart bucket spans at least a minute the series is built from the
+    rollup tables (patients.rollups), so a week costs a few thousand rollup
+    rows instead of every raw reading. Single mat cells aren't rolled up and
+    always come from the frames.
+    """
+    bucket_seconds = (end - start).total_seconds() / max_points
+    model = None if parse_coord(sensor_location or '') else rollups.granularity_for(bucket_seconds)
+    if model is None:
+        source = 'raw'
+        ts, values = load_series(patient, start, end, sensor_location)
+        total = len(ts)
+        width, t, lo, hi, mean, count = downsample(ts, values, start.timestamp(), end.timestamp(), max_points)
+    else:
+        source = model._meta.model_name
+        ts, mins, maxs, sums, counts = rollups.load(model, patient, start, end, sensor_location)
+        total = int(counts.sum())
+        width, t, lo, hi, mean, count = _rebucket(ts, mins, maxs, sums, counts, start.timestamp(), end.timestamp(), max_points)
+    return {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'sensor_location': sensor_location or '',
+        'source': source,
+        'total': total,
+        'bucket_seconds': round(width, 3),
+        't': np.rint(t * 1000).astype(np.int64).tolist(),
+        'min': np.round(lo, DECIMALS).tolist(),
+        'max': np.round(hi, DECIMALS).tolist(),
+        'mean': np.round(mean, DECIMALS).tolist(),
+        'count': np.asarray(count).astype(np.int64).tolist(),
+    }
+
+
+def default_range(patient, span):
+    """Return (start, end) covering `span` up to the patient's newest reading."""
+    latest = [
+        ts for ts in (
+            PressureFrame.objects.filter(patient=patient).order_by('-timestamp').values_list('timestamp', flat=True).first(),
+            PressureData.objects.filter(patient=patient).order_by('-timestamp').values_list('timestamp', flat=True).first(),
+        ) if ts is not None
+    ]
+    end = max(latest) if latest else datetime.now(dt_timezone.utc)
+    # end is exclusive; nudge it past the newest reading so it is included
+    end = datetime.fromtimestamp(end.timestamp() + 0.001, dt_timezone.utc)
+    return end - span, end
+
+
+def _clamp(moment):
+    return min(max(moment, EARLIEST), LATEST)
+
+
+def _shift(moment, delta):
+    """moment + delta, clamped to [EARLIEST, LATEST]."""
+    try:
+        return _clamp(moment + delta)
+    except OverflowError:
+        return LATEST if delta > timedelta(0) else EARLIEST
+
+
+def _parse_time(value, name):
+    if value.lstrip('-').isdigit():
+        try:
+            return _clamp(datetime.fromtimestamp(int(value) / 1000, dt_timezone.utc))  # epoch milliseconds
+        except (OverflowError, OSError, ValueError):
+            # Beyond what datetime (or the platform's time functions) can represent
+            return EARLIEST if value.startswith('-') else LATEST
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(f'{name} must be an ISO 8601 datetime or epoch milliseconds')
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    try:
+        # In UTC, as the database stores it; an offset at year 1 or 9999 can overflow
+        return _clamp(parsed.astimezone(dt_timezone.utc))
+    except OverflowError:
+        return EARLIEST if parsed.year == datetime.min.year else LATEST
+
+
+def params_from_query(query, patient):
+    """
+    Validate history query parameters (start, end, max_points, sensor_location).
+
+    Missing bounds default to DEFAULT_SPAN around the given one, or ending at
+    the newest reading. Raises ValueError with a user-facing message.
+    """
+    start = _parse_time(query['start'], 'start') if query.get('start') else None
+    end = _parse_time(query['end'], 'end') if query.get('end') else None
+    if start is None and end is None:
+        start, end = default_range(patient, DEFAULT_SPAN)
+    elif start is None:
+        start = _shift(end, -DEFAULT_SPAN)
+    elif end is None:
+        end = _shift(start, DEFAULT_SPAN)
+    if end <= start:
+        raise ValueError('end must be after start')
+    try:
+        max_points = int(query.get('max_points', DEFAULT_POINTS))
+    except ValueError:
+        raise ValueError('max_points must be an integer')
+    return {
+        'start': start,
+        'end': end,
+        'max_points': min(max(max_points, MIN_POINTS), MAX_POINTS),
+        'sensor_location': query.get('sensor_location', '').strip() or None,
+    }
@@ -0,0 +1,693 @@
+"""
+Streaming CSV import shared by the upload view and `simulate_upload`.
+
+Two layouts are accepted:
+
+* header CSV with `sensor_location` and `pressure_value` columns. Named
+  sensors become PressureData rows; `r{r}_c{c}` cells are packed into one
+  PressureFrame. An optional `timestamp` (or `time`) column makes it a long
+  recording: rows are stamped with their own time and each run of rows
+  sharing a time is one frame.
+* headerless numeric matrix, one mat row per line, stored as one frame. A
+  recording stacks several matrices, each after a timestamp line
+  (`2024-05-01T08:00:00`, `08:00:00` or `# 1.5`).
+
+Times may be ISO datetimes, times of day on the upload date (rolling over
+midnight), or seconds after the upload timestamp.
+
+The file is read in CHUNK_BYTES pieces and each chunk is parsed as a whole:
+matrix blocks go through NumPy's C parser with blanks read as NaN, header
+rows are split and converted column-wise, and cell coordinates come from
+array indexing. Memory depends on the chunk and mat size, not on the file
+length or frame count.
+
+Named readings are inserted with executemany (COPY on PostgreSQL), one
+bounded transaction per chunk; frames are written FRAME_BATCH at a time.
+A reading or frame the patient already has at that sensor or time is
+replaced or merged instead of added again (see _Writer). Rollups and alerts
+run per chunk (patients.ingest), and the live cache is invalidated once at
+the end.
+
+parse_file and write_parsed split the same import in two, so `bulk_ingest`
+can parse in worker processes and write from one.
+"""
+import codecs
+import csv
+import hashlib
+import time
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta
+from itertools import repeat
+
+import numpy as np
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime, parse_time
+
+from . import alerts, ingest, reposition, rollups
+from . import cache as live_cache
+from .frames import DTYPE, overlay
+from .models import FrameLayer, PressureData, PressureFrame, ReadingLayer, UploadBatch
+
+CHUNK_BYTES = 1 << 20
+BATCH_SIZE = 2000
+FRAME_BATCH = 200  # frames per write transaction
+REQUIRED_HEADERS = {'sensor_location', 'pressure_value'}
+TIME_HEADERS = ('timestamp', 'time')
+
+
+# What ingest.record() needs from a named reading, without building a model instance
+Reading = namedtuple('Reading', 'patient_id timestamp sensor_location pressure_value')
+
+
+class ImportFormatError(ValueError):
+    pass
+
+
+class DuplicateUpload(Exception):
+    """The file was already imported in full; `batch` is the earlier UploadBatch."""
+
+    def __init__(self, batch):
+        self.batch = batch
+        super().__init__(f'Identical to upload batch {batch.pk} ({batch.file_name or "CSV"}); nothing imported')
+
+
+class ImportStats:
+    """Counters for one import; rows counts data lines read (skipped ones included)."""
+
+    def __init__(self, layout=''):
+        self.layout = layout
+        self.rows = 0
+        self.skipped = 0
+        self.readings = 0
+        self.frames = 0
+        self.merged = 0  # frames merged into an existing frame at the same timestamp
+        self.unchanged = 0  # frames identical to the stored one
+        self.replaced = 0  # named readings written over a stored one at the same sensor and time
+        self.cells = 0
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return (
+            f'{self.rows} rows ({self.layout}) in {self.seconds:.2f}s, {self.rows_per_second:,.0f} rows/s: '
+            f'{self.readings} PressureData rows, {self.frames} PressureFrames ({self.cells} cells), {self.skipped} skipped'
+            + (f', {self.merged} frames merged, {self.unchanged} unchanged' if self.merged or self.unchanged else '')
+            + (f', {self.replaced} readings replaced' if self.replaced else '')
+        )
+
+
+def _lines(stream, chunk_bytes):
+    """Yield lists of decoded lines, one list per chunk read from a binary stream."""
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    tail = ''
+    while True:
+        data = stream.read(chunk_bytes)
+        text = tail + decoder.decode(data, final=not data)
+        if not data:
+            if text.strip():
+                yield [text]
+            return
+        lines = text.split('\n')
+        tail = lines.pop()
+        if lines:
+            yield lines
+
+
+def _is_numeric(fields):
+    for field in fields:
+        field = field.strip()
+        if field == '':
+            continue
+        try:
+            float(field)
+        except ValueError:
+            return False
+    return True
+
+
+class _Clock:
+    """
+    Parse the timestamps in one file, relative to the upload timestamp.
+
+    Times of day are placed on the upload date and move to the next day when
+    they go backwards, so an overnight recording stays in order.
+    """
+
+    def __init__(self, start):
+        self.start = start
+        self.day = timezone.localdate(start)
+        self.last = None
+
+    def parse(self, text):
+        """Return an aware datetime, or None when the text isn't a time."""
+        text = text.strip()
+        try:
+            return self.start + timedelta(seconds=float(text))
+        except (ValueError, OverflowError):
+            pass
+        try:
+            moment = parse_datetime(text)
+            clock = None if moment else parse_time(text)
+        except ValueError:
+            return None
+        if clock is not None:
+            if self.last is not None and clock < self.last:
+                self.day += timedelta(days=1)
+            self.last = clock
+            moment = datetime.combine(self.day, clock)
+        if moment is None:
+            return None
+        return timezone.make_aware(moment) if timezone.is_naive(moment) else moment
+
+
+def _stamp_line(line, clock):
+    """Return the timestamp on a matrix separator line, or None for data lines."""
+    text = line.strip().rstrip(',').strip()
+    if text.startswith('#'):
+        return clock.parse(text[1:])
+    if ':' in text and ',' not in text:
+        return clock.parse(text)
+    return None
+
+
+def _split(lines):
+    """Split CSV lines into fields; str.split unless a field is quoted."""
+    if any('"' in line for line in lines):
+        return list(csv.reader(lines))
+    return [line.rstrip('\r').split(',') for line in lines]
+
+
+def _floats(fields, dtype):
+    """
+    Convert strings to an array; returns (values, ok).
+
+    Blank or non-numeric fields are NaN with ok False.
+    """
+    ok = np.ones(len(fields), dtype=bool)
+    try:
+        return np.fromiter(map(float, fields), dtype=dtype, count=len(fields)), ok
+    except ValueError:
+        pass
+    # Something in the chunk isn't a number: convert one field at a time
+    values = np.full(len(fields), np.nan, dtype=dtype)
+    for i, field in enumerate(fields):
+        try:
+            values[i] = float(field)
+        except ValueError:
+            ok[i] = False
+    return values, ok
+
+
+def _coords(locations):
+    """Return (is_cell, rows, cols) for an array of sensor locations, matching frames.COORD_RE."""
+    if not len(locations):
+        return np.zeros(0, dtype=bool), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    head, sep, col = np.char.partition(locations, '_c').T
+    blank, r, row = np.char.partition(head, 'r').T
+    is_cell = (blank == '') & (r == 'r') & (sep == '_c') & np.char.isdecimal(row) & np.char.isdecimal(col)
+    if not is_cell.any():
+        return is_cell, np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    # loadtxt's C parser converts digit strings several times faster than astype(int)
+    return (
+        is_cell,
+        np.loadtxt(row[is_cell].tolist(), dtype=np.int64, ndmin=1),
+        np.loadtxt(col[is_cell].tolist(), dtype=np.int64, ndmin=1),
+    )
+
+
+def _fill_blanks(line):
+    # loadtxt rejects empty fields; a blank cell is a cell without a reading
+    line = line.rstrip('\r')
+    if ',,' in line:
+        line = line.replace(',,', ',nan,').replace(',,', ',nan,')
+    if line.startswith(','):
+        line = 'nan' + line
+    if line.endswith(','):
+        line += 'nan'
+    return line
+
+
+def matrix_block(lines):
+    """Parse matrix lines into a float32 block as wide as the widest row; blank or non-numeric cells are NaN."""
+    if lines and all(line.strip() and '"' not in line for line in lines):
+        try:
+            # NumPy's C parser handles the whole block; ragged rows or junk cells raise
+            return np.loadtxt([_fill_blanks(line) for line in lines], delimiter=',', dtype=DTYPE, ndmin=2, comments=None)
+        except ValueError:
+            pass
+    rows = _split(lines)
+    widths = np.fromiter(map(len, rows), dtype=np.int64, count=len(rows))
+    values, _ = _floats([field for row in rows for field in row], DTYPE)
+    block = np.full((len(rows), int(widths.max(initial=0))), np.nan, dtype=DTYPE)
+    if len(values):
+        # Cell coordinates by indexing: row i repeated widths[i] times, column = offset within the row
+        r = np.repeat(np.arange(len(rows)), widths)
+        c = np.arange(len(values)) - np.repeat(np.cumsum(widths) - widths, widths)
+        block[r, c] = values
+    return block
+
+
+class _GridBuilder:
+    """Growable NaN grid that cells or whole row blocks are written into."""
+
+    def __init__(self):
+        self.grid = np.full((0, 0), np.nan, dtype=DTYPE)
+
+    def _reserve(self, rows, cols):
+        have_rows, have_cols = self.grid.shape
+        if rows <= have_rows and cols <= have_cols:
+            return
+        grown = np.full((max(rows, have_rows), max(cols, have_cols)), np.nan, dtype=DTYPE)
+        grown[:have_rows, :have_cols] = self.grid
+        self.grid = grown
+
+    def put_cells(self, r, c, values):
+        if len(r):
+            self._reserve(int(r.max()) + 1, int(c.max()) + 1)
+            self.grid[r, c] = values
+
+    def put_rows(self, first_row, block):
+        self._reserve(first_row + block.shape[0], block.shape[1])
+        self.grid[first_row:first_row + block.shape[0], :block.shape[1]] = block
+
+    def trimmed(self):
+        # Drop trailing all-NaN rows/columns (e.g. blank lines at the end of a matrix)
+        filled = ~np.isnan(self.grid)
+        rows = np.flatnonzero(filled.any(axis=1))
+        cols = np.flatnonzero(filled.any(axis=0))
+        if not len(rows):
+            return self.grid[:0, :0]
+        return self.grid[:rows[-1] + 1, :cols[-1] + 1]
+
+
+def _table_sql():
+    opts = PressureData._meta
+    qn = connection.ops.quote_name
+    columns = ', '.join(qn(opts.get_field(name).column) for name in ('patient', 'timestamp', 'sensor_location', 'pressure_value', 'batch'))
+    return f'{qn(opts.db_table)} ({columns})'
+
+
+def _insert_sql():
+    return f'INSERT INTO {_table_sql()} VALUES (%s, %s, %s, %s, %s)'
+
+
+def _write_readings(patient, timestamps, batch_id, locations, values, batch_size):
+    """
+    Save a chunk of named readings; returns (inserted, replaced).
+
+    New ones are inserted with executemany over plain tuples, no model
+    instances built. A reading whose sensor and time are already stored
+    replaces the stored value (see _replace_readings); within the chunk the
+    last one wins.
+    """
+    latest = dict(zip(zip(timestamps, locations), values.tolist()))
+    stored = {}
+    if latest:
+        stored = {
+            (reading.timestamp, reading.sensor_location): reading
+            for reading in PressureData.objects.filter(
+                patient=patient, timestamp__range=(min(timestamps), max(timestamps)), sensor_location__in=set(locations),
+            )
+        }
+    readings = [Reading(patient.pk, ts, loc, value) for (ts, loc), value in latest.items() if (ts, loc) not in stored]
+    replaced = [(stored[key], value) for key, value in latest.items() if key in stored]
+    field = PressureData._meta.get_field('timestamp')
+    db_timestamps = {r.timestamp: field.get_db_prep_save(r.timestamp, connection) for r in readings}
+    rows = [(r.patient_id, db_timestamps[r.timestamp], r.sensor_location, r.pressure_value, batch_id) for r in readings]
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            # psycopg 3 cursors stream rows with COPY, several times faster than INSERT
+            copy = getattr(cursor.cursor, 'copy', None) if connection.vendor == 'postgresql' else None
+            if copy:
+                with copy(f'COPY {_table_sql()} FROM STDIN') as stream:
+                    for row in rows:
+                        stream.write_row(row)
+            else:
+                sql = _insert_sql()
+                for i in range(0, len(rows), batch_size):
+                    cursor.executemany(sql, rows[i:i + batch_size])
+        ingest.record(PressureData, readings)
+        if replaced:
+            changed = _replace_readings(replaced, batch_id)
+            if changed:
+                # The replaced values are already in the rollups: recompute their hours
+                times = [reading.timestamp for reading in changed]
+                rollups.rebuild(patient, min(times), max(times))
+                alerts.evaluate(PressureData, changed)
+    return len(readings), len(replaced)
+
+
+def _replace_readings(pairs, batch_id):
+    """
+    Write new values over stored (reading, value) pairs; returns the readings whose value changed.
+
+    A reading another upload wrote keeps every upload's value as a
+    ReadingLayer, so undoing either batch restores the other's.
+    """
+    layered = defaultdict(list)
+    for layer in ReadingLayer.objects.filter(reading__in=[reading for reading, _ in pairs]).order_by('id'):
+        layered[layer.reading_id].append(layer)
+    stale, layers, changed = [], [], []
+    for reading, value in pairs:
+        if layered[reading.pk] or reading.batch_id != batch_id:
+            if not layered[reading.pk]:
+                layers.append(ReadingLayer(reading=reading, batch_id=reading.batch_id, pressure_value=reading.pressure_value))
+            stale += [layer.pk for layer in layered[reading.pk] if layer.batch_id == batch_id]
+            layers.append(ReadingLayer(reading=reading, batch_id=batch_id, pressure_value=value))
+        if value != reading.pressure_value:
+            reading.pressure_value = value
+            changed.append(reading)
+    ReadingLayer.objects.filter(pk__in=stale).delete()
+    ReadingLayer.objects.bulk_create(layers)
+    PressureData.objects.bulk_update(changed, ['pressure_value'])
+    return changed
+
+
+def _runs(times, clock):
+    """Split rows into runs sharing a time; returns (run timestamps, row run index), None for bad times."""
+    if not len(times):
+        return [], np.empty(0, dtype=np.int64)
+    starts = np.flatnonzero(times[1:] != times[:-1]) + 1
+    run_of_row = np.zeros(len(times), dtype=np.int64)
+    run_of_row[starts] = 1
+    run_of_row = np.cumsum(run_of_row)
+    return [clock.parse(text) for text in times[np.r_[0, starts]].tolist()], run_of_row
+
+
+def _import_header(chunks, header, timestamp, sink, stats, progress):
+    columns = [h.strip() for h in header]
+    loc_i, value_i = columns.index('sensor_location'), columns.index('pressure_value')
+    time_i = next((columns.index(name) for name in TIME_HEADERS if name in columns), None)
+    width = max(i for i in (loc_i, value_i, time_i) if i is not None) + 1
+    clock = _Clock(timestamp)
+    frame_time, grid = timestamp, _GridBuilder()
+    for lines in chunks:
+        lines = [line for line in lines if line.strip()]
+        stats.rows += len(lines)
+        text = ','.join(lines)
+        commas = np.fromiter(map(str.count, lines, repeat(',')), dtype=np.int64, count=len(lines))
+        if '"' not in text and (commas == len(columns) - 1).all():
+            # Every line has the header's shape: split the chunk once and slice out the columns
+            fields = text.split(',')
+            column = lambda i: fields[i::len(columns)]  # noqa: E731
+        else:
+            usable = [row for row in _split(lines) if len(row) >= width]
+            stats.skipped += len(lines) - len(usable)
+            column = lambda i: [row[i] for row in usable]  # noqa: E731
+        values, ok = _floats(column(value_i), np.float64)
+        locations = np.char.strip(np.array(column(loc_i), dtype=str))
+        if time_i is None:
+            run_times, run_of_row = [frame_time], np.zeros(len(values), dtype=np.int64)
+        else:
+            run_times, run_of_row = _runs(np.char.strip(np.array(column(time_i), dtype=str)), clock)
+            bad_runs = np.array([t is None for t in run_times], dtype=bool)
+            ok &= ~bad_runs[run_of_row]
+        stats.skipped += int(np.count_nonzero(~ok))
+        locations, values, run_of_row = locations[ok], values[ok], run_of_row[ok]
+
+        is_cell, r, c = _coords(locations)
+        cell_runs, cell_values = run_of_row[is_cell], values[is_cell].astype(DTYPE)
+        stats.cells += len(r)
+        # Each run goes into the open frame, or closes it and opens the next
+        bounds = np.searchsorted(cell_runs, np.arange(len(run_times) + 1))
+        for run, moment in enumerate(run_times):
+            if moment is None:
+                continue
+            if moment != frame_time:
+                sink.frame(frame_time, grid.trimmed())
+                frame_time, grid = moment, _GridBuilder()
+            lo, hi = bounds[run], bounds[run + 1]
+            grid.put_cells(r[lo:hi], c[lo:hi], cell_values[lo:hi])
+        named = ~is_cell
+        if named.any():
+            named_times = [run_times[run] for run in run_of_row[named].tolist()]
+            sink.readings(named_times, locations[named].tolist(), values[named])
+        if progress:
+            progress(stats)
+    sink.frame(frame_time, grid.trimmed())
+
+
+def _import_matrix(chunks, timestamp, sink, stats, progress):
+    clock = _Clock(timestamp)
+    frame_time, grid, frame_rows = timestamp, _GridBuilder(), 0
+
+    def put(lines):
+        nonlocal frame_rows
+        if lines:
+            block = matrix_block(lines)
+            grid.put_rows(frame_rows, block)
+            frame_rows += len(block)
+            stats.rows += len(block)
+
+    def close():
+        frame = grid.trimmed()
+        stats.cells += int(np.count_nonzero(~np.isnan(frame)))
+        sink.frame(frame_time, frame)
+
+    for lines in chunks:
+        done = 0
+        # Matrix rows never contain ':' or start with '#', so only a few lines are parsed as times
+        for i in [i for i, line in enumerate(lines) if ':' in line or line.lstrip()[:1] == '#']:
+            moment = _stamp_line(lines[i], clock)
+            if moment is None:
+                continue
+            put(lines[done:i])
+            close()
+            frame_time, grid, frame_rows = moment, _GridBuilder(), 0
+            done = i + 1
+        put(lines[done:])
+        if progress:
+            progress(stats)
+    close()
+
+
+def _chain(first, rest):
+    yield from first
+    yield from rest
+
+
+def file_hash(stream, chunk_bytes=CHUNK_BYTES):
+    """sha256 hex digest of a binary stream's contents; the stream is rewound afterwards."""
+    digest = hashlib.sha256()
+    for data in iter(lambda: stream.read(chunk_bytes), b''):
+        digest.update(data)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+def start_batch(stream, patient, timestamp, file_name='', user=None):
+    """
+    Record an UploadBatch for a file about to be imported.
+
+    Raises DuplicateUpload, before anything is parsed, when the same bytes
+    were already imported in full for this patient and timestamp.
+    """
+    return open_batch(patient, timestamp, file_hash(stream), file_name, user)
+
+
+def open_batch(patient, timestamp, digest, file_name='', user=None):
+    """start_batch for a file whose hash is already known."""
+    earlier = UploadBatch.objects.filter(patient=patient, file_hash=digest, timestamp=timestamp, complete=True).first()
+    if earlier:
+        raise DuplicateUpload(earlier)
+    return UploadBatch.objects.create(
+        patient=patient,
+        date=timezone.localdate(timestamp),
+        timestamp=timestamp,
+        file_name=file_name,
+        file_hash=digest,
+        created_by=user,
+    )
+
+
+class _Writer:
+    """
+    Save a patient's parsed readings, and frames FRAME_BATCH at a time.
+
+    New timestamps are bulk inserted. A frame whose patient and timestamp
+    already have one is merged into it (the new cells win), so a re-sent or
+    partially overlapping file updates the frame instead of adding another.
+    Merging into another upload's frame records both uploads' cells as
+    FrameLayers, so either batch can still be undone exactly.
+    """
+
+    def __init__(self, patient, batch_id, stats, batch_size=BATCH_SIZE, frame_batch=FRAME_BATCH):
+        self.patient = patient
+        self.batch_id = batch_id
+        self.stats = stats
+        self.batch_size = batch_size
+        self.frame_batch = frame_batch
+        self.pending = {}  # timestamp -> grid, in file order
+
+    def readings(self, timestamps, locations, values):
+        inserted, replaced = _write_readings(self.patient, timestamps, self.batch_id, locations, values, self.batch_size)
+        self.stats.readings += inserted
+        self.stats.replaced += replaced
+
+    def frame(self, timestamp, grid):
+        if not grid.size:
+            return
+        if timestamp in self.pending:
+            grid = overlay(self.pending[timestamp], grid)
+        self.pending[timestamp] = grid
+        if len(self.pending) >= self.frame_batch:
+            self.flush()
+
+    def _layer(self, frame, layers, grid, new_layers, stale):
+        """Record this upload's cells for a frame it shares with another upload."""
+        if not layers:
+            new_layers.append(FrameLayer.from_grid(frame, frame.batch_id, frame.grid))
+        own = [layer for layer in layers if layer.batch_id == self.batch_id]
+        if own:
+            # Moved to the top, as its new cells are now
+            grid = overlay(own[-1].grid, grid)
+            stale.append(own[-1].pk)
+        new_layers.append(FrameLayer.from_grid(frame, self.batch_id, grid))
+
+    def flush(self):
+        pending, self.pending = self.pending, {}
+        if not pending:
+            return
+        existing = {}
+        for frame in PressureFrame.objects.filter(patient=self.patient, timestamp__in=list(pending)).order_by('-id'):
+            existing[frame.timestamp] = frame  # the oldest frame at a timestamp is kept
+        layered = defaultdict(list)
+        for layer in FrameLayer.objects.filter(frame__in=list(existing.values())).order_by('id'):
+            layered[layer.frame_id].append(layer)
+        created, merged, new_layers, stale = [], [], [], []
+        for timestamp, grid in pending.items():
+            frame = existing.get(timestamp)
+            if frame is None:
+                frame = PressureFrame.from_grid(self.patient, timestamp, grid)
+                frame.batch_id = self.batch_id
+                created.append(frame)
+                continue
+            if layered[frame.pk] or frame.batch_id != self.batch_id:
+                self._layer(frame, layered[frame.pk], grid, new_layers, stale)
+            old = frame.grid
+            grid = overlay(old, grid)
+            if grid.shape == old.shape and np.array_equal(grid, old, equal_nan=True):
+                self.stats.unchanged += 1
+                continue
+            update = PressureFrame.from_grid(self.patient, timestamp, grid)
+            for name in ('rows', 'cols', 'data', 'peak_value', 'peak_location'):
+                setattr(frame, name, getattr(update, name))
+            merged.append(frame)
+        with transaction.atomic():
+            # bulk_create sends no post_save: do what the receivers would
+            PressureFrame.objects.bulk_create(created)
+            ingest.record(PressureFrame, created)
+            for frame in sorted(created, key=lambda f: f.timestamp)[-reposition.WINDOW:]:
+                reposition.observe(frame)
+            FrameLayer.objects.filter(pk__in=stale).delete()
+            FrameLayer.objects.bulk_create(new_layers)
+            if merged:
+                PressureFrame.objects.bulk_update(merged, ['rows', 'cols', 'data', 'peak_value', 'peak_location'])
+                # The merged frames' earlier peaks are already in the rollups: recompute their hours
+                times = [frame.timestamp for frame in merged]
+                rollups.rebuild(self.patient, min(times), max(times))
+                alerts.evaluate(PressureFrame, merged)
+        self.stats.frames += len(created)
+        self.stats.merged += len(merged)
+
+
+class ParsedFile:
+    """
+    Everything parse_file read from one CSV, held in memory until write_parsed.
+
+    Named readings are kept as parallel lists (values as float64 arrays, one
+    per chunk) and frames as (timestamp, grid) pairs; all of it pickles, so
+    files can be parsed in worker processes.
+    """
+
+    def __init__(self, file_hash=''):
+        self.file_hash = file_hash
+        self.stats = ImportStats()
+        self.frames = []
+        self.timestamps = []
+        self.locations = []
+        self.values = []
+
+    def readings(self, timestamps, locations, values):
+        self.timestamps.extend(timestamps)
+        self.locations.extend(locations)
+        self.values.append(values)
+
+    def frame(self, timestamp, grid):
+        if grid.size:
+            self.frames.append((timestamp, grid))
+
+
+def _parse(stream, timestamp, sink, stats, chunk_bytes, progress):
+    """Detect the layout and feed the file's named readings and frames to `sink`."""
+    chunks = _lines(stream, chunk_bytes)
+    first = next(chunks, [])
+    header = next(csv.reader(first[:1]), []) if first else []
+
+    if REQUIRED_HEADERS.issubset({h.strip() for h in header}):
+        stats.layout = 'header'
+        rest = [first[1:]] if len(first) > 1 else []
+        _import_header(_chain(rest, chunks), header, timestamp, sink, stats, progress)
+    elif _is_numeric(header) or _stamp_line(first[0], _Clock(timestamp)):
+        stats.layout = 'matrix'
+        _import_matrix(_chain([first] if first else [], chunks), timestamp, sink, stats, progress)
+    else:
+        raise ImportFormatError('CSV must include headers or be a numeric matrix')
+
+
+def _finish(writer, batch):
+    writer.flush()
+    stats = writer.stats
+    if batch:
+        batch.row_count, batch.frame_count, batch.complete = stats.readings, stats.frames, True
+        batch.save(update_fields=['row_count', 'frame_count', 'complete'])
+    live_cache.invalidate(writer.patient.pk)
+
+
+def import_csv(stream, patient, timestamp, chunk_bytes=CHUNK_BYTES, batch_size=BATCH_SIZE, progress=None, batch=None):
+    """
+    Import a CSV from a binary stream for one patient.
+
+    Readings without a time of their own are stamped with `timestamp`.
+    Returns ImportStats. `progress(stats)` is called after every chunk.
+    Rows and frames are tagged with `batch` (an UploadBatch) when given.
+    Raises ImportFormatError when the file is neither layout.
+    """
+    stats = ImportStats()
+    writer = _Writer(patient, batch.pk if batch else None, stats, batch_size)
+    _parse(stream, timestamp, writer, stats, chunk_bytes, progress)
+    _finish(writer, batch)
+    stats.seconds = time.perf_counter() - stats.started
+    return stats
+
+
+def parse_file(path, timestamp, chunk_bytes=CHUNK_BYTES):
+    """
+    Hash and parse a CSV file without touching the database; returns a ParsedFile.
+
+    The parsing half of import_csv, for worker processes (see bulk_ingest).
+    Raises ImportFormatError like import_csv.
+    """
+    with open(path, 'rb') as f:
+        parsed = ParsedFile(file_hash(f, chunk_bytes))
+        _parse(f, timestamp, parsed, parsed.stats, chunk_bytes, None)
+    parsed.stats.seconds = time.perf_counter() - parsed.stats.started
+    return parsed
+
+
+def write_parsed(parsed, patient, batch=None, batch_size=BATCH_SIZE, rows_per_transaction=BATCH_SIZE * 25):
+    """Write a ParsedFile for one patient, as import_csv would have; returns its ImportStats."""
+    writer = _Writer(patient, batch.pk if batch else None, parsed.stats, batch_size)
+    values = np.concatenate(parsed.values) if parsed.values else np.empty(0)
+    for i in range(0, len(values), rows_per_transaction):
+        end = i + rows_per_transaction
+        writer.readings(parsed.timestamps[i:end], parsed.locations[i:end], values[i:end])
+    for timestamp, grid in parsed.frames:
+        writer.frame(timestamp, grid)
+    _finish(writer, batch)
+    return parsed.stats
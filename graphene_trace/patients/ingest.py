@@ -0,0 +1,49 @@
+"""
+Processing that follows every insert of pressure readings: rollups and alerts.
+
+Single saves reach record() through the post_save receiver in models.py.
+bulk_create sends no signals, so bulk callers pass the created objects to
+record() themselves. Anything with the model's patient_id, timestamp and
+value attributes will do (the CSV importer passes importer.Reading tuples).
+Imports that save row by row can wrap the loop in deferred() so the batch is
+processed once on exit.
+"""
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from . import alerts, rollups
+
+_local = threading.local()
+
+
+def _process(sender, instances):
+    rollups.record(sender, instances)
+    alerts.evaluate(sender, instances)
+
+
+def record(sender, instances):
+    """Fold newly created PressureData or PressureFrame rows into rollups and alerts."""
+    if not instances:
+        return
+    buffer = getattr(_local, 'buffer', None)
+    if buffer is not None:
+        buffer[sender].extend(instances)
+    else:
+        _process(sender, instances)
+
+
+@contextmanager
+def deferred():
+    """Buffer record() calls and process them once when the block exits cleanly."""
+    if getattr(_local, 'buffer', None) is not None:
+        yield  # nested: the outer block processes
+        return
+    _local.buffer = defaultdict(list)
+    try:
+        yield
+        pending = _local.buffer
+    finally:
+        _local.buffer = None
+    for sender, instances in pending.items():
+        _process(sender, instances)
@@ -0,0 +1,240 @@
+"""
+Background CSV imports.
+
+upload_csv spools the file under IMPORT_SPOOL_DIR, queues an ImportJob and
+returns straight away. Jobs are claimed from the table one at a time, so any
+number of workers can share the queue: a thread in the web process (when
+IMPORT_IN_PROCESS is set, started by the WSGI/ASGI modules) and/or
+`manage.py run_import_worker`. The running job's counters are written back
+after each chunk, throttled to PROGRESS_INTERVAL, and the upload page polls
+them.
+
+Each progress write also refreshes the job's heartbeat. A job whose worker
+died stops beating; after IMPORT_JOB_TIMEOUT seconds any worker discards its
+partial batch and queues it again (requeue_stale). Workers also drain the
+queue every POLL_INTERVAL, so jobs left queued by a restart don't wait for
+the next upload.
+
+A job that fails part way through the file has its partial batch undone
+too, so a failed import leaves no rows behind.
+"""
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import batches
+from .importer import DuplicateUpload, ImportFormatError, import_csv, start_batch
+from .models import ImportJob
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_INTERVAL = 0.5  # seconds between progress writes
+PROGRESS_FIELDS = ['bytes_read', 'rows', 'skipped', 'readings', 'frames', 'cells', 'rows_per_second']
+POLL_INTERVAL = 5.0  # seconds between queue checks of the in-process worker
+
+_wake = threading.Event()
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def spool(upload):
+    """Copy (or move, when Django already spooled it) an uploaded file into IMPORT_SPOOL_DIR."""
+    os.makedirs(settings.IMPORT_SPOOL_DIR, exist_ok=True)
+    path = os.path.join(settings.IMPORT_SPOOL_DIR, f'{uuid.uuid4().hex}.csv')
+    if hasattr(upload, 'temporary_file_path'):
+        # Django closes (and tries to delete) its temporary file after the request
+        shutil.move(upload.temporary_file_path(), path)
+    else:
+        with open(path, 'wb') as out:
+            for chunk in upload.chunks():
+                out.write(chunk)
+    return path
+
+
+def enqueue(upload, patient, timestamp, user=None):
+    """Spool an upload and queue its import; returns the ImportJob."""
+    path = spool(upload)
+    job = ImportJob.objects.create(
+        patient=patient,
+        created_by=user,
+        file_name=upload.name or '',
+        path=path,
+        size=os.path.getsize(path),
+        timestamp=timestamp,
+    )
+    if settings.IMPORT_IN_PROCESS:
+        transaction.on_commit(_kick)
+    return job
+
+
+def claim():
+    """Mark the oldest queued job running and return it, or None when the queue is empty."""
+    while True:
+        job_id = ImportJob.objects.filter(status=ImportJob.QUEUED).order_by('created_at').values_list('id', flat=True).first()
+        if job_id is None:
+            return None
+        # The status condition makes the claim atomic between workers
+        now = timezone.now()
+        if ImportJob.objects.filter(pk=job_id, status=ImportJob.QUEUED).update(status=ImportJob.RUNNING, started_at=now, heartbeat_at=now):
+            return ImportJob.objects.select_related('patient').get(pk=job_id)
+
+
+def requeue_stale(timeout=None):
+    """
+    Queue again the RUNNING jobs without a heartbeat for `timeout` seconds; returns how many.
+
+    Their worker is assumed dead. Whatever it committed of the file is
+    undone first, so the rerun doesn't import those rows twice.
+    """
+    cutoff = timezone.now() - timedelta(seconds=timeout or settings.IMPORT_JOB_TIMEOUT)
+    stale = ImportJob.objects.filter(status=ImportJob.RUNNING).filter(
+        Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, started_at__lt=cutoff)
+    )
+    requeued = 0
+    for job in stale.select_related('batch__patient'):
+        # Conditional on the heartbeat we read, so only one worker requeues it
+        reset = dict.fromkeys(PROGRESS_FIELDS, 0)
+        if not ImportJob.objects.filter(pk=job.pk, status=ImportJob.RUNNING, heartbeat_at=job.heartbeat_at).update(
+            status=ImportJob.QUEUED, batch=None, started_at=None, heartbeat_at=None, **reset,
+        ):
+            continue
+        if job.batch is not None and not job.batch.complete:
+            batches.undo(job.batch)
+        logger.warning('Requeued import job %s (%s), which stopped reporting progress', job.pk, job.file_name)
+        requeued += 1
+    return requeued
+
+
+def _copy_stats(job, stats, bytes_read):
+    job.bytes_read = bytes_read
+    job.rows = stats.rows
+    job.skipped = stats.skipped
+    job.readings = stats.readings
+    job.frames = stats.frames
+    job.cells = stats.cells
+    elapsed = time.perf_counter() - stats.started
+    job.rows_per_second = stats.rows / elapsed if elapsed else 0.0
+
+
+def run(job):
+    """Import a claimed job's spooled file, recording progress and the outcome on the job."""
+    last_write = 0.0
+    stats = None
+    try:
+        with open(job.path, 'rb') as f:
+            def progress(current):
+                nonlocal last_write, stats
+                stats = current
+                if time.perf_counter() - last_write >= PROGRESS_INTERVAL:
+                    _copy_stats(job, current, f.tell())
+                    job.heartbeat_at = timezone.now()
+                    ImportJob.objects.filter(pk=job.pk).update(
+                        heartbeat_at=job.heartbeat_at, **{name: getattr(job, name) for name in PROGRESS_FIELDS},
+                    )
+                    last_write = time.perf_counter()
+
+            job.batch = start_batch(f, job.patient, job.timestamp, job.file_name, job.created_by)
+            ImportJob.objects.filter(pk=job.pk).update(batch=job.batch)
+            stats = import_csv(f, job.patient, job.timestamp, progress=progress, batch=job.batch)
+        job.status = ImportJob.DONE
+        job.bytes_read = job.size
+    except DuplicateUpload as e:
+        # Same file already imported: point the job at the earlier batch
+        job.status, job.error, job.batch = ImportJob.SKIPPED, str(e), e.batch
+        job.bytes_read = job.size
+    except ImportFormatError as e:
+        # Raised before anything is written
+        job.status, job.error = ImportJob.FAILED, str(e)
+        if job.batch:
+            job.batch.delete()
+            job.batch = None
+    except Exception as e:
+        # Chunks written before the failure are committed: take the partial batch back out
+        job.status, job.error = ImportJob.FAILED, f'Error processing CSV: {e}'
+        if job.batch is not None:
+            try:
+                batches.undo(job.batch)
+            except Exception:
+                logger.exception('Could not undo the partial batch %s of import job %s', job.batch.pk, job.pk)
+                job.error += f'; undoing its partial batch {job.batch.pk} failed (see manage.py undo_upload)'
+            else:
+                job.batch = None
+                job.error += '; the partial import was undone'
+    if stats is not None:
+        _copy_stats(job, stats, job.bytes_read)
+        if job.status == ImportJob.DONE:
+            job.rows_per_second = stats.rows_per_second
+    job.finished_at = timezone.now()
+    job.save(update_fields=PROGRESS_FIELDS + ['batch', 'status', 'error', 'finished_at'])
+    try:
+        os.remove(job.path)
+    except OSError:
+        pass
+    return job
+
+
+def run_next():
+    """Claim and run one job; returns it, or None if nothing was queued."""
+    job = claim()
+    return run(job) if job else None
+
+
+def start_worker():
+    """Start this process's import thread if it isn't running; it drains the queue now and every POLL_INTERVAL."""
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_work, name='import-job', daemon=True)
+            _worker.start()
+
+
+def _kick():
+    start_worker()
+    _wake.set()
+
+
+def _work():
+    # Runs on its own thread, which has its own database connection
+    while True:
+        _wake.clear()
+        try:
+            requeue_stale()
+            while run_next():
+                pass
+        except Exception:
+            logger.exception('Import worker failed; retrying in %s seconds', POLL_INTERVAL)
+        finally:
+            connection.close()
+        _wake.wait(POLL_INTERVAL)
+
+
+def progress(job):
+    """JSON-ready progress for the upload page."""
+    eta = job.eta_seconds
+    return {
+        'id': job.id,
+        'batch': job.batch_id,
+        'status': job.status,
+        'file_name': job.file_name,
+        'size': job.size,
+        'bytes_read': job.bytes_read,
+        'percent': round(100.0 * job.bytes_read / job.size, 1) if job.size else (100.0 if job.finished else 0.0),
+        'rows': job.rows,
+        'skipped': job.skipped,
+        'readings': job.readings,
+        'frames': job.frames,
+        'cells': job.cells,
+        'rows_per_second': round(job.rows_per_second),
+        'eta_seconds': round(eta, 1) if eta is not None else None,
+        'error': job.error,
+        'finished': job.finished,
+    }
@@ -0,0 +1,37 @@
+"""
+Read helpers shared by the patient and clinician live endpoints.
+"""
+from .models import PressureData, PressureFrame
+
+
+def latest_grid(patient, with_cells=True):
+    """
+    Return (timestamp, cells, frame) for the patient's most recent reading.
+
+    Grid readings come from the latest PressureFrame in a single indexed row
+    fetch. Named sensors (e.g. 'left_hip') are only stored as PressureData, so
+    they are shown when they are newer than the latest frame. Pass
+    with_cells=False to get a frame without unpacking its cells.
+    """
+    frame = PressureFrame.objects.filter(patient=patient).order_by('-timestamp').first()
+    named_latest = PressureData.objects.filter(patient=patient).order_by('-timestamp').values_list('timestamp', flat=True).first()
+    if frame and (named_latest is None or frame.timestamp >= named_latest):
+        return frame.timestamp, frame.cells() if with_cells else [], frame
+    if named_latest is None:
+        return None, [], None
+    rows = PressureData.objects.filter(patient=patient, timestamp=named_latest).values_list('sensor_location', 'pressure_value')
+    cells = [{'label': loc, 'value': value} for loc, value in rows]
+    return named_latest, cells, None
+
+
+def recent_series(patient, limit=100):
+    """
+    Return the last `limit` points, oldest first, as (timestamp, value) pairs.
+
+    Each frame contributes its peak reading, so the blobs themselves are never
+    loaded; named-sensor readings are merged in by timestamp.
+    """
+    frame_points = PressureFrame.objects.filter(patient=patient, peak_value__isnull=False).order_by('-timestamp').values_list('timestamp', 'peak_value')[:limit]
+    reading_points = PressureData.objects.filter(patient=patient).order_by('-timestamp').values_list('timestamp', 'pressure_value')[:limit]
+    points = sorted(list(frame_points) + list(reading_points), key=lambda p: p[0])
+    return points[-limit:]
@@ -0,0 +1,37 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from patients import devices
+from patients.models import Device
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Register a bedside device (or issue it a new token) and assign patients to it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', help='Device name')
+        parser.add_argument('--patients', default='', help='Comma-separated patient usernames the device may send frames for')
+        parser.add_argument('--rotate', action='store_true', help='Issue a new token for an existing device')
+
+    def handle(self, *args, **options):
+        usernames = [u.strip() for u in options['patients'].split(',') if u.strip()]
+        patients = list(User.objects.filter(username__in=usernames, role='patient'))
+        missing = set(usernames) - {p.username for p in patients}
+        if missing:
+            raise CommandError(f"Patient user(s) not found: {', '.join(sorted(missing))}")
+
+        device = Device.objects.filter(name=options['name']).first()
+        if device is not None and not options['rotate'] and not patients:
+            raise CommandError(f"Device '{device.name}' exists; pass --rotate for a new token or --patients to assign more")
+        token = None
+        if device is None or options['rotate']:
+            device = device or Device(name=options['name'])
+            token = devices.issue_token(device)
+            device.save()
+        device.patients.add(*patients)
+
+        assigned = ', '.join(device.patients.order_by('username').values_list('username', flat=True)) or 'none'
+        self.stdout.write(f'Device {device.name} (id {device.pk}); patients: {assigned}')
+        if token:
+            self.stdout.write(f'Token (shown once): {token}')
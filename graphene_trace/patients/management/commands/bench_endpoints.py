@@ -0,0 +1,198 @@
+import json
+import os
+import subprocess
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from patients.models import ImportJob, PressureFrame
+
+User = get_user_model()
+
+# name -> (who makes the request, method, URL for a given patient)
+ENDPOINTS = {
+    'dashboard': ('patient', 'get', lambda p: reverse('dashboard')),
+    'live_grid_json': ('patient', 'get', lambda p: reverse('live_grid_json')),
+    'live_graph_json': ('patient', 'get', lambda p: reverse('live_graph_json')),
+    'patient_list': ('clinician', 'get', lambda p: reverse('patient_list')),
+    'patient_history': ('clinician', 'get', lambda p: reverse('patient_history', args=[p.id])),
+    'upload_csv': ('admin', 'post', lambda p: reverse('upload_csv')),
+}
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+class _Worker:
+    """One thread's test clients (one per user, logged in once) and query counter."""
+
+    def __init__(self, upload):
+        self.clients = {}
+        self.upload = upload
+        self.queries = 0
+
+    def count(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def request(self, user, method, url, patient):
+        client = self.clients.get(user.pk)
+        if client is None:
+            # Server errors are reported as 500s rather than raised in the worker
+            client = self.clients[user.pk] = Client(raise_request_exception=False)
+            client.force_login(user)
+        self.queries = 0
+        began = time.perf_counter()
+        with connection.execute_wrapper(self.count):
+            if method == 'post':
+                csv_file = SimpleUploadedFile('bench.csv', self.upload, content_type='text/csv')
+                response = client.post(url, {'patient': patient.id, 'date': '2024-05-01', 'csv_file': csv_file})
+            else:
+                response = client.get(url)
+        return time.perf_counter() - began, self.queries, response.status_code
+
+
+def _drive(run, count, workers):
+    """Call run(worker, i) for i in range(count) from one thread per worker; results in order of i."""
+    results = [None] * count
+    indices = iter(range(count))
+    lock = threading.Lock()
+    failures = []
+
+    def work(worker):
+        try:
+            while not failures:
+                with lock:
+                    i = next(indices, None)
+                if i is None:
+                    return
+                results[i] = run(worker, i)
+        except Exception as e:
+            failures.append(e)
+        finally:
+            connection.close()  # each thread opened its own
+
+    threads = [threading.Thread(target=work, args=(worker,)) for worker in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if failures:
+        raise failures[0]
+    return results
+
+
+def _summarise(results, elapsed):
+    ms = [1000 * seconds for seconds, _, _ in results]
+    queries = [count for _, count, _ in results]
+    statuses = {}
+    for _, _, status in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        'requests': len(results),
+        'errors': sum(1 for _, _, status in results if status >= 400),
+        'status': statuses,
+        'latency_ms_p50': round(_percentile(ms, 50), 2),
+        'latency_ms_p95': round(_percentile(ms, 95), 2),
+        'latency_ms_p99': round(_percentile(ms, 99), 2),
+        'latency_ms_mean': round(sum(ms) / len(ms), 2),
+        'queries_per_request': round(sum(queries) / len(queries), 2),
+        'queries_max': max(queries),
+        'throughput_rps': round(len(results) / elapsed, 1),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive the main pages and APIs through the Django test client with concurrent threads and '
+        'report latency percentiles, queries per request and throughput as JSON. Uses the users '
+        'made by generate_load.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prefix', default='load', help='generate_load username prefix')
+        parser.add_argument('--endpoints', default=','.join(ENDPOINTS), help='Comma separated endpoints to run')
+        parser.add_argument('--requests', type=int, default=200, help='Measured requests per endpoint')
+        parser.add_argument('--concurrency', type=int, default=4, help='Client threads')
+        parser.add_argument('--warmup', type=int, default=20, help='Unmeasured requests per endpoint first')
+        parser.add_argument('--output', help='Write the JSON report here as well as to stdout')
+
+    @override_settings(DEBUG=False, IMPORT_IN_PROCESS=False)
+    def handle(self, *args, **options):
+        names = [name for name in options['endpoints'].split(',') if name]
+        unknown = sorted(set(names) - set(ENDPOINTS))
+        if unknown:
+            raise CommandError(f"Unknown endpoints: {', '.join(unknown)} (choose from {', '.join(ENDPOINTS)})")
+        if options['requests'] < 1:
+            raise CommandError('--requests must be at least 1')
+        prefix = options['prefix']
+        patients = list(
+            User.objects.filter(username__startswith=f'{prefix}-patient-', clinician__isnull=False).select_related('clinician')
+        )
+        admin = User.objects.filter(username=f'{prefix}-admin').first()
+        if not patients or admin is None:
+            raise CommandError(f"No '{prefix}-' users with assigned clinicians; run generate_load first")
+
+        rng = np.random.default_rng(0)
+        upload = '\n'.join(','.join(f'{v:.1f}' for v in row) for row in rng.uniform(0, 120, (32, 32)).tolist()).encode()
+
+        def run(name):
+            role, method, url = ENDPOINTS[name]
+
+            def one(worker, i):
+                patient = patients[i % len(patients)]
+                user = {'patient': patient, 'clinician': patient.clinician, 'admin': admin}[role]
+                return worker.request(user, method, url(patient), patient)
+            return one
+
+        jobs_before = set(ImportJob.objects.values_list('id', flat=True))
+        report = {
+            'commit': _commit(),
+            'database': connection.vendor,
+            'database_profile': getattr(settings, 'DATABASE_PROFILE', None),
+            'session_engine': settings.SESSION_ENGINE,
+            'concurrency': options['concurrency'],
+            'requests_per_endpoint': options['requests'],
+            'dataset': {'patients': len(patients), 'frames': PressureFrame.objects.filter(patient__in=patients).count()},
+            'endpoints': {},
+        }
+        try:
+            with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                for name in names:
+                    # Workers keep their clients (and logins) from the warm-up into the measured run
+                    workers = [_Worker(upload) for _ in range(max(1, options['concurrency']))]
+                    _drive(run(name), options['warmup'], workers)
+                    began = time.perf_counter()
+                    results = _drive(run(name), options['requests'], workers)
+                    report['endpoints'][name] = _summarise(results, time.perf_counter() - began)
+        finally:
+            # upload_csv only queues jobs (IMPORT_IN_PROCESS is off); drop them and their spooled files
+            for job in ImportJob.objects.exclude(id__in=jobs_before):
+                if job.path and os.path.exists(job.path):
+                    os.remove(job.path)
+                job.delete()
+
+        text = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(text + '\n')
+        self.stdout.write(text)
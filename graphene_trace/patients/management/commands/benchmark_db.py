@@ -0,0 +1,124 @@
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection, connections
+from django.test.utils import override_settings
+from django.utils import timezone
+from patients import live
+from patients.importer import import_csv
+from patients.models import PressureData, PressureFrame
+from patients.management.commands.benchmark_import import _write_header, _write_recording
+
+User = get_user_model()
+
+
+def _percentile(values, q):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def _poll(patient_id, interval, importing, stopped, results):
+    """
+    Reader process: poll a patient's live grid and series straight from the
+    database (no cache) until `stopped`, then send back the latencies.
+
+    Processes rather than threads, so the readers contend with the import for
+    the database and not for the GIL.
+    """
+    django.setup()
+    patient = User.objects.get(pk=patient_id)
+    latencies = {'idle': [], 'import': []}
+    errors = 0
+    while not stopped.is_set():
+        phase = 'import' if importing.is_set() else 'idle'
+        began = time.perf_counter()
+        try:
+            live.latest_grid(patient)
+            live.recent_series(patient)
+        except OperationalError:
+            errors += 1  # "database is locked"
+        else:
+            latencies[phase].append(time.perf_counter() - began)
+        stopped.wait(interval)
+    connection.close()
+    results.put((latencies, errors))
+
+
+class Command(BaseCommand):
+    help = 'Measure import rows/s and concurrent live-read latency on the configured database (GRAPHENE_DB)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--values', type=int, default=300_000, help='Values per generated file')
+        parser.add_argument('--layouts', default='header-named,recording', help='header-named and/or recording')
+        parser.add_argument('--readers', type=int, default=4, help='Processes polling the live read path')
+        parser.add_argument('--interval', type=float, default=0.05, help='Seconds between one reader\'s polls')
+        parser.add_argument('--idle', type=float, default=2.0, help='Seconds of polling measured before the import')
+
+    def _describe(self):
+        db = settings.DATABASES['default']
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode')
+                journal = cursor.fetchone()[0]
+                cursor.execute('PRAGMA synchronous')
+                synchronous = cursor.fetchone()[0]
+            return f'sqlite journal_mode={journal} synchronous={synchronous} CONN_MAX_AGE={db.get("CONN_MAX_AGE", 0)}'
+        return f'{connection.vendor} pool={db.get("OPTIONS", {}).get("pool")}'
+
+    def _latency(self, results, phase):
+        ms = [1000 * v for latencies, _ in results for v in latencies[phase]]
+        return (
+            f'{len(ms)} polls, p50 {_percentile(ms, 0.5):.1f} ms, p95 {_percentile(ms, 0.95):.1f} ms, '
+            f'p99 {_percentile(ms, 0.99):.1f} ms, max {max(ms, default=float("nan")):.1f} ms'
+            + (f', mean {statistics.fmean(ms):.1f} ms' if ms else '')
+        )
+
+    @override_settings(DEBUG=False)
+    def handle(self, *args, **options):
+        self.stdout.write(f'Profile {settings.DATABASE_PROFILE}: {self._describe()}')
+        patient, _ = User.objects.get_or_create(username='bench_db', defaults={'role': 'patient'})
+        writers = {
+            'header-named': lambda path, n: _write_header(path, n, named=True),
+            'recording': lambda path, n: _write_recording(path, n, 16, long=False),
+        }
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                for layout in filter(None, options['layouts'].split(',')):
+                    path = os.path.join(tmp, f'{layout}.csv')
+                    values = writers[layout](path, options['values'])
+                    # Each layout starts from an empty patient
+                    PressureFrame.objects.filter(patient=patient).delete()
+                    PressureData.objects.filter(patient=patient).delete()
+                    connections.close_all()  # forked readers must not share the connection
+                    importing, stopped, queue = multiprocessing.Event(), multiprocessing.Event(), multiprocessing.Queue()
+                    readers = [
+                        multiprocessing.Process(target=_poll, args=(patient.pk, options['interval'], importing, stopped, queue))
+                        for _ in range(options['readers'])
+                    ]
+                    for reader in readers:
+                        reader.start()
+                    time.sleep(options['idle'])
+                    importing.set()
+                    began = time.perf_counter()
+                    with open(path, 'rb') as f:
+                        import_csv(f, patient, timezone.now())
+                    elapsed = time.perf_counter() - began
+                    stopped.set()
+                    results = [queue.get() for _ in readers]
+                    for reader in readers:
+                        reader.join()
+                    self.stdout.write(f'{layout}: {values:,} values in {elapsed:.2f}s = {values / elapsed:,.0f} values/s')
+                    self.stdout.write(f'  reads while idle:      {self._latency(results, "idle")}')
+                    self.stdout.write(f'  reads during import:   {self._latency(results, "import")}')
+                    self.stdout.write(f'  read errors (locked):  {sum(errors for _, errors in results)}')
+        finally:
+            patient.delete()
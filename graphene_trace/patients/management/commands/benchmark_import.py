@@ -0,0 +1,170 @@
+import csv
+import os
+import tempfile
+from io import BytesIO
+import time
+import tracemalloc
+
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from django.utils import timezone
+from patients.frames import grid_from_rows
+from patients.importer import CHUNK_BYTES, import_csv, matrix_block
+from patients.models import PressureData, PressureFrame
+
+User = get_user_model()
+
+SENSORS = ('left_hip', 'right_hip', 'sacrum', 'left_heel', 'right_heel', 'left_shoulder', 'right_shoulder', 'head')
+
+
+def _write_matrix(path, values):
+    side = int(np.ceil(np.sqrt(values)))
+    grid = np.random.default_rng(1).uniform(0, 200, (side, side))
+    np.savetxt(path, grid, fmt='%.1f', delimiter=',')
+    return side * side
+
+
+def _write_header(path, values, named):
+    rng = np.random.default_rng(1)
+    side = int(np.ceil(np.sqrt(values)))
+    with open(path, 'w') as f:
+        f.write('sensor_location,pressure_value\n')
+        for first in range(0, values, 100_000):
+            idx = np.arange(first, min(first + 100_000, values))
+            readings = rng.uniform(0, 200, len(idx))
+            if named:
+                names = [SENSORS[i % len(SENSORS)] for i in idx.tolist()]
+            else:
+                names = [f'r{r}_c{c}' for r, c in zip((idx // side).tolist(), (idx % side).tolist())]
+            f.write(''.join(f'{n},{v:.1f}\n' for n, v in zip(names, readings.tolist())))
+    return values
+
+
+def _write_recording(path, values, side, long):
+    """A 1 Hz recording of side x side mats starting at 22:00, as stacked matrices or long rows."""
+    rng = np.random.default_rng(1)
+    frames = max(1, values // (side * side))
+    cells = [f'r{r}_c{c}' for r in range(side) for c in range(side)]
+    with open(path, 'w') as f:
+        if long:
+            f.write('time,sensor_location,pressure_value\n')
+        for i in range(frames):
+            seconds = 22 * 3600 + i
+            stamp = f'{seconds // 3600 % 24:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}'
+            grid = rng.uniform(0, 200, (side, side))
+            if long:
+                f.write(''.join(f'{stamp},{cell},{v:.1f}\n' for cell, v in zip(cells, grid.ravel().tolist())))
+            else:
+                f.write(stamp + '\n' + '\n'.join(','.join(f'{v:.1f}' for v in row) for row in grid.tolist()) + '\n')
+    return frames * side * side
+
+
+def _row_per_cell(lines):
+    """The import before frames: one PressureData per cell, as the matrix branch used to build them."""
+    objs = []
+    for r_idx, row in enumerate(csv.reader(lines)):
+        for c_idx, cell in enumerate(row):
+            cell = cell.strip()
+            if cell == '':
+                continue
+            try:
+                pressure_value = float(cell)
+            except ValueError:
+                continue
+            objs.append(PressureData(sensor_location=f"r{r_idx}_c{c_idx}", pressure_value=pressure_value))
+    return objs
+
+
+def _per_cell_grid(lines):
+    return grid_from_rows(csv.reader(lines))
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the streaming CSV importer on generated header and matrix files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--values', type=int, default=1_000_000, help='Pressure values per file')
+        parser.add_argument('--chunk-bytes', type=int, default=CHUNK_BYTES, help='Bytes read and parsed per chunk')
+        parser.add_argument(
+            '--layouts', default='matrix,header-cells,header-named',
+            help='Comma separated layouts to run: matrix, header-cells, header-named, recording, recording-long',
+        )
+        parser.add_argument('--frames', type=int, default=2000, help='Mats parsed in the per-frame comparison (0 to skip)')
+        parser.add_argument('--mat', type=int, default=64, help='Mat side length for the per-frame comparison and recordings')
+        parser.add_argument('--skip-memory', action='store_true', help='Skip the traced-memory runs at 1/4 and full size')
+
+    def _run(self, patient, path, chunk_bytes, traced):
+        # Start empty, or recordings (absolute times) would merge into the previous run's frames
+        PressureFrame.objects.filter(patient=patient).delete()
+        PressureData.objects.filter(patient=patient).delete()
+        if traced:
+            tracemalloc.start()
+        began = time.perf_counter()
+        with open(path, 'rb') as f:
+            stats = import_csv(f, patient, timezone.now(), chunk_bytes=chunk_bytes)
+        elapsed = time.perf_counter() - began
+        peak = None
+        if traced:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        return stats, elapsed, peak
+
+    def _frames(self, patient, frames, side):
+        """Parse many small mats with the old per-cell parsers and the vectorized one, then import them."""
+        rng = np.random.default_rng(2)
+        mats = []
+        for _ in range(frames):
+            grid = rng.uniform(0, 200, (side, side))
+            grid[rng.random((side, side)) < 0.05] = np.nan  # some blank cells
+            mats.append([','.join('' if np.isnan(v) else f'{v:.1f}' for v in row) for row in grid.tolist()])
+
+        timings = {}
+        for name, parse in (('row per cell', _row_per_cell), ('per-cell grid', _per_cell_grid), ('vectorized', matrix_block)):
+            began = time.perf_counter()
+            for lines in mats:
+                parse(lines)
+            timings[name] = time.perf_counter() - began
+        payloads = [('\n'.join(lines) + '\n').encode() for lines in mats]
+        began = time.perf_counter()
+        for payload in payloads:
+            import_csv(BytesIO(payload), patient, timezone.now())
+        imported = time.perf_counter() - began
+        vectorized = timings['vectorized']
+        self.stdout.write(f'{frames} {side}x{side} mats, parse only:')
+        for name, seconds in timings.items():
+            self.stdout.write(f'  {name:13} {frames / seconds:>8,.0f} frames/s  {seconds / vectorized:5.1f}x the vectorized time')
+        self.stdout.write(f'  full import incl. save {frames / imported:,.0f} frames/s')
+
+    @override_settings(DEBUG=False)  # the debug query log would hold every INSERT
+    def handle(self, *args, **options):
+        patient, _ = User.objects.get_or_create(username='bench_import', defaults={'role': 'patient'})
+        writers = {
+            'matrix': _write_matrix,
+            'header-cells': lambda path, n: _write_header(path, n, named=False),
+            'header-named': lambda path, n: _write_header(path, n, named=True),
+            'recording': lambda path, n: _write_recording(path, n, options['mat'], long=False),
+            'recording-long': lambda path, n: _write_recording(path, n, options['mat'], long=True),
+        }
+        try:
+            if options['frames']:
+                self._frames(patient, options['frames'], options['mat'])
+            with tempfile.TemporaryDirectory() as tmp:
+                for layout in filter(None, options['layouts'].split(',')):
+                    sizes = {}
+                    for values in (options['values'] // 4, options['values']):
+                        path = os.path.join(tmp, f'{layout}-{values}.csv')
+                        sizes[values] = (path, writers[layout](path, values))
+                    path, values = sizes[options['values']]
+                    stats, elapsed, _ = self._run(patient, path, options['chunk_bytes'], traced=False)
+                    line = (
+                        f'{layout:13} {values:>9} values, {os.path.getsize(path) / 2**20:6.1f} MiB '
+                        f'in {elapsed:6.2f}s = {values / elapsed:>10,.0f} values/s ({stats.rows:,} lines, {stats.frames:,} frames)'
+                    )
+                    if not options['skip_memory']:
+                        peaks = [self._run(patient, p, options['chunk_bytes'], traced=True)[2] for p, _ in sizes.values()]
+                        line += f'; peak traced memory {peaks[0] / 2**20:.1f} MiB at 1/4 size, {peaks[1] / 2**20:.1f} MiB at full size'
+                    self.stdout.write(line)
+        finally:
+            patient.delete()
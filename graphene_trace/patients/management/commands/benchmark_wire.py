@@ -0,0 +1,56 @@
+import gzip
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from patients import cache as live_cache
+from patients import wire
+from patients.models import PressureFrame
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Compare the size and build time of the JSON and binary live grid/series payloads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mats', default='16,32,64', help='Comma-separated square mat sizes')
+        parser.add_argument('--repeat', type=int, default=50, help='Builds timed per payload')
+
+    def _time(self, kind, patient, fmt, repeat):
+        # Time a cache miss: the queries plus the serialisation
+        began = time.perf_counter()
+        for _ in range(repeat):
+            _, content = live_cache.BUILDERS[kind](patient, fmt)
+        return content, 1000 * (time.perf_counter() - began) / repeat
+
+    def handle(self, *args, **options):
+        patient, _ = User.objects.get_or_create(username='bench_wire', defaults={'role': 'patient'})
+        rng = np.random.default_rng(0)
+        now = timezone.now()
+        try:
+            for size in (int(s) for s in options['mats'].split(',') if s):
+                PressureFrame.objects.filter(patient=patient).delete()
+                # Enough frames to fill the series; every cell has a reading
+                PressureFrame.objects.bulk_create([
+                    PressureFrame.from_grid(patient, now - timedelta(seconds=2 * i), rng.uniform(0, 150, (size, size)))
+                    for i in range(100)
+                ])
+                self.stdout.write(f'{size}x{size} mat:')
+                for kind in live_cache.KINDS:
+                    results = {fmt: self._time(kind, patient, fmt, options['repeat']) for fmt in wire.FORMATS}
+                    for fmt, (content, ms) in results.items():
+                        self.stdout.write(
+                            f'  {kind:<6} {fmt:<6} {len(content):>9,} bytes  gzip {len(gzip.compress(content)):>9,} bytes  '
+                            f'build {ms:.2f} ms'
+                        )
+                    (json_body, json_ms), (binary_body, binary_ms) = results['json'], results['binary']
+                    self.stdout.write(
+                        f'  {kind:<6} binary is {len(json_body) / len(binary_body):.1f}x smaller, '
+                        f'{json_ms / binary_ms:.1f}x faster to build'
+                    )
+        finally:
+            patient.delete()
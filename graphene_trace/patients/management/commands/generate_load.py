@@ -0,0 +1,126 @@
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from django.utils import timezone
+from patients.frames import DTYPE
+from patients.importer import ParsedFile, write_parsed
+
+User = get_user_model()
+
+FRAMES_PER_WRITE = 1000
+
+# Body contact points on a mat, as (row, col) fractions of the mat, relative
+# spread and typical pressure (mmHg) lying supine: head, shoulders, sacrum, heels
+CONTACTS = np.array([
+    (0.08, 0.50, 0.07, 35.0),
+    (0.22, 0.30, 0.09, 45.0),
+    (0.22, 0.70, 0.09, 45.0),
+    (0.55, 0.50, 0.12, 75.0),
+    (0.92, 0.40, 0.05, 60.0),
+    (0.92, 0.60, 0.05, 60.0),
+])
+POSTURE_HOURS = 2.0  # mean time before the patient is repositioned
+
+
+def postures(total_hours, rng):
+    """Reposition times (hours from the start), with each posture's sideways shift and tilt."""
+    changes = np.cumsum(rng.exponential(POSTURE_HOURS, size=int(total_hours / POSTURE_HOURS * 3) + 2))
+    return changes, rng.normal(0, 0.05, len(changes) + 1), rng.uniform(-0.4, 0.4, len(changes) + 1)
+
+
+def pressure_frames(rows, cols, hours, schedule, rng):
+    """
+    Synthetic mat frames at `hours` (from the start), shape (len(hours), rows, cols).
+
+    Each contact point is a Gaussian blob. The body shifts and tilts at each
+    reposition in `schedule` (see postures), and pressure under a posture
+    builds up the longer it is held, so long stretches in one position cross
+    the alert threshold.
+    """
+    changes, shifts, tilts = schedule
+    posture = np.searchsorted(changes, hours)
+    shift, tilt = shifts[posture], tilts[posture]
+    held = hours - np.concatenate([[0.0], changes])[posture]  # hours in the current posture
+
+    r = np.arange(rows, dtype=np.float32)[:, None] / rows
+    c = np.arange(cols, dtype=np.float32)[None, :] / cols
+    frames = np.zeros((len(hours), rows, cols), dtype=np.float32)
+    for row, col, spread, load in CONTACTS:
+        centre_c = (col + shift)[:, None, None]
+        # Tilting loads one side of the body and unloads the other
+        side = 1.0 + tilt * np.sign(col - 0.5)
+        build = 1.0 + 0.15 * np.minimum(held, 3.0)
+        amplitude = (load * side * build * rng.normal(1.0, 0.04, len(hours))).astype(np.float32)[:, None, None]
+        frames += amplitude * np.exp(-((r - row) ** 2 + (c - centre_c) ** 2) / (2 * spread ** 2))
+    frames += rng.normal(0, 1.5, frames.shape).astype(np.float32)
+    frames[frames < 5] = np.nan  # no contact: the mat reports no reading
+    return frames.astype(DTYPE)
+
+
+class Command(BaseCommand):
+    help = 'Create synthetic patients, clinicians and days of pressure-mat frames for load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patients', type=int, default=20, help='Patients to create')
+        parser.add_argument('--clinicians', type=int, default=2, help='Clinicians; patients are assigned round-robin')
+        parser.add_argument('--mat', default='32x32', help='Mat size as ROWSxCOLS')
+        parser.add_argument('--interval', type=float, default=60.0, help='Seconds between frames (1 = 1 Hz)')
+        parser.add_argument('--days', type=float, default=1.0, help='Days of data per patient, ending now')
+        parser.add_argument('--prefix', default='load', help='Username prefix for the generated users')
+        parser.add_argument('--password', default='load', help='Password given to every generated user')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed')
+        parser.add_argument('--clear', action='store_true', help='Delete users with this prefix (and their data) first')
+
+    @override_settings(DEBUG=False)  # the debug query log would hold every INSERT
+    def handle(self, *args, **options):
+        try:
+            rows, cols = (int(n) for n in options['mat'].lower().split('x'))
+        except ValueError:
+            raise CommandError('--mat must look like 32x32')
+        prefix = options['prefix']
+        if options['clear']:
+            deleted = User.objects.filter(username__startswith=f'{prefix}-').delete()[1].get(User._meta.label, 0)
+            self.stdout.write(f'Deleted {deleted} {prefix}- users and their data')
+        if User.objects.filter(username__startswith=f'{prefix}-').exists():
+            raise CommandError(f"Users named '{prefix}-...' exist already; use --clear or another --prefix")
+
+        password = make_password(options['password'])  # hashed once, shared by every generated user
+        admin = User.objects.create(username=f'{prefix}-admin', role='admin', password=password)
+        clinicians = [
+            User.objects.create(username=f'{prefix}-clinician-{i:03d}', role='clinician', password=password)
+            for i in range(options['clinicians'])
+        ]
+        patients = [
+            User.objects.create(
+                username=f'{prefix}-patient-{i:04d}', role='patient', password=password,
+                clinician=clinicians[i % len(clinicians)] if clinicians else None,
+            )
+            for i in range(options['patients'])
+        ]
+
+        rng = np.random.default_rng(options['seed'])
+        end = timezone.now().replace(microsecond=0)
+        count = max(1, int(options['days'] * 86400 / options['interval']))
+        offsets = np.arange(count)[::-1] * options['interval']  # seconds before `end`, oldest first
+        began = time.perf_counter()
+        frames = 0
+        for patient in patients:
+            schedule = postures(offsets[0] / 3600.0, rng)
+            for first in range(0, count, FRAMES_PER_WRITE):
+                seconds = offsets[first:first + FRAMES_PER_WRITE]
+                parsed = ParsedFile()
+                hours = (offsets[0] - seconds) / 3600.0
+                for grid, ago in zip(pressure_frames(rows, cols, hours, schedule, rng), seconds.tolist()):
+                    parsed.frame(end - timedelta(seconds=ago), grid)
+                frames += write_parsed(parsed, patient).frames
+        elapsed = time.perf_counter() - began
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {admin.username}, {len(clinicians)} clinicians and {len(patients)} patients '
+            f"(password '{options['password']}'): {frames:,} {rows}x{cols} frames "
+            f'in {elapsed:.1f}s = {frames / elapsed if elapsed else 0:,.0f} frames/s'
+        ))
@@ -0,0 +1,47 @@
+import time
+from datetime import datetime, time as _time, timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from patients import cache as live_cache
+from patients.rollups import rebuild
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Recompute the per-minute/per-hour pressure rollups from the raw readings and frames'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', required=False, help='Only rebuild this patient (default: every patient)', default=None)
+        parser.add_argument('--start', required=False, help='First date (YYYY-MM-DD) to rebuild', default=None)
+        parser.add_argument('--end', required=False, help='Last date (YYYY-MM-DD) to rebuild, inclusive', default=None)
+
+    def _date(self, value, label):
+        try:
+            d = datetime.strptime(value, '%Y-%m-%d').date()
+        except ValueError:
+            raise CommandError(f'Invalid {label} date format, use YYYY-MM-DD')
+        return datetime.combine(d, _time.min).replace(tzinfo=timezone.get_current_timezone())
+
+    def handle(self, *args, **options):
+        start = self._date(options['start'], 'start') if options['start'] else None
+        end = self._date(options['end'], 'end') + timedelta(days=1) - timedelta(microseconds=1) if options['end'] else None
+
+        patients = User.objects.filter(role='patient')
+        if options['username']:
+            patients = patients.filter(username=options['username'])
+            if not patients.exists():
+                raise CommandError(f"Patient user '{options['username']}' not found")
+
+        began = time.perf_counter()
+        total = 0
+        for patient in patients.order_by('id').iterator():
+            written = rebuild(patient, start, end)
+            live_cache.invalidate(patient.id)
+            total += written
+            if written:
+                self.stdout.write(f'{patient.username}: {written} rollup rows')
+        elapsed = time.perf_counter() - began
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {total} rollup rows in {elapsed:.1f}s'))
@@ -0,0 +1,39 @@
+import asyncio
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from patients.gateway import Gateway
+
+
+class Command(BaseCommand):
+    help = 'Accept length-prefixed binary frames from bedside hubs over TCP and write them in micro-batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default=settings.GATEWAY_HOST)
+        parser.add_argument('--port', type=int, default=settings.GATEWAY_PORT)
+        parser.add_argument('--batch-frames', type=int, default=settings.GATEWAY_BATCH_FRAMES, help='Most frames per write')
+        parser.add_argument('--batch-delay', type=float, default=settings.GATEWAY_BATCH_DELAY, help='Seconds a batch waits to fill')
+        parser.add_argument('--queue-frames', type=int, default=settings.GATEWAY_QUEUE_FRAMES, help='Queued frames before reads pause')
+        parser.add_argument('--report-interval', type=float, default=10.0, help='Seconds between stats lines (0 = none)')
+
+    async def serve(self, options):
+        gateway = Gateway(options['batch_frames'], options['batch_delay'], options['queue_frames'])
+        server = await gateway.start(options['host'], options['port'])
+        for sock in server.sockets:
+            self.stdout.write(f'Device gateway listening on {sock.getsockname()[0]}:{sock.getsockname()[1]}')
+        try:
+            while True:
+                await asyncio.sleep(options['report_interval'] or 3600)
+                if options['report_interval']:
+                    report = gateway.stats.report(gateway.queue.qsize(), options['report_interval'])
+                    self.stdout.write(json.dumps(report, sort_keys=True))
+        finally:
+            await gateway.close()
+            self.stdout.write(f'Stopped; {json.dumps(gateway.stats.acks, sort_keys=True)}')
+
+    def handle(self, *args, **options):
+        try:
+            asyncio.run(self.serve(options))
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+from patients import jobs
+
+
+class Command(BaseCommand):
+    help = 'Run queued CSV import jobs (use with GRAPHENE_IMPORT_WORKER=command)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run what is queued now and exit instead of polling')
+        parser.add_argument('--interval', type=float, default=2.0, help='Seconds to sleep when the queue is empty')
+
+    def handle(self, *args, **options):
+        done = failed = 0
+        try:
+            while True:
+                requeued = jobs.requeue_stale()
+                if requeued:
+                    self.stdout.write(self.style.WARNING(f'Requeued {requeued} import jobs whose worker stopped'))
+                job = jobs.run_next()
+                if job is None:
+                    if options['once']:
+                        break
+                    time.sleep(options['interval'])
+                    continue
+                if job.status == job.DONE:
+                    done += 1
+                    self.stdout.write(f'Job {job.id} ({job.file_name}): {job.rows} rows at {job.rows_per_second:,.0f} rows/s')
+                elif job.status == job.SKIPPED:
+                    done += 1
+                    self.stdout.write(f'Job {job.id} ({job.file_name}) skipped: {job.error}')
+                else:
+                    failed += 1
+                    self.stdout.write(self.style.WARNING(f'Job {job.id} ({job.file_name}) failed: {job.error}'))
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f'Ran {done + failed} import jobs; {failed} failed'))
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+from patients import outbox
+
+
+class Command(BaseCommand):
+    help = 'Send queued high-pressure alert emails as per-patient digests, retrying failures with backoff'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Drain what is due now and exit instead of polling')
+        parser.add_argument('--interval', type=float, default=10.0, help='Seconds to sleep when the outbox is empty')
+        parser.add_argument('--batch-size', type=int, default=outbox.BATCH_SIZE, help='Outbox rows per batch')
+
+    def handle(self, *args, **options):
+        total_emails = total_alerts = total_failed = 0
+        try:
+            while True:
+                emails, alerts, failed = outbox.drain(options['batch_size'])
+                total_emails += emails
+                total_alerts += alerts
+                total_failed += failed
+                if emails or failed:
+                    self.stdout.write(f'Sent {emails} emails ({alerts} alerts), {failed} alerts failed')
+                if alerts + failed == options['batch_size']:
+                    continue  # full batch: more may be due
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(
+            f'Sent {total_emails} emails for {total_alerts} alerts; {total_failed} alerts failed'
+        ))
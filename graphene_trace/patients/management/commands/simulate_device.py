@@ -0,0 +1,161 @@
+import json
+import statistics
+import time
+import urllib.request
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from patients import devices, wire
+from patients.management.commands.generate_load import postures, pressure_frames
+from patients.models import Device
+
+User = get_user_model()
+
+PREFIX = 'device-sim-'
+POOL = 60  # distinct frames generated per mat and sent in rotation
+ACKS = ('stored', 'duplicate', 'rejected')
+
+
+def create_mats(mats, prefix=PREFIX):
+    """Create `mats` throwaway patients and a device for them; return (patients, device, token)."""
+    # Leftovers from an interrupted run
+    User.objects.filter(username__startswith=prefix, role='patient').delete()
+    Device.objects.filter(name__startswith=prefix).delete()
+    patients = []
+    for i in range(mats):
+        patient = User(username=f'{prefix}{i}', role='patient')
+        patient.set_unusable_password()
+        patient.save()
+        patients.append(patient)
+    device = Device(name=f'{prefix}hub')
+    token = devices.issue_token(device)
+    device.save()
+    device.patients.add(*patients)
+    return patients, device, token
+
+
+def frame_pools(mats, rows, cols, cell_type, scale, seed=0):
+    """POOL encoded cell buffers per mat (see patients.wire.encode_cells), to send in rotation."""
+    rng = np.random.default_rng(seed)
+    hours = np.linspace(0, 1, POOL)
+    return [
+        [wire.encode_cells(grid, cell_type, scale) for grid in pressure_frames(rows, cols, hours, postures(1, rng), rng)]
+        for _ in range(mats)
+    ]
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+class Command(BaseCommand):
+    help = (
+        'Act as bedside devices: post binary frames for throwaway patients to the ingest API '
+        'and report sustained frames/s and request latency. Runs against this process through '
+        'the test client, or against a server sharing this settings module with --base-url.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mats', type=int, default=4, help='Simulated mats, one throwaway patient each')
+        parser.add_argument('--rate', type=float, default=0, help='Frames per second per mat (0 = as fast as the server takes them)')
+        parser.add_argument('--seconds', type=float, default=10, help='How long to send')
+        parser.add_argument('--frames-per-request', type=int, default=20, help='Frames batched into each request')
+        parser.add_argument('--size', default='32x32', help='Mat rows x cols')
+        parser.add_argument('--cell-type', choices=('float32', 'uint16'), default='float32')
+        parser.add_argument('--base-url', help='Running server to post to (default: in-process test client)')
+        parser.add_argument('--keep', action='store_true', help='Keep the throwaway patients, device and frames')
+
+    def _poster(self, base_url, token):
+        path = reverse('ingest_frames')
+        if base_url is None:
+            client = Client()
+
+            def post(body):
+                response = client.post(path, body, content_type=wire.FRAME_CONTENT_TYPE, HTTP_AUTHORIZATION=f'Bearer {token}')
+                return response.status_code, response.content
+            return post
+
+        def post(body):
+            request = urllib.request.Request(base_url.rstrip('/') + path, data=body, method='POST', headers={
+                'Content-Type': wire.FRAME_CONTENT_TYPE, 'Authorization': f'Bearer {token}',
+            })
+            with urllib.request.urlopen(request) as response:
+                return response.status, response.read()
+        return post
+
+    def _send(self, post, patients, pools, options, rows, cols, cell_type, scale):
+        """Post frames until --seconds is up; return (seconds, request latencies, ack counts, bytes sent)."""
+        # Timestamps start a day back so fast runs never get ahead of the server clock
+        start_ms = int((timezone.now().timestamp() - 86400) * 1000)
+        step_ms = int(1000 / options['rate']) if options['rate'] else 10
+        seq = [0] * len(patients)
+        per_request = options['frames_per_request']
+        latencies, counts, sent_bytes = [], dict.fromkeys(ACKS + ('http_errors',), 0), 0
+        began = time.perf_counter()
+        deadline = began + options['seconds']
+        mat = 0
+        while time.perf_counter() < deadline:
+            if options['rate']:
+                # Send once the mats have produced a request's worth of frames
+                due = began + (sum(seq) + per_request) / (options['rate'] * len(patients))
+                time.sleep(max(0.0, due - time.perf_counter()))
+            records = []
+            for _ in range(per_request):
+                n = seq[mat]
+                records.append(wire.FRAME_HEADER.pack(
+                    patients[mat].pk, start_ms + n * step_ms, rows, cols, cell_type, scale,
+                ) + pools[mat][n % POOL])
+                seq[mat] += 1
+                mat = (mat + 1) % len(patients)
+            body = b''.join(records)
+            sent_bytes += len(body)
+            t0 = time.perf_counter()
+            status, content = post(body)
+            latencies.append(time.perf_counter() - t0)
+            if status != 200:
+                if not counts['http_errors']:
+                    self.stderr.write(f'HTTP {status}: {content[:200]!r}')
+                counts['http_errors'] += 1
+                continue
+            reply = json.loads(content)
+            for ack in ACKS:
+                counts[ack] += reply[ack]
+        return time.perf_counter() - began, latencies, counts, sent_bytes
+
+    @override_settings(DEBUG=False)
+    def handle(self, *args, **options):
+        rows, cols = (int(n) for n in options['size'].lower().split('x'))
+        cell_type = wire.UINT16 if options['cell_type'] == 'uint16' else wire.FLOAT32
+        scale = 0.01 if cell_type == wire.UINT16 else 1.0
+        patients, device, token = create_mats(options['mats'])
+        try:
+            pools = frame_pools(len(patients), rows, cols, cell_type, scale)
+            post = self._poster(options['base_url'], token)
+            # The test client's requests come from 'testserver'
+            hosts = settings.ALLOWED_HOSTS if options['base_url'] else [*settings.ALLOWED_HOSTS, 'testserver']
+            with override_settings(ALLOWED_HOSTS=hosts):
+                elapsed, latencies, counts, sent_bytes = self._send(post, patients, pools, options, rows, cols, cell_type, scale)
+            ms = [1000 * v for v in latencies]
+            report = {
+                'mat': f'{rows}x{cols}', 'cell_type': options['cell_type'], 'mats': len(patients),
+                'frames_per_request': options['frames_per_request'], 'requests': len(latencies), 'seconds': round(elapsed, 2),
+                **counts,
+                'frames_per_second': round(counts['stored'] / elapsed, 1),
+                'megabytes_per_second': round(sent_bytes / elapsed / 1e6, 2),
+                'latency_ms_p50': round(_percentile(ms, 50), 2) if ms else None,
+                'latency_ms_p95': round(_percentile(ms, 95), 2) if ms else None,
+                'latency_ms_p99': round(_percentile(ms, 99), 2) if ms else None,
+                'latency_ms_mean': round(statistics.fmean(ms), 2) if ms else None,
+            }
+            self.stdout.write(json.dumps(report, indent=2))
+        finally:
+            if not options['keep']:
+                User.objects.filter(pk__in=[p.pk for p in patients]).delete()
+                device.delete()
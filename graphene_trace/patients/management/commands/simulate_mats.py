@@ -0,0 +1,141 @@
+import asyncio
+import json
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from django.utils import timezone
+from patients import wire
+from patients.gateway import ACK, STATUS_CODES, Gateway, message, read_message
+from patients.management.commands.simulate_device import POOL, _percentile, create_mats, frame_pools
+
+User = get_user_model()
+
+PREFIX = 'mat-sim-'
+ACK_WAIT = 10.0  # seconds to wait for outstanding acks after sending stops
+
+
+class _Mat:
+    """One hub connection streaming a mat's frames and timing each frame's ack."""
+
+    def __init__(self, patient_id, pool, rows, cols, cell_type, scale, start_ms, step_ms):
+        self.patient_id = patient_id
+        self.pool = pool
+        self.header = (rows, cols, cell_type, scale)
+        self.start_ms = start_ms
+        self.step_ms = step_ms
+        self.sent = {}  # frame number -> send time, until acked
+        self.latencies = []
+        self.acks = dict.fromkeys(STATUS_CODES, 0)
+
+    async def _receive(self, reader):
+        names = {code: name for name, code in STATUS_CODES.items()}
+        while True:
+            payload = await read_message(reader, 1 << 24)
+            now = time.perf_counter()
+            for number, status, _ in ACK.iter_unpack(payload):
+                self.latencies.append(now - self.sent.pop(number))
+                self.acks[names[status]] += 1
+
+    async def run(self, host, port, token, rate, seconds):
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write(message(token.encode()))
+        reply = await read_message(reader, 256)
+        if reply != b'OK':
+            raise CommandError(f'Gateway refused the connection: {reply.decode(errors="replace")}')
+        receiver = asyncio.create_task(self._receive(reader))
+        began = time.perf_counter()
+        number = 0
+        try:
+            while time.perf_counter() - began < seconds:
+                if rate:
+                    await asyncio.sleep(max(0.0, began + number / rate - time.perf_counter()))
+                record = wire.FRAME_HEADER.pack(self.patient_id, self.start_ms + number * self.step_ms, *self.header)
+                self.sent[number] = time.perf_counter()
+                writer.write(message(record + self.pool[number % POOL]))
+                await writer.drain()  # blocks while the gateway isn't reading (backpressure)
+                number += 1
+            waited = time.perf_counter()
+            while self.sent and time.perf_counter() - waited < ACK_WAIT and not receiver.done():
+                await asyncio.sleep(0.01)
+        finally:
+            receiver.cancel()
+            writer.close()
+        return number
+
+
+class Command(BaseCommand):
+    help = (
+        'Stream frames from N simulated mats over TCP to the device gateway and report throughput and '
+        'ack latency. Starts a gateway in this process unless --port names a running one '
+        '(which must share this settings module).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mats', type=int, default=50, help='Concurrent mat connections, one throwaway patient each')
+        parser.add_argument('--rate', type=float, default=2.0, help='Frames per second per mat (0 = as fast as the gateway takes them)')
+        parser.add_argument('--seconds', type=float, default=10, help='How long to send')
+        parser.add_argument('--size', default='32x32', help='Mat rows x cols')
+        parser.add_argument('--cell-type', choices=('float32', 'uint16'), default='float32')
+        parser.add_argument('--host', default=settings.GATEWAY_HOST)
+        parser.add_argument('--port', type=int, help='Running gateway to connect to (default: start one here)')
+        parser.add_argument('--batch-frames', type=int, default=settings.GATEWAY_BATCH_FRAMES, help='For the in-process gateway')
+        parser.add_argument('--batch-delay', type=float, default=settings.GATEWAY_BATCH_DELAY, help='For the in-process gateway')
+        parser.add_argument('--queue-frames', type=int, default=settings.GATEWAY_QUEUE_FRAMES, help='For the in-process gateway')
+        parser.add_argument('--keep', action='store_true', help='Keep the throwaway patients, device and frames')
+
+    async def simulate(self, mats, token, options):
+        gateway = None
+        host, port = options['host'], options['port']
+        if port is None:
+            gateway = Gateway(options['batch_frames'], options['batch_delay'], options['queue_frames'])
+            server = await gateway.start(host, 0)
+            port = server.sockets[0].getsockname()[1]
+        try:
+            began = time.perf_counter()
+            sent = await asyncio.gather(*(mat.run(host, port, token, options['rate'], options['seconds']) for mat in mats))
+            elapsed = time.perf_counter() - began
+            stats = gateway.stats.report(gateway.queue.qsize(), elapsed) if gateway else None
+        finally:
+            if gateway:
+                await gateway.close()
+        return sum(sent), elapsed, stats
+
+    @override_settings(DEBUG=False)
+    def handle(self, *args, **options):
+        rows, cols = (int(n) for n in options['size'].lower().split('x'))
+        cell_type = wire.UINT16 if options['cell_type'] == 'uint16' else wire.FLOAT32
+        scale = 0.01 if cell_type == wire.UINT16 else 1.0
+        patients, device, token = create_mats(options['mats'], PREFIX)
+        try:
+            pools = frame_pools(len(patients), rows, cols, cell_type, scale)
+            # Timestamps start a day back so fast runs never get ahead of the server clock
+            start_ms = int((timezone.now().timestamp() - 86400) * 1000)
+            step_ms = int(1000 / options['rate']) if options['rate'] else 10
+            mats = [
+                _Mat(patient.pk, pool, rows, cols, cell_type, scale, start_ms, step_ms)
+                for patient, pool in zip(patients, pools)
+            ]
+            sent, elapsed, gateway_stats = asyncio.run(self.simulate(mats, token, options))
+            ms = [1000 * v for mat in mats for v in mat.latencies]
+            acks = {name: sum(mat.acks[name] for mat in mats) for name in STATUS_CODES}
+            report = {
+                'mat': f'{rows}x{cols}', 'cell_type': options['cell_type'], 'mats': len(mats),
+                'rate_per_mat': options['rate'], 'seconds': round(elapsed, 2),
+                'sent': sent, **acks, 'unacked': sent - sum(acks.values()),
+                'frames_per_second': round(acks['stored'] / elapsed, 1),
+                'ack_latency_ms_p50': round(_percentile(ms, 50), 2) if ms else None,
+                'ack_latency_ms_p95': round(_percentile(ms, 95), 2) if ms else None,
+                'ack_latency_ms_p99': round(_percentile(ms, 99), 2) if ms else None,
+                'ack_latency_ms_mean': round(statistics.fmean(ms), 2) if ms else None,
+            }
+            if gateway_stats:
+                report['gateway'] = gateway_stats
+            self.stdout.write(json.dumps(report, indent=2))
+        finally:
+            if not options['keep']:
+                User.objects.filter(pk__in=[p.pk for p in patients]).delete()
+                device.delete()
@@ -0,0 +1,220 @@
+import asyncio
+import json
+import statistics
+import time
+from importlib import import_module
+from urllib.parse import urlsplit
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+from django.utils import timezone
+from patients import cache as live_cache
+from patients.models import PressureFrame
+from patients.reposition import rebuild
+
+User = get_user_model()
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+async def _read_body(reader, chunked):
+    """Yield raw body bytes, undoing chunked transfer encoding if needed."""
+    if not chunked:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                return
+            yield data
+    while True:
+        size = int((await reader.readline()).split(b';')[0].strip() or b'0', 16)
+        if size == 0:
+            return
+        yield await reader.readexactly(size)
+        await reader.readline()
+
+
+class Command(BaseCommand):
+    help = (
+        'Open many idle SSE live streams against a running ASGI server, ingest frames, '
+        'and report delivery latency. The server must share this settings module '
+        '(database and session store). Streams are spread over --patients throwaway '
+        'patients (deleted afterwards) unless --username names an existing one.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', help='Existing patient to stream and ingest for (use a test patient)')
+        parser.add_argument('--patients', type=int, default=1, help='Throwaway patients to spread the streams over')
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000', help='Server base URL')
+        parser.add_argument('--connections', type=int, default=1000, help='Concurrent open streams')
+        parser.add_argument('--frames', type=int, default=20, help='Frames to ingest once all streams are open (round-robin over patients)')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds between ingested frames')
+        parser.add_argument('--idle', type=float, default=5.0, help='Seconds to hold the streams idle before ingesting')
+        parser.add_argument('--size', type=int, default=32, help='Mat size (rows = cols)')
+        parser.add_argument('--keep', action='store_true', help='Keep the frames ingested for --username instead of deleting them')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        if options['username']:
+            try:
+                patients = [User.objects.get(username=options['username'], role='patient')]
+            except User.DoesNotExist:
+                raise CommandError(f"Patient user '{options['username']}' not found")
+        else:
+            # Leftovers from an interrupted run
+            User.objects.filter(username__startswith='sse-load-', role='patient').delete()
+            patients = []
+            for i in range(options['patients']):
+                patient = User(username=f'sse-load-{i}', role='patient')
+                patient.set_unusable_password()
+                patient.save()
+                patients.append(patient)
+        try:
+            report = asyncio.run(self._run(patients, options))
+        finally:
+            if not options['username']:
+                User.objects.filter(id__in=[p.id for p in patients]).delete()
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        for key, value in report.items():
+            self.stdout.write(f'{key:>24}: {value}')
+
+    def _session_cookie(self, patient):
+        store = import_module(settings.SESSION_ENGINE).SessionStore()
+        store[SESSION_KEY] = str(patient.pk)
+        store[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+        store[HASH_SESSION_KEY] = patient.get_session_auth_hash()
+        store.save()
+        return f'{settings.SESSION_COOKIE_NAME}={store.session_key}'
+
+    def _cleanup(self, patients, frame_ids):
+        PressureFrame.objects.filter(id__in=frame_ids).delete()
+        for patient in patients:
+            rebuild(patient)
+            live_cache.invalidate(patient.pk)
+
+    async def _run(self, patients, options):
+        url = urlsplit(options['base_url'])
+        host, port = url.hostname, url.port or 80
+        requests = []
+        for patient in patients:
+            cookie = await sync_to_async(self._session_cookie)(patient)
+            requests.append((
+                f"GET {reverse('live_stream')} HTTP/1.1\r\nHost: {url.netloc}\r\n"
+                f"Cookie: {cookie}\r\nAccept: text/event-stream\r\n\r\n"
+            ).encode())
+
+        sent_at = {}  # frame timestamp (iso) -> perf_counter at ingest
+        latencies = []
+        connected = []
+        failures = []
+        all_connected = asyncio.Event()
+
+        async def client(request):
+            try:
+                reader, writer = await asyncio.open_connection(host, port)
+                writer.write(request)
+                await writer.drain()
+                status = await reader.readline()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b''):
+                        break
+                    name, _, value = line.decode().partition(':')
+                    headers[name.strip().lower()] = value.strip().lower()
+                if b' 200 ' not in status or 'text/event-stream' not in headers.get('content-type', ''):
+                    failures.append(status.decode().strip())
+                    writer.close()
+                    return
+                connected.append(writer)
+            except OSError as exc:
+                failures.append(str(exc))
+                return
+            finally:
+                if len(connected) + len(failures) == options['connections']:
+                    all_connected.set()
+            buffer = b''
+            event = None
+            try:
+                async for data in _read_body(reader, headers.get('transfer-encoding') == 'chunked'):
+                    buffer += data
+                    while b'\n' in buffer:
+                        line, buffer = buffer.split(b'\n', 1)
+                        if line.startswith(b'event: '):
+                            event = line[7:].decode()
+                        elif line.startswith(b'data: ') and event == 'grid':
+                            # Pull out the timestamp without parsing the whole grid, so
+                            # the client doesn't dominate the measured latency
+                            start = line.rfind(b'"timestamp": "') + 14
+                            ts = line[start:line.find(b'"', start)].decode()
+                            if ts in sent_at:
+                                latencies.append(time.perf_counter() - sent_at[ts])
+            except (asyncio.CancelledError, ConnectionError):
+                pass
+
+        started = time.perf_counter()
+        tasks = []
+        for i in range(options['connections']):
+            tasks.append(asyncio.create_task(client(requests[i % len(requests)])))
+            await asyncio.sleep(0)  # don't flood the accept backlog in one burst
+        try:
+            await asyncio.wait_for(all_connected.wait(), timeout=60)
+        except asyncio.TimeoutError:
+            pass
+        connect_time = time.perf_counter() - started
+        await asyncio.sleep(options['idle'])
+
+        size = options['size']
+        rng = np.random.default_rng()
+        frame_ids = []
+
+        def ingest(patient):
+            # Values stay below the alert threshold so the test sends no notifications
+            grid = rng.uniform(0, 60, (size, size)).astype('<f4')
+            frame = PressureFrame.from_grid(patient, timezone.now(), grid)
+            sent_at[frame.timestamp.isoformat()] = time.perf_counter()
+            frame.save()
+            frame_ids.append(frame.id)
+
+        for i in range(options['frames']):
+            await sync_to_async(ingest)(patients[i % len(patients)])
+            await asyncio.sleep(options['interval'])
+        await asyncio.sleep(2)  # let the last frame drain
+
+        for writer in connected:
+            writer.close()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if options['username'] and not options['keep']:
+            await sync_to_async(self._cleanup)(patients, frame_ids)
+
+        # Each frame is expected on every stream open for its patient
+        viewers = [0] * len(patients)
+        for i in range(len(connected)):
+            viewers[i % len(patients)] += 1
+        expected = sum(viewers[i % len(patients)] for i in range(options['frames']))
+        ms = [v * 1000 for v in latencies]
+        return {
+            'patients': len(patients),
+            'connections_open': len(connected),
+            'connection_failures': len(failures),
+            'failure_sample': failures[0] if failures else None,
+            'connect_all_seconds': round(connect_time, 2),
+            'frames_ingested': options['frames'],
+            'deliveries': f'{len(latencies)}/{expected}',
+            'latency_ms_p50': round(statistics.median(ms), 1) if ms else None,
+            'latency_ms_p95': round(_percentile(ms, 95), 1) if ms else None,
+            'latency_ms_p99': round(_percentile(ms, 99), 1) if ms else None,
+            'latency_ms_max': round(max(ms), 1) if ms else None,
+        }
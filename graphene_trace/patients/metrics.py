@@ -0,0 +1,327 @@
+"""
+Per-view request metrics, kept in memory by each process.
+
+MetricsMiddleware records, per resolved URL name, wall time, database time,
+query count, response bytes, status class and application cache hits/misses
+(see count_cache). It runs in sync (WSGI) and async (ASGI) stacks alike.
+Every database connection gets an execute wrapper when it opens (instrument,
+connected in PatientsConfig.ready), which charges each query to the request
+in a context variable. So a sync view run on a sync_to_async thread under
+ASGI is counted too, and nothing depends on DEBUG query logging. A thread a
+view starts itself is only counted if it runs in a copy of the request's
+context (contextvars.copy_context).
+
+Each thread writes to its own shard, so recording takes no lock. snapshot()
+merges the shards when the metrics page is read, and folds the shards of
+finished threads into one retired total.
+
+A request slower than METRICS_SLOW_REQUEST_MS logs its METRICS_SLOW_QUERIES
+slowest queries with the view name. The newest METRICS_SLOW_SAMPLES of those
+are kept for the metrics page too.
+"""
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Upper bucket bounds; each histogram has one more bucket for larger values
+MS_BOUNDS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+QUERY_BOUNDS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+BYTE_BOUNDS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+HISTOGRAMS = {'wall_ms': MS_BOUNDS, 'db_ms': MS_BOUNDS, 'queries': QUERY_BOUNDS, 'bytes': BYTE_BOUNDS}
+
+STARTED = timezone.now()
+
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def merge(self, other):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.sum += other.sum
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (None if empty or past the last bound)."""
+        total = sum(self.counts)
+        if not total:
+            return None
+        rank, seen = q * total, 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+    def as_dict(self):
+        total = sum(self.counts)
+        return {
+            'count': total,
+            'sum': round(self.sum, 3),
+            'mean': round(self.sum / total, 3) if total else None,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'buckets': dict(zip([*map(str, self.bounds), '+Inf'], self.counts)),
+        }
+
+
+class ViewStats:
+    __slots__ = ('histograms', 'status', 'cache')
+
+    def __init__(self):
+        self.histograms = {name: Histogram(bounds) for name, bounds in HISTOGRAMS.items()}
+        self.status = {}  # '2xx' -> count
+        self.cache = {}  # (cache, 'hit' or 'miss') -> count
+
+    def merge(self, other):
+        for name, histogram in other.histograms.items():
+            self.histograms[name].merge(histogram)
+        for key, count in list(other.status.items()):
+            self.status[key] = self.status.get(key, 0) + count
+        for key, count in list(other.cache.items()):
+            self.cache[key] = self.cache.get(key, 0) + count
+
+
+_local = threading.local()
+_current = ContextVar('metrics_request', default=None)  # the _Request being served
+_shards = []  # (thread, {view: ViewStats}), one per thread that served a request
+_retired = {}  # merged stats of threads that have finished
+_shards_lock = threading.Lock()  # taken when a thread first records, and by snapshot()
+slow_samples = deque(maxlen=settings.METRICS_SLOW_SAMPLES)
+
+
+def _shard():
+    try:
+        return _local.shard
+    except AttributeError:
+        _local.shard = {}
+        with _shards_lock:
+            _shards.append((threading.current_thread(), _local.shard))
+        return _local.shard
+
+
+class _Request:
+    """What one request has done so far; the execute wrapper for its queries."""
+    __slots__ = ('queries', 'db_seconds', 'timings', 'cache')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.timings = []  # (seconds, sql)
+        self.cache = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        began = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - began
+            self.queries += 1
+            self.db_seconds += elapsed
+            self.timings.append((elapsed, sql))
+
+
+def _timed(execute, sql, params, many, context):
+    current = _current.get()
+    if current is None:
+        return execute(sql, params, many, context)
+    return current(execute, sql, params, many, context)
+
+
+def instrument(sender, connection, **kwargs):
+    """connection_created receiver: charge the connection's queries to the current request."""
+    if _timed not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_timed)
+
+
+def count_cache(name, hit):
+    """Count a lookup in one of the application caches against the current request's view."""
+    current = _current.get()
+    if current is not None:
+        key = (name, 'hit' if hit else 'miss')
+        current.cache[key] = current.cache.get(key, 0) + 1
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else '<unresolved>'
+
+
+def record(view, wall_seconds, current, status, size):
+    shard = _shard()
+    stats = shard.get(view)
+    if stats is None:
+        stats = shard[view] = ViewStats()
+    histograms = stats.histograms
+    histograms['wall_ms'].observe(wall_seconds * 1000)
+    histograms['db_ms'].observe(current.db_seconds * 1000)
+    histograms['queries'].observe(current.queries)
+    if size is not None:
+        histograms['bytes'].observe(size)
+    key = f'{status // 100}xx'
+    stats.status[key] = stats.status.get(key, 0) + 1
+    for key, count in current.cache.items():
+        stats.cache[key] = stats.cache.get(key, 0) + count
+
+
+def _sample_slow(view, method, wall_seconds, current):
+    slowest = sorted(current.timings, key=lambda t: t[0], reverse=True)[:settings.METRICS_SLOW_QUERIES]
+    sample = {
+        'view': view,
+        'method': method,
+        'at': timezone.now().isoformat(),
+        'wall_ms': round(wall_seconds * 1000, 2),
+        'db_ms': round(current.db_seconds * 1000, 2),
+        'queries': current.queries,
+        'slowest': [{'ms': round(seconds * 1000, 3), 'sql': sql} for seconds, sql in slowest],
+    }
+    slow_samples.append(sample)
+    logger.warning(
+        'Slow request %s %s: %.0f ms, %d queries (%.0f ms in the database). Slowest queries:%s',
+        method, view, sample['wall_ms'], current.queries, sample['db_ms'],
+        ''.join(f"\n  {q['ms']:.1f} ms  {q['sql']}" for q in sample['slowest']) or ' none',
+    )
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        current = _Request()
+        token = _current.set(current)
+        began = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self._record(request, response, current, time.perf_counter() - began)
+        return response
+
+    async def __acall__(self, request):
+        current = _Request()
+        token = _current.set(current)
+        began = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self._record(request, response, current, time.perf_counter() - began)
+        return response
+
+    def _record(self, request, response, current, wall_seconds):
+        view = _view_name(request)
+        size = None if response.streaming else len(response.content)
+        record(view, wall_seconds, current, response.status_code, size)
+        if wall_seconds * 1000 >= settings.METRICS_SLOW_REQUEST_MS:
+            _sample_slow(view, request.method, wall_seconds, current)
+
+
+def snapshot():
+    """Merged stats of every thread in this process: {view: ViewStats}."""
+    merged = {}
+    with _shards_lock:
+        alive = []
+        for thread, shard in _shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+                target = merged
+            else:
+                target = _retired  # finished: nothing writes to it any more
+            for view, stats in list(shard.items()):
+                target.setdefault(view, ViewStats()).merge(stats)
+        _shards[:] = alive
+        for view, stats in _retired.items():
+            merged.setdefault(view, ViewStats()).merge(stats)
+    return merged
+
+
+def as_json():
+    views = {}
+    for view, stats in sorted(snapshot().items()):
+        cache = {}
+        for (name, result), count in stats.cache.items():
+            cache.setdefault(name, {'hit': 0, 'miss': 0})[result] = count
+        views[view] = {
+            'requests': sum(stats.status.values()),
+            'status': dict(sorted(stats.status.items())),
+            'cache': cache,
+            **{name: histogram.as_dict() for name, histogram in stats.histograms.items()},
+        }
+    return {
+        'pid': os.getpid(),
+        'since': STARTED.isoformat(),
+        'views': views,
+        'slow_requests': list(slow_samples),
+    }
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def as_prometheus():
+    """The metrics in the Prometheus text exposition format."""
+    stats = sorted(snapshot().items())
+    lines = []
+    names = {
+        'wall_ms': ('graphene_request_duration_ms', 'Request wall time in milliseconds'),
+        'db_ms': ('graphene_request_db_ms', 'Database time per request in milliseconds'),
+        'queries': ('graphene_request_queries', 'Database queries per request'),
+        'bytes': ('graphene_response_bytes', 'Response body size in bytes'),
+    }
+    for key, (metric, text) in names.items():
+        lines += [f'# HELP {metric} {text}', f'# TYPE {metric} histogram']
+        for view, view_stats in stats:
+            histogram = view_stats.histograms[key]
+            cumulative = 0
+            for bound, count in zip([*map(str, histogram.bounds), '+Inf'], histogram.counts):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{view="{_label(view)}",le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_sum{{view="{_label(view)}"}} {histogram.sum:g}')
+            lines.append(f'{metric}_count{{view="{_label(view)}"}} {cumulative}')
+    lines += ['# HELP graphene_requests_total Requests by view and status class', '# TYPE graphene_requests_total counter']
+    for view, view_stats in stats:
+        for status, count in sorted(view_stats.status.items()):
+            lines.append(f'graphene_requests_total{{view="{_label(view)}",status="{status}"}} {count}')
+    lines += ['# HELP graphene_cache_total Application cache lookups by view', '# TYPE graphene_cache_total counter']
+    for view, view_stats in stats:
+        for (name, result), count in sorted(view_stats.cache.items()):
+            lines.append(f'graphene_cache_total{{view="{_label(view)}",cache="{name}",result="{result}"}} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    """Forget everything recorded so far (used by tests)."""
+    with _shards_lock:
+        for _, shard in _shards:
+            shard.clear()
+        _retired.clear()
+    slow_samples.clear()
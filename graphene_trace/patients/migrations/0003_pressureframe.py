@@ -0,0 +1,34 @@
+# Generated by Django 5.2.11 on 2026-10-18 08:39
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0002_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PressureFrame',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('rows', models.PositiveSmallIntegerField()),
+                ('cols', models.PositiveSmallIntegerField()),
+                ('data', models.BinaryField()),
+                ('peak_value', models.FloatField(blank=True, null=True)),
+                ('peak_location', models.CharField(blank=True, max_length=50)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pressure_frames', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-timestamp'],
+                'indexes': [models.Index(fields=['patient', '-timestamp'], name='frame_patient_ts_idx')],
+            },
+        ),
+    ]
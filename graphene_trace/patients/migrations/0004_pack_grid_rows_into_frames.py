@@ -0,0 +1,95 @@
+"""
+Pack existing per-cell 'r{r}_c{c}' PressureData rows into PressureFrames.
+
+Rows are grouped by (patient, timestamp); each group becomes one frame.
+Converted rows are deleted unless a Comment still points at them.
+"""
+import re
+
+import numpy as np
+from django.db import migrations
+
+COORD_RE = r'^r[0-9]+_c[0-9]+$'
+CELL_RE = re.compile(r'^r(\d+)_c(\d+)$')
+BATCH_SIZE = 500
+
+
+def _build_frame(PressureFrame, patient_id, timestamp, cells):
+    rows = max(r for r, _, _ in cells) + 1
+    cols = max(c for _, c, _ in cells) + 1
+    grid = np.full((rows, cols), np.nan, dtype='<f4')
+    for r, c, value in cells:
+        grid[r, c] = value
+    idx = int(np.nanargmax(grid))
+    pr, pc = divmod(idx, cols)
+    return PressureFrame(
+        patient_id=patient_id,
+        timestamp=timestamp,
+        rows=rows,
+        cols=cols,
+        data=grid.tobytes(),
+        peak_value=round(float(grid[pr, pc]), 3),
+        peak_location=f"r{pr}_c{pc}",
+    )
+
+
+def rows_to_frames(apps, schema_editor):
+    PressureData = apps.get_model('patients', 'PressureData')
+    PressureFrame = apps.get_model('patients', 'PressureFrame')
+    Comment = apps.get_model('patients', 'Comment')
+
+    grid_rows = PressureData.objects.filter(sensor_location__regex=COORD_RE)
+    pending = []
+    key, cells = None, []
+    for patient_id, timestamp, location, value in grid_rows.order_by('patient_id', 'timestamp').values_list(
+        'patient_id', 'timestamp', 'sensor_location', 'pressure_value'
+    ).iterator(chunk_size=5000):
+        if (patient_id, timestamp) != key:
+            if cells:
+                pending.append(_build_frame(PressureFrame, key[0], key[1], cells))
+            key, cells = (patient_id, timestamp), []
+        m = CELL_RE.match(location)
+        cells.append((int(m.group(1)), int(m.group(2)), value))
+        if len(pending) >= BATCH_SIZE:
+            PressureFrame.objects.bulk_create(pending)
+            pending = []
+    if cells:
+        pending.append(_build_frame(PressureFrame, key[0], key[1], cells))
+    if pending:
+        PressureFrame.objects.bulk_create(pending)
+
+    commented = Comment.objects.filter(pressure_data__isnull=False).values('pressure_data_id')
+    grid_rows.exclude(id__in=commented).delete()
+
+
+def frames_to_rows(apps, schema_editor):
+    PressureData = apps.get_model('patients', 'PressureData')
+    PressureFrame = apps.get_model('patients', 'PressureFrame')
+
+    objs = []
+    for frame in PressureFrame.objects.iterator(chunk_size=BATCH_SIZE):
+        grid = np.frombuffer(bytes(frame.data), dtype='<f4').reshape(frame.rows, frame.cols)
+        rs, cs = np.nonzero(~np.isnan(grid))
+        for r, c in zip(rs.tolist(), cs.tolist()):
+            objs.append(PressureData(
+                patient_id=frame.patient_id,
+                timestamp=frame.timestamp,
+                sensor_location=f"r{r}_c{c}",
+                pressure_value=float(grid[r, c]),
+            ))
+        if len(objs) >= 2000:
+            PressureData.objects.bulk_create(objs)
+            objs = []
+    if objs:
+        PressureData.objects.bulk_create(objs)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0003_pressureframe'),
+    ]
+
+    operations = [
+        migrations.RunPython(rows_to_frames, frames_to_rows),
+    ]
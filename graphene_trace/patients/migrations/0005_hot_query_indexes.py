@@ -0,0 +1,31 @@
+# Generated by Django 5.2.11 on 2026-10-18 08:41
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0004_pack_grid_rows_into_frames'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['patient', 'timestamp'], name='comment_patient_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('is_read', False)), fields=['patient', '-timestamp'], name='notif_patient_unread_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pressuredata',
+            index=models.Index(fields=['patient', '-timestamp'], name='pdata_patient_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pressuredata',
+            index=models.Index(fields=['patient', 'timestamp', 'sensor_location'], name='pdata_patient_ts_loc_idx'),
+        ),
+    ]
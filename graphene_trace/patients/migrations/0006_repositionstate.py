@@ -0,0 +1,29 @@
+# Generated by Django 5.2.11 on 2026-10-18 08:42
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0005_hot_query_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RepositionState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('frame_timestamp', models.DateTimeField(blank=True, null=True)),
+                ('recent_locations', models.JSONField(blank=True, default=list)),
+                ('persistence_count', models.PositiveSmallIntegerField(default=0)),
+                ('peak_value', models.FloatField(blank=True, null=True)),
+                ('peak_location', models.CharField(blank=True, max_length=50)),
+                ('suggestion', models.JSONField(blank=True, null=True)),
+                ('patient', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='reposition_state', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
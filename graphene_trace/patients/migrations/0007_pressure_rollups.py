@@ -0,0 +1,56 @@
+# Generated by Django 5.2.11 on 2026-10-18 09:11
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0006_repositionstate'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PressureRollupHour',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sensor_location', models.CharField(max_length=50)),
+                ('bucket_start', models.DateTimeField()),
+                ('min_value', models.FloatField()),
+                ('max_value', models.FloatField()),
+                ('sum_value', models.FloatField()),
+                ('count', models.PositiveIntegerField()),
+                ('seconds_above', models.FloatField(default=0)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['bucket_start'],
+                'abstract': False,
+                'indexes': [models.Index(fields=['patient', 'bucket_start'], name='pressurerolluphour_ts_idx')],
+                'constraints': [models.UniqueConstraint(fields=('patient', 'sensor_location', 'bucket_start'), name='pressurerolluphour_key')],
+            },
+        ),
+        migrations.CreateModel(
+            name='PressureRollupMinute',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sensor_location', models.CharField(max_length=50)),
+                ('bucket_start', models.DateTimeField()),
+                ('min_value', models.FloatField()),
+                ('max_value', models.FloatField()),
+                ('sum_value', models.FloatField()),
+                ('count', models.PositiveIntegerField()),
+                ('seconds_above', models.FloatField(default=0)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['bucket_start'],
+                'abstract': False,
+                'indexes': [models.Index(fields=['patient', 'bucket_start'], name='pressurerollupminute_ts_idx')],
+                'constraints': [models.UniqueConstraint(fields=('patient', 'sensor_location', 'bucket_start'), name='pressurerollupminute_key')],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.11 on 2026-10-18 11:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0015_importjob_heartbeat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FrameLayer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rows', models.PositiveSmallIntegerField()),
+                ('cols', models.PositiveSmallIntegerField()),
+                ('data', models.BinaryField()),
+                ('batch', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='patients.uploadbatch')),
+                ('frame', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='layers', to='patients.pressureframe')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ReadingLayer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pressure_value', models.FloatField()),
+                ('batch', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='patients.uploadbatch')),
+                ('reading', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='layers', to='patients.pressuredata')),
+            ],
+        ),
+    ]
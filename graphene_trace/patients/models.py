@@ -4,18 +4,174 @@ from django.utils import timezone
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 
+from . import frames
+
+class UploadBatch(models.Model):
+    """One imported CSV file; its readings and frames point back here so it can be undone."""
+    patient = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='upload_batches')
+    date = models.DateField()
+    timestamp = models.DateTimeField()  # given to the imported readings
+    file_name = models.CharField(max_length=255, blank=True)
+    file_hash = models.CharField(max_length=64, blank=True)  # sha256 of the file contents
+    row_count = models.PositiveBigIntegerField(default=0)  # PressureData rows
+    frame_count = models.PositiveIntegerField(default=0)
+    complete = models.BooleanField(default=False)  # set once the whole file is imported
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            # Re-upload detection (patients.importer.start_batch)
+            models.Index(fields=['patient', 'file_hash'], name='batch_patient_hash_idx'),
+        ]
+
+    def __str__(self):
+        return f"Upload {self.pk} of {self.file_name or 'CSV'} for {self.patient_id} on {self.date}"
+
 class PressureData(models.Model):
     patient = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='pressure_data')
     timestamp = models.DateTimeField(default=timezone.now)
     pressure_value = models.FloatField()  # in mmHg or appropriate unit
     sensor_location = models.CharField(max_length=50)  # e.g., 'left_hip', 'right_shoulder'
+    batch = models.ForeignKey(UploadBatch, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
 
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['patient', '-timestamp'], name='pdata_patient_ts_idx'),
+            models.Index(fields=['patient', 'timestamp', 'sensor_location'], name='pdata_patient_ts_loc_idx'),
+        ]
 
     def __str__(self):
         return f"{self.patient.username} - {self.sensor_location} at {self.timestamp}"
 
+class PressureFrame(models.Model):
+    """A full pressure-mat reading stored as one row (see patients.frames)."""
+    patient = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='pressure_frames')
+    timestamp = models.DateTimeField(default=timezone.now)
+    rows = models.PositiveSmallIntegerField()
+    cols = models.PositiveSmallIntegerField()
+    data = models.BinaryField()  # row-major little-endian float32, NaN = no reading
+    peak_value = models.FloatField(null=True, blank=True)
+    peak_location = models.CharField(max_length=50, blank=True)
+    batch = models.ForeignKey(UploadBatch, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    class Meta:
+        ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['patient', '-timestamp'], name='frame_patient_ts_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.patient.username} - {self.rows}x{self.cols} frame at {self.timestamp}"
+
+    @classmethod
+    def from_grid(cls, patient, timestamp, grid):
+        """Build an unsaved frame from a 2D array."""
+        peak_value, peak_location = frames.grid_peak(grid)
+        rows, cols = grid.shape
+        return cls(
+            patient=patient,
+            timestamp=timestamp,
+            rows=rows,
+            cols=cols,
+            data=frames.pack(grid),
+            peak_value=peak_value,
+            peak_location=peak_location,
+        )
+
+    @property
+    def grid(self):
+        return frames.unpack(self.data, self.rows, self.cols)
+
+    def cells(self):
+        return frames.grid_cells(self.grid)
+
+class ReadingLayer(models.Model):
+    """
+    One upload's value for a named reading that several uploads supplied.
+
+    The reading holds the latest layer's value. Readings written by a single
+    upload have no layers; undoing a batch drops its layer and restores the
+    rest (patients.batches).
+    """
+    reading = models.ForeignKey(PressureData, on_delete=models.CASCADE, related_name='layers')
+    batch = models.ForeignKey(UploadBatch, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    pressure_value = models.FloatField()
+
+class FrameLayer(models.Model):
+    """
+    The cells one upload gave a frame that several uploads wrote to.
+
+    The frame holds the overlay of its layers in id order, later uploads on
+    top. Frames written by a single upload have no layers; undoing a batch
+    drops its layer and restacks the rest (patients.batches).
+    """
+    frame = models.ForeignKey(PressureFrame, on_delete=models.CASCADE, related_name='layers')
+    batch = models.ForeignKey(UploadBatch, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    rows = models.PositiveSmallIntegerField()
+    cols = models.PositiveSmallIntegerField()
+    data = models.BinaryField()  # packed like PressureFrame.data
+
+    @classmethod
+    def from_grid(cls, frame, batch_id, grid):
+        rows, cols = grid.shape
+        return cls(frame=frame, batch_id=batch_id, rows=rows, cols=cols, data=frames.pack(grid))
+
+    @property
+    def grid(self):
+        return frames.unpack(self.data, self.rows, self.cols)
+
+class RepositionState(models.Model):
+    """Per-patient rolling state for reposition suggestions (see patients.reposition)."""
+    patient = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='reposition_state')
+    frame_timestamp = models.DateTimeField(null=True, blank=True)  # newest frame folded in
+    recent_locations = models.JSONField(default=list, blank=True)  # peak locations, newest first
+    persistence_count = models.PositiveSmallIntegerField(default=0)
+    peak_value = models.FloatField(null=True, blank=True)
+    peak_location = models.CharField(max_length=50, blank=True)
+    suggestion = models.JSONField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Reposition state for {self.patient.username}"
+
+class PressureRollup(models.Model):
+    """Aggregate of one sensor's readings over a time bucket (see patients.rollups)."""
+    patient = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    sensor_location = models.CharField(max_length=50)  # named sensor, or rollups.MAT_PEAK for frames
+    bucket_start = models.DateTimeField()
+    min_value = models.FloatField()
+    max_value = models.FloatField()
+    sum_value = models.FloatField()  # mean = sum_value / count, kept as a sum so merges stay exact
+    count = models.PositiveIntegerField()
+    seconds_above = models.FloatField(default=0)  # time spent above the alert threshold
+
+    class Meta:
+        abstract = True
+        ordering = ['bucket_start']
+        constraints = [
+            models.UniqueConstraint(fields=['patient', 'sensor_location', 'bucket_start'], name='%(class)s_key'),
+        ]
+        indexes = [
+            models.Index(fields=['patient', 'bucket_start'], name='%(class)s_ts_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.patient_id} - {self.sensor_location} at {self.bucket_start}"
+
+    @property
+    def mean(self):
+        return self.sum_value / self.count if self.count else None
+
+class PressureRollupMinute(PressureRollup):
+    class Meta(PressureRollup.Meta):
+        pass
+
+class PressureRollupHour(PressureRollup):
+    class Meta(PressureRollup.Meta):
+        pass
+
 class Comment(models.Model):
     patient = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='comments')
     clinician = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='clinician_comments')
@@ -26,6 +182,9 @@ class Comment(models.Model):
 
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            models.Index(fields=['patient', 'timestamp'], name='comment_patient_ts_idx'),
+        ]
 
     def __str__(self):
         return f"Comment by {self.patient.username if not self.clinician else self.clinician.username} at {self.timestamp}"
@@ -35,27 +194,135 @@ class Notification(models.Model):
     timestamp = models.DateTimeField(default=timezone.now)
     message = models.TextField()
     is_read = models.BooleanField(default=False)
+    reading_timestamp = models.DateTimeField(null=True, blank=True)  # reading that raised the alert (see patients.alerts)
 
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            # Partial rather than (patient, is_read, -timestamp): Django renders
+            # is_read=False as NOT "is_read", which SQLite cannot match against
+            # an index column but does match against the index condition.
+            models.Index(fields=['patient', '-timestamp'], condition=models.Q(is_read=False), name='notif_patient_unread_idx'),
+            models.Index(fields=['patient', 'reading_timestamp'], name='notif_patient_reading_idx'),
+        ]
 
     def __str__(self):
         return f"Notification for {self.patient.username}: {self.message[:50]}"
 
+class AlertEmail(models.Model):
+    """Outbox row for an alert email, sent by `manage.py send_alert_emails` (see patients.outbox)."""
+    patient = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    notification = models.ForeignKey(Notification, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    recipient = models.EmailField()
+    message = models.TextField()
+    created_at = models.DateTimeField(default=timezone.now)
+    next_attempt_at = models.DateTimeField(default=timezone.now, null=True, blank=True)  # null once sent or given up
+    attempts = models.PositiveSmallIntegerField(default=0)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['next_attempt_at'], condition=models.Q(next_attempt_at__isnull=False), name='alertemail_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"Alert email to {self.recipient} ({'sent' if self.sent_at else 'pending'})"
+
+class ImportJob(models.Model):
+    """A spooled CSV upload, imported in the background (see patients.jobs)."""
+    QUEUED, RUNNING, DONE, SKIPPED, FAILED = 'queued', 'running', 'done', 'skipped', 'failed'
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (SKIPPED, 'Skipped (already imported)'), (FAILED, 'Failed')]
+
+    patient = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    file_name = models.CharField(max_length=255, blank=True)
+    path = models.CharField(max_length=500)  # spooled copy, removed once the job finishes
+    size = models.PositiveBigIntegerField(default=0)
+    timestamp = models.DateTimeField()  # given to the imported readings
+    batch = models.ForeignKey(UploadBatch, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    bytes_read = models.PositiveBigIntegerField(default=0)
+    rows = models.PositiveBigIntegerField(default=0)
+    skipped = models.PositiveBigIntegerField(default=0)
+    readings = models.PositiveBigIntegerField(default=0)
+    frames = models.PositiveIntegerField(default=0)
+    cells = models.PositiveBigIntegerField(default=0)
+    rows_per_second = models.FloatField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)  # last progress write while running
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at'], condition=models.Q(status='queued'), name='importjob_queued_idx'),
+        ]
+
+    def __str__(self):
+        return f"Import of {self.file_name} for {self.patient_id} ({self.status})"
+
+    @property
+    def finished(self):
+        return self.status in (self.DONE, self.SKIPPED, self.FAILED)
+
+    @property
+    def eta_seconds(self):
+        """Seconds left at the current byte rate, or None before the first progress update."""
+        if self.status != self.RUNNING or not self.bytes_read or not self.started_at:
+            return None
+        elapsed = (timezone.now() - self.started_at).total_seconds()
+        return max(self.size - self.bytes_read, 0) * elapsed / self.bytes_read
+
+class ProfileRule(models.Model):
+    """Profile the next `remaining` requests matching a view/path pattern and/or user (see patients.profiling)."""
+    pattern = models.CharField(max_length=200, blank=True, help_text='URL name, or a regular expression searched in the path')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    remaining = models.PositiveIntegerField(default=10)
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        target = ' and '.join(filter(None, [self.pattern and f"'{self.pattern}'", self.user_id and f'user {self.user_id}']))
+        return f"Profile {target or 'every request'} ({self.remaining} left)"
+
+class Device(models.Model):
+    """A bedside device that pushes frames for its patients over the ingest API (see patients.devices)."""
+    name = models.CharField(max_length=100, unique=True)
+    token_hash = models.CharField(max_length=64, unique=True, editable=False)  # sha256 of the bearer token
+    patients = models.ManyToManyField(settings.AUTH_USER_MODEL, blank=True, related_name='devices', limit_choices_to={'role': 'patient'})
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['name']
+
+    def __str__(self):
+        return self.name
+
+@receiver(post_save, sender=PressureFrame)
+def update_reposition_state(sender, instance, created, **kwargs):
+    if created:
+        from .reposition import observe
+        observe(instance)
+
+@receiver(post_save, sender=PressureFrame)
 @receiver(post_save, sender=PressureData)
-def check_high_pressure(sender, instance, created, **kwargs):
-    if created and instance.pressure_value > 100:  # Assuming 100 is high
-        Notification.objects.create(
-            patient=instance.patient,
-            message=f"High pressure detected at {instance.sensor_location}: {instance.pressure_value}"
-        )
-        # Send email if email is set
-        if instance.patient.email:
-            from django.core.mail import send_mail
-            send_mail(
-                'High Pressure Alert',
-                f"High pressure detected: {instance.pressure_value} at {instance.sensor_location}",
-                'noreply@graphenetrace.com',
-                [instance.patient.email],
-                fail_silently=True,
-            )
+def record_new_reading(sender, instance, created, **kwargs):
+    # Rollups and coalesced alerts; bulk inserts call ingest.record themselves
+    if created:
+        from . import ingest
+        ingest.record(sender, [instance])
+
+@receiver(post_save, sender=PressureFrame)
+@receiver(post_save, sender=PressureData)
+def invalidate_live_cache(sender, instance, **kwargs):
+    # Registered after update_reposition_state so rebuilt payloads see the new suggestion
+    from .cache import invalidate
+    invalidate(instance.patient_id)
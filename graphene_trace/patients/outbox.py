@@ -0,0 +1,119 @@
+"""
+Alert email outbox.
+
+Ingest only inserts AlertEmail rows, so saving a reading never waits on the
+mail server. `manage.py send_alert_emails` drains the outbox in batches over
+one reused connection. It sends each recipient a single digest of their
+pending alerts and retries failures with exponential backoff. Sending is
+at-least-once: a worker that dies mid-batch leaves its rows to be sent again
+once their lease runs out.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import AlertEmail
+
+FROM_EMAIL = 'noreply@graphenetrace.com'
+BATCH_SIZE = 200
+MAX_ATTEMPTS = 6
+BACKOFF = timedelta(minutes=1)  # doubled after every failed attempt
+MAX_BACKOFF = timedelta(hours=1)
+LEASE = timedelta(minutes=10)  # claimed rows stay reserved this long while being sent
+
+
+def enqueue(notifications, emails):
+    """Queue an email for each notification whose patient has an address in `emails`."""
+    rows = [
+        AlertEmail(patient_id=n.patient_id, notification=n, recipient=emails[n.patient_id], message=n.message)
+        for n in notifications if emails.get(n.patient_id)
+    ]
+    AlertEmail.objects.bulk_create(rows)
+    return rows
+
+
+def _digest(recipient, rows):
+    if len(rows) == 1:
+        subject, body = 'High Pressure Alert', rows[0].message
+    else:
+        subject = f'High Pressure Alerts ({len(rows)})'
+        body = '\n'.join(f"{timezone.localtime(row.created_at):%Y-%m-%d %H:%M} - {row.message}" for row in rows)
+    return EmailMessage(subject, body, FROM_EMAIL, [recipient])
+
+
+def _backoff(attempts):
+    return min(BACKOFF * 2 ** (attempts - 1), MAX_BACKOFF)
+
+
+def _failed(rows, exc, now):
+    for row in rows:
+        row.attempts += 1
+        row.last_error = f'{type(exc).__name__}: {exc}'[:1000]
+        row.next_attempt_at = now + _backoff(row.attempts) if row.attempts < MAX_ATTEMPTS else None
+
+
+def _claim(batch_size, now):
+    """Lease up to `batch_size` due rows to this worker and return them."""
+    with transaction.atomic():
+        # skip_locked lets several workers share the outbox on databases that support it
+        due = list(
+            AlertEmail.objects.select_for_update(skip_locked=True)
+            .filter(next_attempt_at__lte=now).order_by('next_attempt_at', 'id')[:batch_size]
+        )
+        if due:
+            # Not due again until the lease runs out, so a crashed worker's rows are retried
+            AlertEmail.objects.filter(pk__in=[row.pk for row in due]).update(next_attempt_at=now + LEASE)
+    return due
+
+
+def drain(batch_size=BATCH_SIZE, connection=None):
+    """
+    Send one batch of due outbox rows; returns (emails sent, alerts sent, alerts failed).
+
+    Rows are grouped into one digest per recipient. A failed digest is
+    retried after a growing delay; after MAX_ATTEMPTS it is parked
+    (next_attempt_at cleared) with the last error kept for inspection.
+
+    The rows are claimed and their outcome recorded in two short
+    transactions; the mail server is talked to outside both, so ingest
+    writers never wait on it for the database lock.
+    """
+    now = timezone.now()
+    due = _claim(batch_size, now)
+    if not due:
+        return 0, 0, 0
+    by_recipient = defaultdict(list)
+    for row in due:
+        by_recipient[row.recipient].append(row)
+
+    connection = connection or get_connection()
+    sent_emails = sent = failed = 0
+    try:
+        connection.open()
+    except Exception as exc:
+        _failed(due, exc, now)
+        failed = len(due)
+        by_recipient = {}
+    try:
+        for recipient, rows in by_recipient.items():
+            try:
+                if not connection.send_messages([_digest(recipient, rows)]):
+                    raise RuntimeError('mail backend accepted no messages')
+            except Exception as exc:
+                _failed(rows, exc, now)
+                failed += len(rows)
+                continue
+            sent_emails += 1
+            sent += len(rows)
+            for row in rows:
+                row.attempts += 1
+                row.sent_at = now
+                row.next_attempt_at = None
+    finally:
+        connection.close()
+    with transaction.atomic():
+        AlertEmail.objects.bulk_update(due, ['attempts', 'last_error', 'next_attempt_at', 'sent_at'])
+    return sent_emails, sent, failed
@@ -0,0 +1,255 @@
+"""
+Opt-in cProfile profiling of individual views.
+
+A request is profiled when:
+- an admin has added a ProfileRule that matches it, by URL name or path
+  regex and/or by user. Each rule covers its next `remaining` requests; or
+- it carries the PROFILE_HEADER with a token from header_token(). Admins get
+  the token from the profiles page and it expires after
+  PROFILE_TOKEN_MAX_AGE seconds.
+
+Active rules are cached in each process for PROFILE_RULES_TTL seconds, so
+while no rule is active a request costs one clock read. A matching request
+claims its slot with a conditional UPDATE, so N means N across all worker
+processes. One request at a time is profiled in each process.
+
+Each profile is written to PROFILE_DIR as <name>.pstats (for pstats,
+snakeviz and similar tools) and <name>.collapsed. The collapsed file holds
+folded stacks ("a;b;c microseconds") for flamegraph.pl and speedscope. cProfile
+keeps caller/callee pairs, not whole stacks, so the folded stacks share each
+function's time among its callers in proportion to the time it spent under
+each of them.
+"""
+import cProfile
+import os
+import pstats
+import re
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from asgiref.sync import async_to_sync, iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.urls import Resolver404, get_resolver
+from django.utils import timezone
+
+from .models import ProfileRule
+
+SALT = 'patients.profiling'
+MAX_DEPTH = 60  # folded stack depth; deeper frames are merged into their parent
+MIN_SHARE = 1e-4  # stacks under this fraction of the total time are merged into their parent
+
+_rules = (0.0, [])  # (expires, active rules)
+_busy = threading.Lock()  # one profiler at a time per process
+
+
+def header_token(user):
+    return signing.dumps(user.pk, salt=SALT)
+
+
+def _token_valid(token):
+    try:
+        signing.loads(token, salt=SALT, max_age=settings.PROFILE_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return True
+
+
+def active_rules():
+    global _rules
+    expires, rules = _rules
+    now = time.monotonic()
+    if expires <= now:
+        rules = []
+        for rule in ProfileRule.objects.filter(remaining__gt=0):
+            try:
+                rule.regex = re.compile(rule.pattern) if rule.pattern else None
+            except re.error:
+                continue  # the admin form rejects these; skip one saved some other way
+            rules.append(rule)
+        _rules = (now + settings.PROFILE_RULES_TTL, rules)
+    return rules
+
+
+@receiver(post_save, sender=ProfileRule)
+@receiver(post_delete, sender=ProfileRule)
+def forget_rules(sender, **kwargs):
+    global _rules
+    _rules = (0.0, [])
+
+
+def _matches(rule, request, view_name):
+    if rule.user_id is not None and getattr(request.user, 'pk', None) != rule.user_id:
+        return False
+    if rule.regex is not None and rule.pattern != view_name and not rule.regex.search(request.path_info):
+        return False
+    return True
+
+
+def _claim(request, view_name):
+    """Whether to profile this request; takes one of a matching rule's remaining slots."""
+    token = request.headers.get(settings.PROFILE_HEADER)
+    if token:
+        return _token_valid(token)
+    for rule in active_rules():
+        if _matches(rule, request, view_name):
+            if ProfileRule.objects.filter(pk=rule.pk, remaining__gt=0).update(remaining=F('remaining') - 1):
+                return True
+    return False
+
+
+def collapsed_stacks(stats):
+    """Folded stacks from a pstats.Stats: {'a;b;c': microseconds of own time}."""
+    entries = stats.stats  # func -> (primitive calls, calls, own time, cumulative time, callers)
+    children = {}
+    for func, (_, _, _, _, callers) in entries.items():
+        for caller, caller_stats in callers.items():
+            children.setdefault(caller, []).append((func, caller_stats[3]))
+    roots = [func for func, entry in entries.items() if not entry[4]]
+    cutoff = MIN_SHARE * sum(entries[root][3] for root in roots)
+    folded = {}
+
+    def label(func):
+        path, line, name = func
+        return f'{name} ({os.path.basename(path)}:{line})' if line else name
+
+    def walk(func, share, stack, seen):
+        _, _, own, cumulative, _ = entries[func]
+        fraction = share / cumulative if cumulative else 0.0
+        stack = stack + [label(func)]
+        key = ';'.join(stack)
+        kept = own * fraction
+        for child, child_time in children.get(func, ()):
+            child_share = child_time * fraction
+            # Recursion is counted once, at its first frame; the call graph has
+            # no more detail than that
+            if child not in seen and child_share >= cutoff and len(stack) < MAX_DEPTH:
+                walk(child, child_share, stack, seen | {child})
+            elif child not in seen:
+                kept += child_share
+        folded[key] = folded.get(key, 0.0) + kept
+
+    for root in roots:
+        walk(root, entries[root][3], [], {root})
+    return {stack: round(seconds * 1e6) for stack, seconds in folded.items() if seconds * 1e6 >= 1}
+
+
+def _save(profiler, request, view_name, elapsed):
+    directory = settings.PROFILE_DIR
+    os.makedirs(directory, exist_ok=True)
+    user = getattr(request.user, 'username', '') or 'anonymous'
+    stem = re.sub(r'[^\w.-]+', '_', f'{timezone.now():%Y%m%d-%H%M%S}-{view_name}-{user}-{elapsed * 1000:.0f}ms')
+    stem = f'{stem}-{uuid.uuid4().hex[:6]}'
+    profiler.dump_stats(os.path.join(directory, f'{stem}.pstats'))
+    stacks = collapsed_stacks(pstats.Stats(profiler))
+    with open(os.path.join(directory, f'{stem}.collapsed'), 'w') as f:
+        for stack, micros in sorted(stacks.items()):
+            f.write(f'{stack} {micros}\n')
+    return stem
+
+
+def profiles():
+    """Stored profiles, newest first: [{'name', 'created', 'size', 'collapsed'}]."""
+    try:
+        names = os.listdir(settings.PROFILE_DIR)
+    except FileNotFoundError:
+        return []
+    found = []
+    for name in names:
+        stem, ext = os.path.splitext(name)
+        if ext == '.pstats':
+            path = os.path.join(settings.PROFILE_DIR, name)
+            stat = os.stat(path)
+            found.append({
+                'name': stem,
+                'created': datetime.fromtimestamp(stat.st_mtime, tz=timezone.get_current_timezone()),
+                'size': stat.st_size,
+                'collapsed': f'{stem}.collapsed' in names,
+            })
+    return sorted(found, key=lambda p: p['created'], reverse=True)
+
+
+def profile_path(name, ext):
+    """Path of a stored profile file, or None if there is no such profile."""
+    if ext not in ('pstats', 'collapsed') or not re.fullmatch(r'[\w.-]+', name):
+        return None
+    path = os.path.join(settings.PROFILE_DIR, f'{name}.{ext}')
+    return path if os.path.isfile(path) else None
+
+
+def _worth_checking(request):
+    """Cheap test, without the database, for whether a request could be profiled at all."""
+    expires, rules = _rules
+    return bool(rules) or expires <= time.monotonic() or settings.PROFILE_HEADER in request.headers
+
+
+def _resolve(request):
+    # Middleware runs before Django resolves the URL
+    try:
+        match = get_resolver(getattr(request, 'urlconf', None)).resolve(request.path_info)
+    except Resolver404:
+        return '', None
+    return match.view_name, match.func
+
+
+class ProfilingMiddleware:
+    """
+    Runs matching requests under cProfile. Keep it last in MIDDLEWARE so it wraps the view alone.
+
+    The profiler follows one thread, so under ASGI a profiled request runs
+    on the thread its sync view uses, as Django runs sync-only middleware.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        view_name = self._begin(request) if _worth_checking(request) else None
+        if view_name is None:
+            return self.get_response(request)
+        return self._profile(request, view_name, self.get_response)
+
+    async def __acall__(self, request):
+        view_name = await sync_to_async(self._begin)(request) if _worth_checking(request) else None
+        if view_name is None:
+            return await self.get_response(request)
+        return await sync_to_async(self._profile)(request, view_name, async_to_sync(self.get_response))
+
+    def _begin(self, request):
+        """The view name if this request is to be profiled, holding _busy; otherwise None."""
+        view_name, view_func = _resolve(request)
+        if view_func is None or iscoroutinefunction(view_func):
+            return None  # async streams run for minutes; not profiled
+        if not _busy.acquire(blocking=False):
+            return None  # another thread is being profiled
+        if _claim(request, view_name):
+            return view_name
+        _busy.release()
+        return None
+
+    def _profile(self, request, view_name, get_response):
+        profiler = cProfile.Profile()
+        began = time.perf_counter()
+        try:
+            profiler.enable()
+            try:
+                return get_response(request)
+            finally:
+                profiler.disable()
+        finally:
+            try:
+                _save(profiler, request, view_name, time.perf_counter() - began)
+            finally:
+                _busy.release()
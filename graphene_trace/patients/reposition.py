@@ -0,0 +1,104 @@
+"""
+Reposition suggestions, computed once per ingested frame.
+
+Each patient has a RepositionState row holding the peak location of the last
+few frames, so the live endpoints only read the stored suggestion instead of
+re-scanning recent history on every poll.
+"""
+from collections import Counter
+
+from django.db import transaction
+
+from .frames import parse_coord
+from .models import PressureFrame, RepositionState
+
+WINDOW = 3  # number of recent frames considered
+PERSISTENCE_MIN = 2  # frames the same peak location must appear in
+PEAK_THRESHOLD = 80  # current peak must exceed this (mmHg)
+
+
+def suggest(recent_locations, peak_value, cols):
+    """
+    Return (persistence_count, suggestion) for a window of peak locations.
+
+    `recent_locations` is newest first; `cols` is the width of the current
+    frame and decides which way the patient should roll.
+    """
+    if not recent_locations:
+        return 0, None
+    loc, count = Counter(recent_locations).most_common(1)[0]
+    if count < PERSISTENCE_MIN or peak_value is None or peak_value <= PEAK_THRESHOLD:
+        return count, None
+    coord = parse_coord(loc)
+    mid = (cols - 1) / 2.0
+    if coord and coord[1] < mid:
+        action = 'roll_right'
+        message = f"Suggest roll to the right — persistent high pressure at {loc}"
+    elif coord and coord[1] > mid:
+        action = 'roll_left'
+        message = f"Suggest roll to the left — persistent high pressure at {loc}"
+    else:
+        action = 'adjust_position'
+        message = f"Suggest adjust position — persistent high pressure at {loc}"
+    confidence = round(min(0.95, 0.5 + (count - 1) * 0.2), 2)
+    return count, {'action': action, 'reason': message, 'location': loc, 'confidence': confidence}
+
+
+def _apply(state, frame):
+    if frame.peak_location:
+        state.recent_locations = ([frame.peak_location] + list(state.recent_locations))[:WINDOW]
+    state.frame_timestamp = frame.timestamp
+    state.peak_value = frame.peak_value
+    state.peak_location = frame.peak_location
+    state.persistence_count, state.suggestion = suggest(state.recent_locations, frame.peak_value, frame.cols)
+
+
+def _locked_state(patient_id):
+    """Return the patient's state row, locked until the caller's transaction ends."""
+    locked = RepositionState.objects.select_for_update()
+    state = locked.filter(patient_id=patient_id).first()
+    if state is None:
+        # get_or_create copes with a concurrent insert; a row we inserted is already ours
+        state, created = RepositionState.objects.get_or_create(patient_id=patient_id)
+        if not created:
+            state = locked.get(pk=state.pk)
+    return state
+
+
+def observe(frame):
+    """Fold a newly saved frame into its patient's state and return the state."""
+    # Concurrent frames for one patient would otherwise each fold into the
+    # same stale window and the last save would win
+    with transaction.atomic():
+        state = _locked_state(frame.patient_id)
+        if state.frame_timestamp and frame.timestamp < state.frame_timestamp:
+            # Late (backfilled) frames don't change what the patient is lying on now
+            return state
+        _apply(state, frame)
+        state.save()
+    return state
+
+
+def rebuild(patient):
+    """Recompute a patient's state from their last WINDOW frames."""
+    with transaction.atomic():
+        state = _locked_state(patient.pk)
+        state.recent_locations = []
+        state.frame_timestamp = state.peak_value = state.suggestion = None
+        state.peak_location = ''
+        state.persistence_count = 0
+        recent = PressureFrame.objects.filter(patient=patient).order_by('-timestamp').only(
+            'timestamp', 'cols', 'peak_value', 'peak_location'
+        )[:WINDOW]
+        for frame in reversed(list(recent)):
+            _apply(state, frame)
+        state.save()
+    return state
+
+
+def current_suggestion(patient):
+    """Return the stored suggestion for a patient (building the state on first use)."""
+    state = RepositionState.objects.filter(patient=patient).first()
+    if state is None:
+        state = rebuild(patient)
+    return state.suggestion
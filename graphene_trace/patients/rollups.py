@@ -0,0 +1,255 @@
+"""
+Per-minute and per-hour pressure aggregates, maintained on ingest.
+
+Each rollup row covers one (patient, sensor_location, bucket_start) and holds
+min/max/sum/count plus the seconds spent above the alert threshold. Frames
+are rolled up by their mat peak under MAT_PEAK; named sensors keep their own
+location. Long-range history and the clinician summary read these tables
+instead of the raw readings.
+
+New rows are folded in as they are created (see patients.ingest). Readings
+that arrive out of order only affect seconds_above slightly (the gap to the
+next reading isn't revisited); `manage.py rebuild_rollups` recomputes exactly.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.db import connection, transaction
+from django.db.models import Max, Min
+
+from .alerts import THRESHOLD
+from .models import PressureData, PressureFrame, PressureRollupHour, PressureRollupMinute
+
+MAT_PEAK = 'mat_peak'  # sensor_location for the per-frame mat peak
+MAX_GAP = 60  # longest time (s) one reading above threshold is counted for
+MIN_GAP = 1  # time (s) counted for a reading with no earlier one
+GRANULARITIES = ((PressureRollupMinute, 60), (PressureRollupHour, 3600))
+REBUILD_WINDOW = timedelta(days=1)
+CHUNK_SIZE = 5000
+KEY_FIELDS = ('patient_id', 'sensor_location', 'bucket_start')
+UPDATE_FIELDS = ('min_value', 'max_value', 'sum_value', 'count', 'seconds_above')
+
+
+def _from_epoch(seconds):
+    return datetime.fromtimestamp(seconds, dt_timezone.utc)
+
+
+def _samples(sender, instances):
+    if sender is PressureFrame:
+        return [(f.patient_id, MAT_PEAK, f.timestamp.timestamp(), f.peak_value) for f in instances if f.peak_value is not None]
+    return [(r.patient_id, r.sensor_location, r.timestamp.timestamp(), r.pressure_value) for r in instances]
+
+
+def record(sender, instances):
+    """Fold newly created PressureData or PressureFrame rows into the rollups."""
+    samples = _samples(sender, instances)
+    if samples:
+        _fold(samples)
+
+
+def _previous_timestamp(patient_id, location, before):
+    if location == MAT_PEAK:
+        qs = PressureFrame.objects.filter(patient_id=patient_id, peak_value__isnull=False)
+    else:
+        qs = PressureData.objects.filter(patient_id=patient_id, sensor_location=location)
+    ts = qs.filter(timestamp__lt=_from_epoch(before)).order_by('-timestamp').values_list('timestamp', flat=True).first()
+    return ts.timestamp() if ts is not None else None
+
+
+def _held_seconds(ts, values, previous):
+    """Seconds each reading accounts for above THRESHOLD: the gap since the one before it."""
+    gaps = np.diff(ts, prepend=ts[0] - MIN_GAP if previous is None else previous)
+    return np.clip(gaps, MIN_GAP, MAX_GAP) * (values > THRESHOLD)
+
+
+def _aggregate(ts, values, held, width):
+    """Return (bucket starts, min, max, sum, count, seconds above) for sorted readings."""
+    buckets = np.floor(ts / width) * width
+    offsets = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    counts = np.diff(np.r_[offsets, len(ts)])
+    return (
+        buckets[offsets],
+        np.minimum.reduceat(values, offsets),
+        np.maximum.reduceat(values, offsets),
+        np.add.reduceat(values, offsets),
+        counts,
+        np.add.reduceat(held, offsets),
+    )
+
+
+def _upsert_sql(model):
+    """INSERT one bucket, or fold it into the existing row in the same statement."""
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    column = {name: qn(model._meta.get_field(name).column) for name in KEY_FIELDS + UPDATE_FIELDS}
+    least, greatest = ('LEAST', 'GREATEST') if connection.vendor == 'postgresql' else ('MIN', 'MAX')
+    merged = {
+        'min_value': f'{least}({table}.{column["min_value"]}, EXCLUDED.{column["min_value"]})',
+        'max_value': f'{greatest}({table}.{column["max_value"]}, EXCLUDED.{column["max_value"]})',
+    }
+    updates = ', '.join(
+        f'{column[name]} = ' + merged.get(name, f'{table}.{column[name]} + EXCLUDED.{column[name]}')
+        for name in UPDATE_FIELDS
+    )
+    fields = KEY_FIELDS + UPDATE_FIELDS
+    return (
+        f'INSERT INTO {table} ({", ".join(column[name] for name in fields)}) '
+        f'VALUES ({", ".join(["%s"] * len(fields))}) '
+        f'ON CONFLICT ({", ".join(column[name] for name in KEY_FIELDS)}) DO UPDATE SET {updates}'
+    )
+
+
+def _merge(model, groups):
+    """Add [((patient_id, location), aggregate stats), ...] to a rollup model's rows."""
+    bucket_field = model._meta.get_field('bucket_start')
+    rows = [
+        (patient_id, location, bucket_field.get_db_prep_save(_from_epoch(start), connection), lo, hi, total, count, secs)
+        for (patient_id, location), (starts, mins, maxs, sums, counts, above) in groups
+        for start, lo, hi, total, count, secs in zip(starts.tolist(), mins.tolist(), maxs.tolist(), sums.tolist(), counts.tolist(), above.tolist())
+    ]
+    # The database does the merge, so concurrent writers to one bucket add up
+    # instead of overwriting each other or colliding on the unique key
+    with connection.cursor() as cursor:
+        for i in range(0, len(rows), CHUNK_SIZE):
+            cursor.executemany(_upsert_sql(model), rows[i:i + CHUNK_SIZE])
+    return len(rows)
+
+
+def _fold(samples):
+    """Aggregate (patient_id, location, epoch, value) samples into every granularity."""
+    samples.sort()
+    groups = {model: [] for model, _ in GRANULARITIES}
+    start = 0
+    while start < len(samples):
+        patient_id, location = samples[start][:2]
+        end = start
+        while end < len(samples) and samples[end][:2] == (patient_id, location):
+            end += 1
+        ts = np.fromiter((s[2] for s in samples[start:end]), dtype=np.float64, count=end - start)
+        values = np.fromiter((s[3] for s in samples[start:end]), dtype=np.float64, count=end - start)
+        held = _held_seconds(ts, values, _previous_timestamp(patient_id, location, ts[0]))
+        for model, width in GRANULARITIES:
+            groups[model].append(((patient_id, location), _aggregate(ts, values, held, width)))
+        start = end
+    written = 0
+    with transaction.atomic():
+        # One upsert per granularity for all patients in the batch
+        for model, _ in GRANULARITIES:
+            written += _merge(model, groups[model])
+    return written
+
+
+def _floor_hour(dt):
+    return dt.replace(minute=0, second=0, microsecond=0)
+
+
+def rebuild(patient, start=None, end=None):
+    """
+    Recompute a patient's rollups from the raw readings and frames.
+
+    The range is widened to whole hours (all data when omitted) and processed
+    one REBUILD_WINDOW at a time so memory stays bounded. Returns the number
+    of rollup rows written.
+    """
+    frames = PressureFrame.objects.filter(patient=patient, peak_value__isnull=False)
+    readings = PressureData.objects.filter(patient=patient)
+    full = start is None and end is None
+    if start is None or end is None:
+        bounds = [
+            b for qs in (frames, readings)
+            for b in qs.aggregate(first=Min('timestamp'), last=Max('timestamp')).values() if b is not None
+        ]
+        start = start or (min(bounds) if bounds else None)
+        end = end or (max(bounds) if bounds else None)
+        full = full or not bounds
+
+    written = 0
+    with transaction.atomic():
+        for model, _ in GRANULARITIES:
+            stale = model.objects.filter(patient=patient)
+            if not full:
+                stale = stale.filter(bucket_start__gte=_floor_hour(start), bucket_start__lt=_floor_hour(end) + timedelta(hours=1))
+            stale.delete()
+        if start is None or end is None:
+            return 0  # no readings left
+        start = _floor_hour(start)
+        end = _floor_hour(end) + timedelta(hours=1)
+        window = start
+        while window < end:
+            window_end = min(window + REBUILD_WINDOW, end)
+            samples = [
+                (patient.pk, MAT_PEAK, ts.timestamp(), value)
+                for ts, value in frames.filter(timestamp__gte=window, timestamp__lt=window_end)
+                .order_by().values_list('timestamp', 'peak_value').iterator(chunk_size=CHUNK_SIZE)
+            ]
+            samples += [
+                (patient.pk, location, ts.timestamp(), value)
+                for location, ts, value in readings.filter(timestamp__gte=window, timestamp__lt=window_end)
+                .order_by().values_list('sensor_location', 'timestamp', 'pressure_value').iterator(chunk_size=CHUNK_SIZE)
+            ]
+            if samples:
+                written += _fold(samples)
+            window = window_end
+    return written
+
+
+def granularity_for(bucket_seconds):
+    """Return the coarsest rollup model at least as fine as a chart bucket, or None for raw data."""
+    chosen = None
+    for model, width in GRANULARITIES:
+        if width <= bucket_seconds:
+            chosen = model
+    return chosen
+
+
+def load(model, patient, start, end, sensor_location=None):
+    """
+    Return (bucket epoch, min, max, sum, count) arrays covering [start, end), oldest first.
+
+    Without a sensor_location the rows of every location in a bucket are
+    combined, matching the default history series.
+    """
+    # Include the bucket that start falls inside
+    width = dict(GRANULARITIES)[model]
+    rows = model.objects.filter(patient=patient, bucket_start__gt=start - timedelta(seconds=width), bucket_start__lt=end)
+    if sensor_location:
+        rows = rows.filter(sensor_location=sensor_location)
+    rows = list(rows.order_by('bucket_start').values_list('bucket_start', 'min_value', 'max_value', 'sum_value', 'count'))
+    if not rows:
+        return tuple(np.empty(0) for _ in range(5))
+    starts, mins, maxs, sums, counts = zip(*rows)
+    ts = np.fromiter((s.timestamp() for s in starts), dtype=np.float64, count=len(starts))
+    mins, maxs, sums, counts = (np.asarray(a, dtype=np.float64) for a in (mins, maxs, sums, counts))
+    offsets = np.flatnonzero(np.r_[True, ts[1:] != ts[:-1]])
+    return (
+        ts[offsets],
+        np.minimum.reduceat(mins, offsets),
+        np.maximum.reduceat(maxs, offsets),
+        np.add.reduceat(sums, offsets),
+        np.add.reduceat(counts, offsets),
+    )
+
+
+def summary(patient, start, end):
+    """Per-sensor peak/mean/readings/seconds above threshold over [start, end) from hourly rollups."""
+    rows = PressureRollupHour.objects.filter(
+        patient=patient, bucket_start__gte=_floor_hour(start), bucket_start__lt=end,
+    ).values_list('sensor_location', 'max_value', 'sum_value', 'count', 'seconds_above')
+    # At most 24 rows per sensor for a day, so combine them here rather than GROUP BY
+    sensors = {}
+    for location, peak, total, count, above in rows:
+        acc = sensors.setdefault(location, [peak, 0.0, 0, 0.0])
+        acc[0] = max(acc[0], peak)
+        acc[1] += total
+        acc[2] += count
+        acc[3] += above
+    return [
+        {
+            'sensor_location': location,
+            'peak': peak,
+            'mean': round(total / count, 1) if count else None,
+            'readings': count,
+            'minutes_above': round(above / 60, 1),
+        }
+        for location, (peak, total, count, above) in sorted(sensors.items())
+    ]
@@ -0,0 +1,172 @@
+"""
+Server-Sent Events push for live pressure frames.
+
+Every open stream subscribes to the process-wide `hub`. Ingest in this
+process wakes subscribers directly (patients.cache.invalidate publishes to
+the hub). Changes made by other processes (CSV imports, undo_upload, the
+device gateway, other workers) are picked up by a single watcher task per
+process. Every invalidation stores a new change marker in the live cache
+(shared when settings.LIVE_CACHE_BACKEND is file or redis), and the watcher reads the markers of the subscribed patients in one
+get_many per WATCH_INTERVAL: its cost follows the number of watched patients,
+not their history, and deletes and frame merges are seen like inserts.
+
+The encoded event for each (kind, patient) is built once per change and the
+same bytes are written to every stream watching that patient.
+
+Streaming needs an ASGI server (see graphene_trace/asgi.py); under WSGI the
+endpoints answer 503 and the browser falls back to polling.
+"""
+import asyncio
+import threading
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
+
+from . import cache as live_cache
+
+WATCH_INTERVAL = 0.5  # seconds between cross-process change checks
+HEARTBEAT = 15  # seconds between keep-alive comments on an idle stream
+RETRY_MS = 2000  # EventSource reconnect delay
+
+
+def _encode(kind, entry):
+    return f"event: {kind}\nid: {entry['etag']}\ndata: {entry['content'].decode()}\n\n".encode()
+
+
+def _wake(queue):
+    # One pending wake-up is enough; the stream re-reads the latest payload
+    if not queue.full():
+        queue.put_nowait(True)
+
+
+class LiveHub:
+    """Fan-out of "patient X has new data" to the streams in this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)  # patient_id -> {(loop, queue)}
+        self._seen = {}  # patient_id -> last change marker seen (see patients.cache.versions)
+        self._generation = defaultdict(int)  # patient_id -> bumped on every publish
+        self._events = {}  # (kind, patient_id) -> (etag, encoded event)
+        self._building = {}  # (kind, patient_id) -> in-flight build
+        self._watcher = None
+
+    async def subscribe(self, patient_id):
+        """Register the calling stream; returns a (loop, queue) subscription."""
+        loop = asyncio.get_running_loop()
+        subscription = (loop, asyncio.Queue(maxsize=1))
+        # Read the marker before the stream reads any payload, so a change
+        # made in between is still seen by the next watch
+        marker = (await sync_to_async(live_cache.versions)([patient_id]))[patient_id]
+        with self._lock:
+            self._subscribers[patient_id].add(subscription)
+            self._seen.setdefault(patient_id, marker)
+            if self._watcher is None or self._watcher.done():
+                self._watcher = loop.create_task(self._watch())
+        return subscription
+
+    def unsubscribe(self, patient_id, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(patient_id)
+            if subscribers is None:
+                return
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[patient_id]
+                self._seen.pop(patient_id, None)
+                self._generation.pop(patient_id, None)
+                for kind in live_cache.KINDS:
+                    self._events.pop((kind, patient_id), None)
+
+    def publish(self, patient_id, marker=None):
+        """Wake every stream for a patient; safe to call from any thread."""
+        with self._lock:
+            targets = list(self._subscribers.get(patient_id, ()))
+            if not targets:
+                return
+            if marker is not None:
+                # Our own change; the watcher needn't publish it again
+                self._seen[patient_id] = marker
+            self._generation[patient_id] += 1
+            for kind in live_cache.KINDS:
+                self._events.pop((kind, patient_id), None)
+        for loop, queue in targets:
+            loop.call_soon_threadsafe(_wake, queue)
+
+    async def latest_event(self, kind, patient):
+        """Return (etag, encoded event), building it at most once per change."""
+        key = (kind, patient.pk)
+        event = self._events.get(key)
+        if event is not None:
+            return event
+        build = self._building.get(key)
+        if build is None:
+            # Every stream for the patient wakes at once; share one build between them
+            build = asyncio.ensure_future(self._build(kind, patient))
+            self._building[key] = build
+            build.add_done_callback(lambda _: self._building.pop(key, None))
+        return await asyncio.shield(build)
+
+    async def _build(self, kind, patient):
+        generation = self._generation[patient.pk]
+        entry = await sync_to_async(live_cache.get)(kind, patient)
+        event = (entry['etag'], _encode(kind, entry))
+        with self._lock:
+            # Don't memoise a payload that a publish has already made stale
+            if patient.pk in self._subscribers and self._generation[patient.pk] == generation:
+                self._events[(kind, patient.pk)] = event
+        return event
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(WATCH_INTERVAL)
+            with self._lock:
+                patient_ids = list(self._subscribers)
+            if not patient_ids:
+                return
+            markers = await sync_to_async(live_cache.versions)(patient_ids)
+            changed = []
+            with self._lock:
+                for pid, marker in markers.items():
+                    if pid in self._seen and self._seen[pid] != marker:
+                        changed.append(pid)
+                    if pid in self._subscribers:
+                        self._seen[pid] = marker
+            for pid in changed:
+                # Another process already dropped the shared entries; wake our streams
+                self.publish(pid)
+
+
+hub = LiveHub()
+
+
+async def event_stream(patient):
+    subscription = await hub.subscribe(patient.pk)
+    queue = subscription[1]
+    sent = {}
+    try:
+        yield f"retry: {RETRY_MS}\n\n".encode()
+        while True:
+            for kind in live_cache.KINDS:
+                etag, event = await hub.latest_event(kind, patient)
+                if sent.get(kind) != etag:
+                    sent[kind] = etag
+                    yield event
+            try:
+                await asyncio.wait_for(queue.get(), HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield b": keepalive\n\n"
+    finally:
+        hub.unsubscribe(patient.pk, subscription)
+
+
+def stream_response(request, patient):
+    """Return an SSE response for a patient, or 503 when not served over ASGI."""
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse('Live streaming requires the ASGI server', status=503, content_type='text/plain')
+    response = StreamingHttpResponse(event_stream(patient), content_type='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # don't let nginx buffer the stream
+    return response
@@ -1,3 +1,926 @@
-from django.test import TestCase
+import asyncio
+import contextvars
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import async_to_sync, sync_to_async
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.management import call_command
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import caches
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import alerts, db, devices, gateway, history, importer, ingest, metrics, outbox, profiling, reposition, rollups, stream, wire
+from . import cache as live_cache
+from .models import AlertEmail, Device, ImportJob, ProfileRule, PressureData, PressureFrame, PressureRollupHour, PressureRollupMinute, RepositionState, Comment, Notification
+
+User = get_user_model()
+
+HOT_TABLES = (
+    'patients_pressuredata', 'patients_pressureframe', 'patients_notification', 'patients_comment',
+    'patients_pressurerollupminute', 'patients_pressurerolluphour',
+)
+
+# Tests that clear the live cache get one of their own, never a developer's file or Redis cache
+TEST_CACHES = {
+    **settings.CACHES,
+    'live': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'graphene-trace-test-live'},
+}
+
+
+class FrameStorageTests(TestCase):
+
+    def setUp(self):
+        self.patient = User.objects.create_user('pat', password='pw', role='patient')
+
+    def test_grid_round_trip(self):
+        grid = np.array([[1.5, np.nan, 3.0], [0.0, 12.3, np.nan]], dtype='<f4')
+        frame = PressureFrame.from_grid(self.patient, timezone.now(), grid)
+        self.assertEqual((frame.rows, frame.cols), (2, 3))
+        self.assertEqual(len(frame.data), 6 * 4)
+        self.assertEqual((frame.peak_value, frame.peak_location), (12.3, 'r1_c1'))
+        frame.save()
+        stored = PressureFrame.objects.get(pk=frame.pk)
+        np.testing.assert_array_equal(stored.grid, grid)
+        self.assertEqual(stored.cells(), [
+            {'r': 0, 'c': 0, 'value': 1.5}, {'r': 0, 'c': 2, 'value': 3.0},
+            {'r': 1, 'c': 0, 'value': 0.0}, {'r': 1, 'c': 1, 'value': 12.3},
+        ])
+
+    def test_empty_grid_has_no_peak(self):
+        frame = PressureFrame.from_grid(self.patient, timezone.now(), np.full((2, 2), np.nan, dtype='<f4'))
+        self.assertEqual((frame.peak_value, frame.peak_location), (None, ''))
+
+    def test_migration_packs_cell_rows_into_frames(self):
+        migration = import_module('patients.migrations.0004_pack_grid_rows_into_frames')
+        t1 = timezone.now().replace(microsecond=0)
+        t2 = t1 + timedelta(seconds=1)
+        rows = [
+            # A full 2x2 frame, a partial frame missing r0_c1, and a named sensor
+            (t1, 'r0_c0', 1), (t1, 'r0_c1', 2), (t1, 'r1_c0', 3), (t1, 'r1_c1', 4),
+            (t2, 'r0_c0', 5), (t2, 'r1_c2', 9),
+            (t2, 'left_hip', 40),
+        ]
+        objs = PressureData.objects.bulk_create([
+            PressureData(patient=self.patient, timestamp=ts, sensor_location=loc, pressure_value=v) for ts, loc, v in rows
+        ])
+        commented = next(o for o in objs if o.timestamp == t2 and o.sensor_location == 'r0_c0')
+        Comment.objects.create(patient=self.patient, pressure_data=commented, text='keep me')
+
+        migration.rows_to_frames(django_apps, None)
+
+        first, second = PressureFrame.objects.filter(patient=self.patient).order_by('timestamp')
+        self.assertEqual(first.timestamp, t1)
+        np.testing.assert_array_equal(first.grid, [[1, 2], [3, 4]])
+        self.assertEqual((first.peak_value, first.peak_location), (4.0, 'r1_c1'))
+        self.assertEqual((second.rows, second.cols), (2, 3))
+        np.testing.assert_array_equal(second.grid, [[5, np.nan, np.nan], [np.nan, np.nan, 9]])
+        self.assertEqual((second.peak_value, second.peak_location), (9.0, 'r1_c2'))
+        # Named sensors and commented cells stay as rows
+        self.assertEqual(
+            sorted(PressureData.objects.filter(patient=self.patient).values_list('sensor_location', flat=True)),
+            ['left_hip', 'r0_c0'],
+        )
+
+
+@override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cache', CACHES=TEST_CACHES)
+class HotQueryPlanTests(TestCase):
+    """
+    Run EXPLAIN QUERY PLAN on every query the hot views issue against the
+    pressure/notification/comment tables and fail on full scans or sorts.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.clinician = User.objects.create_user('clin', password='pw', role='clinician')
+        cls.patient = User.objects.create_user('pat', password='pw', role='patient', clinician=cls.clinician)
+        other = User.objects.create_user('other', password='pw', role='patient')
+        now = timezone.now()
+        for owner in (cls.patient, other):
+            for i in range(20):
+                ts = now - timedelta(minutes=i)
+                PressureData.objects.create(patient=owner, timestamp=ts, sensor_location='left_hip', pressure_value=40 + i)
+                grid = np.full((4, 4), float(i), dtype='<f4')
+                PressureFrame.from_grid(owner, ts, grid).save()
+                Notification.objects.create(patient=owner, timestamp=ts, message='m', is_read=bool(i % 2))
+                Comment.objects.create(patient=owner, timestamp=ts, text='c')
+
+    def assertIndexedPlans(self, user, url):
+        caches[settings.LIVE_CACHE_ALIAS].clear()
+        self.client.force_login(user)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        checked = 0
+        with connection.cursor() as cursor:
+            for query in ctx.captured_queries:
+                sql = query['sql']
+                if not sql.startswith('SELECT') or not any(t in sql for t in HOT_TABLES):
+                    continue
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                plan = [row[-1] for row in cursor.fetchall()]
+                for step in plan:
+                    self.assertNotIn('USE TEMP B-TREE', step, f'{url}: sort without index\n{sql}\n{plan}')
+                    if step.startswith('SCAN'):
+                        self.assertFalse(
+                            any(t in step for t in HOT_TABLES),
+                            f'{url}: full table scan\n{sql}\n{plan}',
+                        )
+                checked += 1
+        self.assertGreater(checked, 0, f'{url} issued no queries against the hot tables')
+
+    def test_patient_views_use_indexes(self):
+        for name in ('dashboard', 'pressure_data', 'pressure_history_json', 'live_grid_json', 'live_graph_json'):
+            with self.subTest(view=name):
+                self.assertIndexedPlans(self.patient, reverse(name))
+
+    def test_clinician_views_use_indexes(self):
+        self.assertIndexedPlans(self.clinician, reverse('patient_list'))
+        for name in ('patient_detail', 'patient_history', 'clinician_patient_history', 'clinician_patient_live_grid'):
+            with self.subTest(view=name):
+                self.assertIndexedPlans(self.clinician, reverse(name, args=[self.patient.id]))
+
+
+class RepositionTests(TestCase):
+
+    def setUp(self):
+        self.patient = User.objects.create_user('pat', password='pw', role='patient')
+        self.start = timezone.now() - timedelta(minutes=10)
+        self.saved = 0
+
+    def frame(self, r, c, value):
+        # One hot cell on a 4x4 mat that is otherwise at 10 mmHg
+        grid = np.full((4, 4), 10.0, dtype='<f4')
+        grid[r, c] = value
+        PressureFrame.from_grid(self.patient, self.start + timedelta(seconds=self.saved), grid).save()
+        self.saved += 1
+        return reposition.current_suggestion(self.patient)
+
+    def test_peak_must_exceed_the_threshold(self):
+        for _ in range(reposition.WINDOW):
+            self.assertIsNone(self.frame(1, 0, reposition.PEAK_THRESHOLD))
+        self.assertEqual(self.frame(1, 0, reposition.PEAK_THRESHOLD + 1)['location'], 'r1_c0')
+
+    def test_peak_must_persist(self):
+        self.assertIsNone(self.frame(1, 0, 120))
+        suggestion = self.frame(1, 0, 120)
+        self.assertEqual((suggestion['action'], suggestion['confidence']), ('roll_right', 0.7))
+        self.assertEqual(self.frame(1, 0, 120)['confidence'], 0.9)
+        self.assertEqual(self.frame(2, 3, 120)['location'], 'r1_c0')  # still the most frequent
+        self.assertEqual(self.frame(2, 3, 120)['action'], 'roll_left')
+
+    def test_repositioning_clears_the_suggestion(self):
+        self.frame(1, 0, 120)
+        self.assertIsNotNone(self.frame(1, 0, 120))
+        self.assertIsNone(self.frame(2, 3, 40))
+        state = RepositionState.objects.get(patient=self.patient)
+        self.assertEqual(state.recent_locations, ['r2_c3', 'r1_c0', 'r1_c0'])
+
+    def test_late_frames_are_ignored_and_rebuild_matches(self):
+        self.frame(1, 0, 120)
+        self.frame(1, 0, 120)
+        late = np.full((4, 4), 10.0, dtype='<f4')
+        late[2, 3] = 200
+        PressureFrame.from_grid(self.patient, self.start - timedelta(minutes=1), late).save()
+        observed = RepositionState.objects.get(patient=self.patient)
+        self.assertEqual(observed.peak_location, 'r1_c0')
+        rebuilt = reposition.rebuild(self.patient)
+        self.assertEqual(rebuilt.suggestion, observed.suggestion)
+
+
+@override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cache', CACHES=TEST_CACHES)
+class LiveCacheTests(TestCase):
+
+    def setUp(self):
+        caches[settings.LIVE_CACHE_ALIAS].clear()
+        self.patient = User.objects.create_user('pat', password='pw', role='patient')
+        self.client.force_login(self.patient)
+        PressureFrame.from_grid(self.patient, timezone.now(), np.ones((2, 2), dtype='<f4')).save()
+
+    def test_unchanged_poll_is_304_without_data_queries(self):
+        first = self.client.get(reverse('live_grid_json'))
+        self.assertEqual(first.status_code, 200)
+        with CaptureQueriesContext(connection) as ctx:
+            second = self.client.get(reverse('live_grid_json'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 304)
+        self.assertFalse([q for q in ctx.captured_queries if any(t in q['sql'] for t in HOT_TABLES)])
+
+    def test_ingest_invalidates(self):
+        first = self.client.get(reverse('live_grid_json'))
+        PressureFrame.from_grid(self.patient, timezone.now(), np.full((2, 2), 5, dtype='<f4')).save()
+        second = self.client.get(reverse('live_grid_json'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.json()['cells'][0]['value'], 5.0)
+
+    def test_binary_format(self):
+        response = self.client.get(reverse('live_grid_json'), HTTP_ACCEPT=wire.CONTENT_TYPE)
+        self.assertEqual(response['Content-Type'], wire.CONTENT_TYPE)
+        self.assertIn('Accept', response['Vary'])
+        header, buffer = wire.decode(response.content)
+        self.assertEqual((header['rows'], header['cols']), (2, 2))
+        np.testing.assert_array_equal(np.frombuffer(buffer, dtype='<f4'), np.ones(4))
+        # Formats are cached and validated separately
+        self.assertNotEqual(response['ETag'], self.client.get(reverse('live_grid_json'))['ETag'])
+
+        response = self.client.get(reverse('live_graph_json'), {'format': 'binary'})
+        header, buffer = wire.decode(response.content)
+        times = np.frombuffer(buffer, dtype='<f8', count=header['count'])
+        values = np.frombuffer(buffer, dtype='<f4', offset=8 * header['count'])
+        self.assertEqual(header['count'], 1)
+        self.assertEqual(values.tolist(), [1.0])
+        self.assertAlmostEqual(times[0], PressureFrame.objects.get().timestamp.timestamp() * 1000, places=0)
+
+
+@override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cache', CACHES=TEST_CACHES)
+class LiveStreamTests(TestCase):
+
+    def setUp(self):
+        caches[settings.LIVE_CACHE_ALIAS].clear()
+        self.patient = User.objects.create_user('pat', password='pw', role='patient')
+        PressureFrame.from_grid(self.patient, timezone.now() - timedelta(seconds=2), np.ones((2, 2), dtype='<f4')).save()
+
+    def save_frame(self, value):
+        PressureFrame.from_grid(self.patient, timezone.now(), np.full((2, 2), value, dtype='<f4')).save()
+
+    def stream_events(self, write):
+        """Open a stream, make `write` (a coroutine function) change the data, return the grid events seen."""
+        async def run():
+            events = stream.event_stream(self.patient)
+            try:
+                self.assertTrue((await anext(events)).startswith(b'retry:'))
+                kinds = [(await anext(events)).split(b'\n')[0] for _ in live_cache.KINDS]
+                self.assertEqual(kinds, [b'event: grid', b'event: series'])
+                await write()
+                event = await asyncio.wait_for(anext(events), 5)
+            finally:
+                await events.aclose()
+                await asyncio.sleep(2 * stream.WATCH_INTERVAL)  # let the watcher see no subscribers and stop
+            return event
+
+        event = async_to_sync(run)()
+        self.assertTrue(event.startswith(b'event: grid\n'))
+        return json.loads(event.split(b'data: ', 1)[1])
+
+    def test_write_in_this_process_is_pushed(self):
+        payload = self.stream_events(sync_to_async(lambda: self.save_frame(7)))
+        self.assertEqual(payload['cells'][0]['value'], 7.0)
+
+    def test_write_in_another_process_is_picked_up_by_the_watcher(self):
+        def write_elsewhere():
+            # Another process shares the live cache but not this process's hub
+            with mock.patch.object(stream.hub, 'publish'):
+                self.save_frame(9)
+        payload = self.stream_events(sync_to_async(write_elsewhere))
+        self.assertEqual(payload['cells'][0]['value'], 9.0)
+
+    def test_view_needs_asgi(self):
+        self.client.force_login(self.patient)
+        self.assertEqual(self.client.get(reverse('live_stream')).status_code, 503)
+
+        async def first_chunk():
+            response = await self.async_client.get(reverse('live_stream'))
+            chunks = aiter(response.streaming_content)
+            chunk = await anext(chunks)
+            await chunks.aclose()
+            return response, chunk
+
+        self.async_client.force_login(self.patient)
+        response, chunk = async_to_sync(first_chunk)()
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(chunk, f'retry: {stream.RETRY_MS}\n\n'.encode())
+
+
+@override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cache')
+class HistoryApiTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = User.objects.create_user('pat', password='pw', role='patient')
+        cls.start = timezone.now().replace(microsecond=0) - timedelta(days=1)
+        # One frame per minute for a day with a single one-minute spike
+        frames = []
+        for i in range(24 * 60):
+            grid = np.full((2, 2), 30.0, dtype='<f4')
+            grid[1, 0] = 150.0 if i == 700 else 20.0 + i % 7
+            frames.append(PressureFrame.from_grid(cls.patient, cls.start + timedelta(minutes=i), grid))
+        PressureFrame.objects.bulk_create(frames)
+        ingest.record(PressureFrame, frames)
+        PressureData.objects.create(patient=cls.patient, timestamp=cls.start + timedelta(hours=2), sensor_location='left_hip', pressure_value=55)
+
+    def setUp(self):
+        self.client.force_login(self.patient)
+
+    def fetch(self, **params):
+        params.setdefault('start', int(self.start.timestamp() * 1000))
+        params.setdefault('end', int((self.start + timedelta(days=1)).timestamp() * 1000))
+        return self.client.get(reverse('pressure_history_json'), params)
+
+    def test_downsampled_series_is_bounded_and_keeps_peaks(self):
+        j = self.fetch(max_points=100).json()
+        self.assertEqual(j['source'], 'pressurerollupminute')
+        self.assertEqual(j['total'], 24 * 60 + 1)
+        self.assertLessEqual(len(j['t']), 100)
+        self.assertEqual(sum(j['count']), j['total'])
+        self.assertEqual(max(j['max']), 150.0)
+        self.assertEqual(j['t'], sorted(j['t']))
+
+    def test_small_range_is_returned_raw(self):
+        end = int((self.start + timedelta(minutes=10)).timestamp() * 1000)
+        j = self.fetch(end=end).json()
+        self.assertEqual(j['source'], 'raw')
+        self.assertEqual(j['bucket_seconds'], 0)
+        self.assertEqual(len(j['t']), 10)
+
+    def test_sensor_location_filters(self):
+        self.assertEqual(self.fetch(sensor_location='left_hip').json()['max'], [55.0])
+        cell = self.fetch(sensor_location='r1_c0', max_points=2000).json()
+        self.assertEqual(cell['total'], 24 * 60)
+        self.assertEqual(max(cell['max']), 150.0)
+        self.assertEqual(self.fetch(sensor_location='r5_c5').json()['total'], 0)
+
+    def test_defaults_to_the_day_before_the_newest_reading(self):
+        j = self.client.get(reverse('pressure_history_json')).json()
+        self.assertEqual(j['total'], 24 * 60 + 1)
+
+    def test_empty_rollup_window(self):
+        j = self.fetch(start='2020-01-01T00:00:00Z', end='2020-01-08T00:00:00Z').json()
+        self.assertEqual(j['source'], 'pressurerollupminute')
+        self.assertEqual((j['total'], j['t'], j['max'], j['count']), (0, [], [], []))
+
+    def test_patient_without_readings(self):
+        clinician = User.objects.create_user('clin', password='pw', role='clinician')
+        empty = User.objects.create_user('empty', password='pw', role='patient', clinician=clinician)
+        self.client.force_login(empty)
+        j = self.client.get(reverse('pressure_history_json')).json()
+        self.assertEqual((j['total'], j['t'], j['mean']), (0, [], []))
+        self.client.force_login(clinician)
+        response = self.client.get(reverse('clinician_patient_history', args=[empty.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['t'], [])
+
+    def test_bad_parameters(self):
+        self.assertEqual(self.fetch(start='yesterday').status_code, 400)
+        self.assertEqual(self.fetch(end=int(self.start.timestamp() * 1000)).status_code, 400)
+        self.assertEqual(self.fetch(max_points='many').status_code, 400)
+
+    def test_out_of_range_bounds_are_clamped(self):
+        url = reverse('pressure_history_json')
+        response = self.fetch(start='-' + '9' * 400, end='9' * 30)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['end'], history.LATEST.isoformat())
+        for params in ({'end': '0001-01-01T00:00:00'}, {'start': '9999-12-31T23:00:00'}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(url, params).status_code, 400)  # nothing left between the clamped bounds
+        response = self.client.get(url, {'start': '0001-01-01T00:00:00+05:00'})
+        self.assertEqual(response.json()['start'], history.EARLIEST.isoformat())
+
+
+class RollupTests(TestCase):
+
+    def setUp(self):
+        self.patient = User.objects.create_user('pat', password='pw', role='patient')
+        self.start = timezone.now().replace(minute=0, second=0, microsecond=0) - timedelta(hours=3)
+
+    def rollup_rows(self, model):
+        return list(model.objects.filter(patient=self.patient).order_by('sensor_location', 'bucket_start').values_list(
+            'sensor_location', 'bucket_start', 'min_value', 'max_value', 'sum_value', 'count', 'seconds_above',
+        ))
+
+    def ingest(self):
+        # Readings every 10s for two hours; left_hip goes above the threshold for 5 minutes
+        for i in range(720):
+            ts = self.start + timedelta(seconds=10 * i)
+            high = 300 <= i < 330
+            PressureData.objects.create(patient=self.patient, timestamp=ts, sensor_location='left_hip', pressure_value=120 if high else 50)
+            if i % 6 == 0:
+                PressureFrame.from_grid(self.patient, ts, np.full((2, 2), 20 + i % 40, dtype='<f4')).save()
+
+    def test_incremental_matches_rebuild(self):
+        with ingest.deferred():
+            self.ingest()
+        incremental = {model: self.rollup_rows(model) for model in (PressureRollupMinute, PressureRollupHour)}
+        self.assertEqual(len(incremental[PressureRollupHour]), 4)  # 2 sensors x 2 hours
+        rollups.rebuild(self.patient)
+        for model, rows in incremental.items():
+            self.assertEqual(self.rollup_rows(model), rows)
+
+    def test_single_saves_update_rollups(self):
+        self.ingest()
+        hour = PressureRollupHour.objects.get(patient=self.patient, sensor_location='left_hip', bucket_start=self.start)
+        self.assertEqual(hour.count, 360)
+        self.assertEqual(hour.max_value, 120)
+        self.assertEqual(hour.seconds_above, 300)
+        minute = PressureRollupMinute.objects.get(patient=self.patient, sensor_location=rollups.MAT_PEAK, bucket_start=self.start)
+        self.assertEqual((minute.count, minute.min_value), (1, 20))
+
+    def test_merging_the_same_bucket_twice_adds_up(self):
+        ts = self.start.timestamp()
+        rollups._fold([(self.patient.pk, 'left_hip', ts, 40.0), (self.patient.pk, 'left_hip', ts + 10, 60.0)])
+        rollups._fold([(self.patient.pk, 'left_hip', ts + 20, 30.0), (self.patient.pk, 'left_hip', ts + 30, 90.0)])
+        for model in (PressureRollupMinute, PressureRollupHour):
+            row = model.objects.get(patient=self.patient, sensor_location='left_hip', bucket_start=self.start)
+            self.assertEqual((row.min_value, row.max_value, row.sum_value, row.count), (30, 90, 220, 4))
+
+    def test_summary(self):
+        self.ingest()
+        rows = {row['sensor_location']: row for row in rollups.summary(self.patient, self.start, self.start + timedelta(days=1))}
+        self.assertEqual(rows['left_hip']['peak'], 120)
+        self.assertEqual(rows['left_hip']['minutes_above'], 5.0)
+        self.assertEqual(rows[rollups.MAT_PEAK]['readings'], 120)
+
+
+class AlertTests(TestCase):
+
+    def setUp(self):
+        self.patient = User.objects.create_user('pat', email='pat@example.com', password='pw', role='patient')
+        self.start = timezone.now() - timedelta(hours=1)
+
+    def frame(self, seconds, hot_cells=3):
+        grid = np.full((4, 4), 40, dtype='<f4')
+        grid.flat[:hot_cells] = [110 + i for i in range(hot_cells)]
+        return PressureFrame.from_grid(self.patient, self.start + timedelta(seconds=seconds), grid)
+
+    def test_one_coalesced_alert_per_frame(self):
+        self.frame(0).save()
+        notification = Notification.objects.get(patient=self.patient)
+        self.assertIn('r0_c2: 112.0 (3 cells above 100 mmHg)', notification.message)
+        self.assertEqual(AlertEmail.objects.get().notification, notification)
+        self.assertEqual(len(mail.outbox), 0)  # queued, not sent during ingest
+
+    def test_cooldown_bounds_alerts_for_a_burst(self):
+        # Two minutes of hot frames every 2s, then another one after the cooldown
+        with ingest.deferred():
+            for i in range(60):
+                self.frame(2 * i).save()
+        self.frame(2 * 60).save()  # still inside the first alert's window
+        self.frame(alerts.COOLDOWN.total_seconds() + 10).save()
+        messages = list(Notification.objects.filter(patient=self.patient).order_by('reading_timestamp').values_list('message', flat=True))
+        self.assertEqual(len(messages), 2)
+        self.assertIn('59 more high-pressure readings', messages[0])
+        self.assertEqual(AlertEmail.objects.count(), 2)
+
+    def test_bulk_created_frames_alert(self):
+        frames = [self.frame(600 * i, hot_cells=0 if i % 2 else 2) for i in range(4)]
+        PressureFrame.objects.bulk_create(frames)
+        self.assertEqual(Notification.objects.filter(patient=self.patient).count(), 0)
+        ingest.record(PressureFrame, frames)
+        self.assertEqual(Notification.objects.filter(patient=self.patient).count(), 2)
+
+    def test_named_sensors_uploaded_together_raise_one_alert(self):
+        with ingest.deferred():
+            for i, location in enumerate(('left_hip', 'right_hip', 'sacrum', 'left_heel')):
+                PressureData.objects.create(patient=self.patient, timestamp=self.start, sensor_location=location, pressure_value=90 + 10 * i)
+        notification = Notification.objects.get(patient=self.patient)
+        self.assertIn('left_heel: 120.0 (2 sensors above 100 mmHg)', notification.message)
+
+
+class FailingEmailBackend(BaseEmailBackend):
+    def send_messages(self, email_messages):
+        raise ConnectionRefusedError('mail server down')
+
+
+class OutboxTests(TestCase):
+
+    def setUp(self):
+        self.patient = User.objects.create_user('pat', email='pat@example.com', password='pw', role='patient')
+        start = timezone.now() - timedelta(hours=1)
+        for i in range(3):
+            grid = np.full((2, 2), 120, dtype='<f4')
+            PressureFrame.from_grid(self.patient, start + i * alerts.COOLDOWN, grid).save()
+
+    def test_digest_per_patient(self):
+        other = User.objects.create_user('other', email='other@example.com', password='pw', role='patient')
+        PressureFrame.from_grid(other, timezone.now(), np.full((2, 2), 120, dtype='<f4')).save()
+        self.assertEqual(outbox.drain(), (2, 4, 0))
+        self.assertEqual(sorted(m.subject for m in mail.outbox), ['High Pressure Alert', 'High Pressure Alerts (3)'])
+        self.assertEqual(AlertEmail.objects.filter(sent_at__isnull=True).count(), 0)
+        self.assertEqual(outbox.drain(), (0, 0, 0))
+
+    def test_retry_with_backoff_then_park(self):
+        failing = FailingEmailBackend()
+        self.assertEqual(outbox.drain(connection=failing), (0, 0, 3))
+        row = AlertEmail.objects.first()
+        self.assertEqual(row.attempts, 1)
+        self.assertIn('mail server down', row.last_error)
+        self.assertEqual(outbox.drain(connection=failing), (0, 0, 0))  # not due yet
+        for attempt in range(2, outbox.MAX_ATTEMPTS + 1):
+            AlertEmail.objects.update(next_attempt_at=timezone.now())
+            outbox.drain(connection=failing)
+        row.refresh_from_db()
+        self.assertEqual(row.attempts, outbox.MAX_ATTEMPTS)
+        self.assertIsNone(row.next_attempt_at)  # parked
+
+    def test_sends_outside_the_claim_transaction(self):
+        depth = len(connection.atomic_blocks)  # the test case's own transaction
+
+        class RecordingBackend(BaseEmailBackend):
+            def send_messages(self, messages):
+                self.depth = len(connection.atomic_blocks)
+                self.due = AlertEmail.objects.filter(next_attempt_at__lte=timezone.now()).count()
+                return len(messages)
+
+        backend = RecordingBackend()
+        self.assertEqual(outbox.drain(connection=backend), (1, 3, 0))
+        self.assertEqual(backend.depth, depth)
+        self.assertEqual(backend.due, 0)  # leased while in flight
+
+    def test_rows_of_a_crashed_send_are_retried_after_the_lease(self):
+        class CrashingBackend(BaseEmailBackend):
+            def send_messages(self, messages):
+                raise SystemExit
+
+        with self.assertRaises(SystemExit):
+            outbox.drain(connection=CrashingBackend())
+        self.assertEqual(outbox.drain(), (0, 0, 0))
+        AlertEmail.objects.update(next_attempt_at=timezone.now())  # lease expired
+        self.assertEqual(outbox.drain(), (1, 3, 0))
+
+    def test_command_drains_once(self):
+        call_command('send_alert_emails', '--once', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+
+
+class ImporterTests(TestCase):
+
+    def setUp(self):
+        self.patient = User.objects.create_user('pat', password='pw', role='patient')
+        self.timestamp = timezone.now().replace(microsecond=0)
+
+    def run_import(self, text, **kwargs):
+        return importer.import_csv(BytesIO(text.encode('utf-8-sig')), self.patient, self.timestamp, **kwargs)
+
+    def test_header_csv(self):
+        lines = ['sensor_location,pressure_value', 'left_hip,40', 'right_hip,oops', 'r0_c0,10', 'r1_c2,120', 'sacrum,55']
+        stats = self.run_import('\n'.join(lines) + '\n')
+        self.assertEqual((stats.rows, stats.skipped, stats.readings, stats.cells, stats.frames), (5, 1, 2, 2, 1))
+        self.assertEqual(sorted(PressureData.objects.values_list('sensor_location', flat=True)), ['left_hip', 'sacrum'])
+        frame = PressureFrame.objects.get()
+        self.assertEqual((frame.rows, frame.cols, frame.peak_value), (2, 3, 120.0))
+        self.assertEqual(Notification.objects.count(), 1)  # the frame cell above the threshold
+        self.assertEqual(PressureRollupMinute.objects.filter(sensor_location='left_hip').count(), 1)
+
+    def test_ragged_and_quoted_rows(self):
+        stats = self.run_import('pressure_value,sensor_location,note\n40,left_hip,\n12,heel\n"7","r0_c1","a, b"\n')
+        self.assertEqual((stats.rows, stats.skipped, stats.readings, stats.cells), (3, 0, 2, 1))
+        self.assertEqual(PressureFrame.objects.get().grid.shape, (1, 2))
+
+    def test_matrix_csv(self):
+        stats = self.run_import('1,2,3\r\n4,,6\r\n\r\n')
+        self.assertEqual((stats.layout, stats.cells, stats.frames), ('matrix', 5, 1))
+        grid = PressureFrame.objects.get().grid
+        self.assertEqual(grid.shape, (2, 3))
+        self.assertTrue(np.isnan(grid[1, 1]))
+
+    def test_small_chunks_match_one_chunk(self):
+        lines = ['sensor_location,pressure_value'] + [f'r{i // 8}_c{i % 8},{i}' for i in range(64)] + ['heel,7']
+        text = '\n'.join(lines)  # no trailing newline
+        whole = self.run_import(text)
+        grid = PressureFrame.objects.get().grid
+        PressureFrame.objects.all().delete()
+        PressureData.objects.all().delete()
+        chunked = self.run_import(text, chunk_bytes=7)
+        self.assertEqual((whole.rows, whole.cells, whole.readings), (chunked.rows, chunked.cells, chunked.readings))
+        np.testing.assert_array_equal(PressureFrame.objects.get().grid, grid)
+
+    def test_unrecognised_layout(self):
+        with self.assertRaises(importer.ImportFormatError):
+            self.run_import('name,value\nleft_hip,4\n')
+        self.assertFalse(PressureData.objects.exists())
+
+    def test_overlapping_upload_merges_into_the_frame(self):
+        self.run_import('sensor_location,pressure_value\nr0_c0,10\nr0_c1,20\n')
+        stats = self.run_import('sensor_location,pressure_value\nr0_c1,25\nr1_c0,30\n')
+        self.assertEqual((stats.frames, stats.merged), (0, 1))
+        grid = PressureFrame.objects.get().grid
+        np.testing.assert_array_equal(grid, [[10, 25], [30, np.nan]])
+        self.assertEqual(PressureRollupMinute.objects.get(sensor_location=rollups.MAT_PEAK).max_value, 30.0)
+        self.assertEqual(self.run_import('sensor_location,pressure_value\nr1_c0,30\n').unchanged, 1)
+
+    def test_named_readings_are_replaced_not_duplicated(self):
+        stats = self.run_import('sensor_location,pressure_value\nleft_hip,40\nleft_hip,45\nheel,5\n')
+        self.assertEqual((stats.readings, stats.replaced), (2, 0))
+        stats = self.run_import('sensor_location,pressure_value\nleft_hip,120\nsacrum,7\n')
+        self.assertEqual((stats.readings, stats.replaced), (1, 1))
+        self.assertEqual(
+            sorted(PressureData.objects.values_list('sensor_location', 'pressure_value')),
+            [('heel', 5.0), ('left_hip', 120.0), ('sacrum', 7.0)],
+        )
+        self.assertEqual(PressureRollupMinute.objects.get(sensor_location='left_hip').max_value, 120.0)
+        self.assertEqual(Notification.objects.count(), 1)
+
+    def test_stacked_matrices_with_timestamp_lines(self):
+        self.timestamp = timezone.make_aware(datetime(2024, 5, 1))
+        text = '23:59:59\n1,2\n3,4\n\n00:00:00\n5,6\n# 172800\n7,,9\n'
+        stats = self.run_import(text, chunk_bytes=5)
+        self.assertEqual((stats.layout, stats.frames, stats.rows, stats.cells), ('matrix', 3, 5, 8))
+        frames = list(PressureFrame.objects.order_by('timestamp'))
+        self.assertEqual(
+            [timezone.localtime(f.timestamp).strftime('%d %H:%M:%S') for f in frames],
+            ['01 23:59:59', '02 00:00:00', '03 00:00:00'],  # past midnight, then seconds after the upload
+        )
+        self.assertEqual((frames[0].grid.shape, frames[2].grid.shape), ((2, 2), (1, 3)))
+
+    def test_long_format_with_a_time_column(self):
+        lines = ['time,sensor_location,pressure_value']
+        lines += [f'{t},r{i // 2}_c{i % 2},{t * 10 + i}' for t in range(5) for i in range(4)]
+        lines += ['2,heel,30', 'later,heel,1']
+        stats = importer.import_csv(
+            BytesIO('\n'.join(lines).encode()), self.patient, self.timestamp, chunk_bytes=40,
+        )
+        self.assertEqual((stats.frames, stats.cells, stats.readings, stats.skipped), (5, 20, 1, 1))
+        latest = PressureFrame.objects.order_by('-timestamp').first()
+        self.assertEqual(latest.timestamp, self.timestamp + timedelta(seconds=4))
+        np.testing.assert_array_equal(latest.grid, [[40, 41], [42, 43]])
+        self.assertEqual(PressureData.objects.get().timestamp, self.timestamp + timedelta(seconds=2))
+
+
+@skipUnless(connection.vendor == 'sqlite', 'SQLite pragmas')
+class SqlitePragmaTests(TestCase):
+
+    def cache_size(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA cache_size')
+            return cursor.fetchone()[0]
+
+    def test_pragmas_are_applied_to_connections(self):
+        configured = settings.SQLITE_PRAGMAS.get('cache_size', -2000)  # -2000 is SQLite's default
+        self.assertEqual(self.cache_size(), configured)
+        with override_settings(SQLITE_PRAGMAS={'cache_size': -1024}):
+            db.apply_sqlite_pragmas(None, connection)
+        self.assertEqual(self.cache_size(), -1024)
+        with override_settings(SQLITE_PRAGMAS={'cache_size': configured}):
+            db.apply_sqlite_pragmas(None, connection)
+
+
+
+@override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cache', CACHES=TEST_CACHES)
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        caches[settings.LIVE_CACHE_ALIAS].clear()
+        self.patient = User.objects.create_user('pat', password='pw', role='patient')
+        self.admin = User.objects.create_user('adm', password='pw', role='admin')
+        PressureFrame.from_grid(self.patient, timezone.now(), np.ones((2, 2), dtype='<f4')).save()
+
+    def test_records_each_view(self):
+        self.client.force_login(self.patient)
+        first = self.client.get(reverse('live_grid_json'))
+        self.client.get(reverse('live_grid_json'))
+        stats = metrics.as_json()['views']['live_grid_json']
+        self.assertEqual(stats['requests'], 2)
+        self.assertEqual(stats['status'], {'2xx': 2})
+        self.assertEqual(stats['cache']['live'], {'hit': 1, 'miss': 1})
+        self.assertGreater(stats['queries']['sum'], 0)  # the miss built the payload
+        self.assertEqual(stats['bytes']['sum'], 2 * len(first.content))
+        self.assertEqual(stats['wall_ms']['count'], 2)
+
+    def test_endpoint_is_admin_only(self):
+        self.client.force_login(self.patient)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.client.force_login(self.admin)
+        self.client.get(reverse('user_list'))
+        data = self.client.get(reverse('metrics')).json()
+        self.assertIn('user_list', data['views'])
+        text = self.client.get(reverse('metrics'), {'format': 'prometheus'})
+        self.assertTrue(text['Content-Type'].startswith('text/plain'))
+        self.assertIn('graphene_requests_total{view="user_list",status="2xx"} 1', text.content.decode())
+        self.assertIn('graphene_request_duration_ms_bucket{view="user_list",le="+Inf"} 1', text.content.decode())
+
+    @override_settings(METRICS_SLOW_REQUEST_MS=0, METRICS_SLOW_QUERIES=2)
+    def test_slow_requests_log_their_slowest_queries(self):
+        self.client.force_login(self.patient)
+        with self.assertLogs('patients.metrics', 'WARNING') as logs:
+            self.client.get(reverse('live_graph_json'))
+        self.assertIn('live_graph_json', logs.output[0])
+        sample = metrics.as_json()['slow_requests'][-1]
+        self.assertEqual(sample['view'], 'live_graph_json')
+        self.assertLessEqual(len(sample['slowest']), 2)
+        self.assertTrue(sample['slowest'])
+
+    def test_async_requests_are_recorded(self):
+        self.async_client.force_login(self.patient)
+        response = async_to_sync(self.async_client.get)(reverse('live_grid_json'))
+        self.assertEqual(response.status_code, 200)
+        stats = metrics.as_json()['views']['live_grid_json']
+        self.assertEqual(stats['requests'], 1)
+        self.assertEqual(stats['cache']['live'], {'hit': 0, 'miss': 1})
+        self.assertGreater(stats['queries']['sum'], 0)  # run on a sync_to_async thread
+
+    def test_queries_on_other_threads_are_counted(self):
+        def query():
+            Comment.objects.exists()  # a table this test's open transaction hasn't locked
+            connection.close()
+
+        def view(request):
+            with ThreadPoolExecutor(max_workers=1) as pool:
+                pool.submit(contextvars.copy_context().run, query).result()
+            return HttpResponse()
+
+        metrics.MetricsMiddleware(view)(RequestFactory().get('/'))
+        self.assertEqual(metrics.as_json()['views']['<unresolved>']['queries']['sum'], 1)
+
+
+
+@override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cache')
+class ProfilingTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(PROFILE_DIR=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        profiling.forget_rules(ProfileRule)
+        self.patient = User.objects.create_user('pat', password='pw', role='patient')
+        self.other = User.objects.create_user('pat2', password='pw', role='patient')
+        self.admin = User.objects.create_user('adm', password='pw', role='admin')
+
+    def test_rule_profiles_the_next_n_matching_requests(self):
+        ProfileRule.objects.create(pattern='live_grid_json', remaining=2)
+        self.client.force_login(self.patient)
+        self.client.get(reverse('live_graph_json'))  # does not match
+        for _ in range(3):
+            self.assertEqual(self.client.get(reverse('live_grid_json')).status_code, 200)
+        saved = profiling.profiles()
+        self.assertEqual(len(saved), 2)
+        self.assertIn('live_grid_json-pat-', saved[0]['name'])
+        self.assertEqual(ProfileRule.objects.get().remaining, 0)
+        with open(profiling.profile_path(saved[0]['name'], 'collapsed')) as f:
+            stacks = [line.rsplit(' ', 1) for line in f]
+        self.assertTrue(any('live_grid_json (views.py' in stack for stack, _ in stacks))
+        self.assertTrue(all(int(micros) >= 1 for _, micros in stacks))
+
+    def test_async_stack_profiles_sync_views_but_not_streams(self):
+        ProfileRule.objects.create(pattern='^/api/live-', remaining=5)
+        self.async_client.force_login(self.patient)
+
+        async def run():
+            response = await self.async_client.get(reverse('live_stream'))
+            chunks = aiter(response.streaming_content)
+            self.assertTrue((await anext(chunks)).startswith(b'retry:'))
+            await chunks.aclose()
+            return await self.async_client.get(reverse('live_grid_json'))
+
+        self.assertEqual(async_to_sync(run)().status_code, 200)
+        saved = profiling.profiles()
+        self.assertEqual(len(saved), 1)
+        self.assertIn('live_grid_json-pat-', saved[0]['name'])
+        with open(profiling.profile_path(saved[0]['name'], 'collapsed')) as f:
+            self.assertIn('live_grid_json (views.py', f.read())
+        self.assertEqual(ProfileRule.objects.get().remaining, 4)
+
+    def test_user_rule_and_signed_header(self):
+        ProfileRule.objects.create(user=self.other, remaining=5)
+        self.client.force_login(self.patient)
+        self.client.get(reverse('live_grid_json'))
+        self.client.get(reverse('live_grid_json'), HTTP_X_GRAPHENE_PROFILE='forged')
+        self.assertEqual(profiling.profiles(), [])
+        self.client.get(reverse('live_grid_json'), HTTP_X_GRAPHENE_PROFILE=profiling.header_token(self.admin))
+        self.client.force_login(self.other)
+        self.client.get(reverse('live_graph_json'))
+        self.assertEqual(len(profiling.profiles()), 2)
+        self.assertEqual(ProfileRule.objects.get().remaining, 4)
+
+    def test_admin_page_adds_rules_and_serves_files(self):
+        self.client.force_login(self.patient)
+        self.assertTemplateUsed(self.client.get(reverse('profiles')), '403.html')
+        self.client.force_login(self.admin)
+        response = self.client.post(reverse('profiles'), {'pattern': '(', 'remaining': 1})
+        self.assertContains(response, 'Not a valid regular expression')
+        self.client.post(reverse('profiles'), {'pattern': '^/accounts/user_list/$', 'remaining': 1})
+        self.client.get(reverse('user_list'))
+        name = profiling.profiles()[0]['name']
+        page = self.client.get(reverse('profiles'))
+        self.assertContains(page, name)
+        download = self.client.get(reverse('profile_download', args=[name, 'pstats']))
+        self.assertEqual(download.status_code, 200)
+        self.assertGreater(len(b''.join(download.streaming_content)), 0)
+        self.assertEqual(self.client.get(reverse('profile_download', args=['missing', 'pstats'])).status_code, 404)
+
+    def test_admin_page_deletes_rules(self):
+        self.client.force_login(self.admin)
+        rule = ProfileRule.objects.create(pattern='^/accounts/user_list/$', remaining=1, created_by=self.admin)
+        self.assertEqual(self.client.post(reverse('profiles'), {'delete': 'x'}).status_code, 400)
+        self.assertRedirects(self.client.post(reverse('profiles'), {'delete': rule.pk}), reverse('profiles'))
+        self.assertFalse(ProfileRule.objects.exists())
+
+
+class DeviceIngestTests(TestCase):
+
+    def setUp(self):
+        self.patient = User.objects.create_user('pat', password='pw', role='patient')
+        self.other = User.objects.create_user('other', password='pw', role='patient')
+        self.device = Device(name='bed-1')
+        self.token = devices.issue_token(self.device)
+        self.device.save()
+        self.device.patients.add(self.patient)
+        self.epoch_ms = int(timezone.now().timestamp() * 1000) - 60_000
+
+    def post(self, body, token=None):
+        return self.client.post(reverse('ingest_frames'), body, content_type=wire.FRAME_CONTENT_TYPE,
+                                HTTP_AUTHORIZATION=f'Bearer {token or self.token}')
+
+    def test_batch_is_acknowledged_per_frame(self):
+        grid = np.arange(6, dtype='<f4').reshape(2, 3)
+        bad = grid.copy()
+        bad[0, 0] = np.inf
+        body = b''.join([
+            wire.encode_frame(self.patient.pk, self.epoch_ms, grid),
+            wire.encode_frame(self.patient.pk, self.epoch_ms + 100, grid, wire.UINT16, 0.5),
+            wire.encode_frame(self.other.pk, self.epoch_ms, grid),
+            wire.encode_frame(self.patient.pk, self.epoch_ms + 200, bad),
+            wire.encode_frame(self.patient.pk, self.epoch_ms, grid),
+        ])
+        reply = self.post(body).json()
+        self.assertEqual((reply['stored'], reply['duplicate'], reply['rejected']), (2, 1, 2))
+        acks = reply['frames']
+        self.assertEqual([ack['status'] for ack in acks], ['stored', 'stored', 'rejected', 'rejected', 'duplicate'])
+        self.assertEqual(acks[4]['id'], acks[0]['id'])
+        frame = PressureFrame.objects.get(pk=acks[1]['id'])
+        np.testing.assert_array_equal(frame.grid, grid)
+        self.assertEqual(frame.peak_location, 'r1_c2')
+        self.assertEqual(PressureRollupMinute.objects.filter(patient=self.patient).count(), 1)
+
+        # A resend after a lost response is acknowledged without a second frame
+        reply = self.post(wire.encode_frame(self.patient.pk, self.epoch_ms, grid)).json()
+        self.assertEqual(reply['frames'], [{'status': 'duplicate', 'id': acks[0]['id']}])
+        self.assertEqual(PressureFrame.objects.count(), 2)
+
+    def test_bad_token_and_truncated_body(self):
+        body = wire.encode_frame(self.patient.pk, self.epoch_ms, np.ones((2, 2)))
+        self.assertEqual(self.post(body, token='wrong').status_code, 401)
+        self.assertEqual(self.post(body[:-1]).status_code, 400)
+        self.assertFalse(PressureFrame.objects.exists())
+
+
+class LoadBenchmarkTests(TransactionTestCase):
+    # Committed data, so bench_endpoints' client thread (its own connection) can see it.
+    # One thread: the in-memory test database locks whole tables between connections.
+
+    def test_generate_load_then_bench_endpoints(self):
+        out = StringIO()
+        call_command('generate_load', '--patients', '3', '--clinicians', '2', '--mat', '4x4',
+                     '--interval', '600', '--days', '0.5', stdout=out)
+        self.assertEqual(User.objects.filter(username__startswith='load-patient-', clinician__isnull=False).count(), 3)
+        self.assertEqual(PressureFrame.objects.filter(patient__username='load-patient-0000').count(), 72)
+
+        out = StringIO()
+        call_command('bench_endpoints', '--requests', '4', '--warmup', '1', '--concurrency', '1', stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['dataset'], {'patients': 3, 'frames': 216})
+        self.assertEqual(set(report['endpoints']), {
+            'dashboard', 'live_grid_json', 'live_graph_json', 'patient_list', 'patient_history', 'upload_csv',
+        })
+        for name, result in report['endpoints'].items():
+            self.assertEqual(result['requests'], 4, name)
+            self.assertEqual(result['errors'], 0, name)
+            self.assertLessEqual(result['latency_ms_p50'], result['latency_ms_p99'], name)
+        self.assertEqual(report['endpoints']['upload_csv']['status'], {'302': 4})
+        self.assertFalse(ImportJob.objects.exists())  # the benchmark's queued uploads are removed
+
+
+class DeviceGatewayTests(TransactionTestCase):
+    # The gateway writes from its own database thread, so the data must be committed
+
+    def test_simulated_mats_are_stored_and_acked(self):
+        out = StringIO()
+        call_command('simulate_mats', '--mats', '3', '--rate', '20', '--seconds', '0.5', '--size', '4x4',
+                     '--batch-delay', '0.01', '--keep', stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertGreater(report['sent'], 0)
+        self.assertEqual(report['stored'], report['sent'])
+        self.assertEqual(report['unacked'], 0)
+        self.assertEqual(report['gateway']['stored'], report['sent'])
+        self.assertEqual(PressureFrame.objects.filter(patient__username__startswith='mat-sim-').count(), report['sent'])
+
+    def test_unknown_token_is_refused(self):
+        async def connect():
+            server = gateway.Gateway()
+            listener = await server.start('127.0.0.1', 0)
+            try:
+                reader, writer = await asyncio.open_connection('127.0.0.1', listener.sockets[0].getsockname()[1])
+                writer.write(gateway.message(b'not-a-token'))
+                reply = await gateway.read_message(reader, 256)
+                closed = await reader.read() == b''
+                writer.close()
+                return reply, closed
+            finally:
+                await server.close()
+
+        self.assertEqual(asyncio.run(connect()), (b'ERR invalid device token', True))
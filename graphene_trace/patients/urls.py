@@ -5,9 +5,12 @@ urlpatterns = [
     path('', views.dashboard, name='dashboard'),
     path('add_pressure_data/', views.add_pressure_data, name='add_pressure_data'),
     path('pressure-data/', views.pressure_data, name='pressure_data'),
+    path('api/history/', views.pressure_history_json, name='pressure_history_json'),
     path('live-graph-json/', views.live_graph_json, name='live_graph_json'),
     path('comments/', views.comments, name='comments'),
     path('notifications/', views.notifications, name='notifications'),
     path('live-map/', views.live_map, name='live_map'),
     path('api/live-grid/', views.live_grid_json, name='live_grid_json'),
+    path('api/live-stream/', views.live_stream, name='live_stream'),
+    path('api/frames/', views.ingest_frames, name='ingest_frames'),
 ]
\ No newline at end of file
@@ -1,12 +1,20 @@
 from django.shortcuts import render, get_object_or_404
 from django.contrib.auth.decorators import login_required
-from .models import PressureData, Comment, Notification
+from .models import PressureData, PressureFrame, Comment, Notification
 from django.utils import timezone
 from datetime import timedelta
 from django.shortcuts import redirect
 from .forms import CommentForm, PressureDataForm
 from django.http import JsonResponse
-import re
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from django.conf import settings
+from .frames import grid_from_cells, parse_coord
+from . import cache as live_cache
+from . import devices
+from .history import history, params_from_query
+from .stream import stream_response
+from .wire import decode_frames, negotiate
 
 @login_required
 def add_pressure_data(request):
@@ -17,7 +25,13 @@ def add_pressure_data(request):
         if form.is_valid():
             data = form.save(commit=False)
             data.patient = request.user
-            data.save()
+            coord = parse_coord(data.sensor_location)
+            if coord:
+                # Grid cells are stored as a (sparse) frame, like CSV uploads
+                grid = grid_from_cells([(coord[0], coord[1], data.pressure_value)])
+                PressureFrame.from_grid(request.user, data.timestamp, grid).save()
+            else:
+                data.save()
             return redirect('dashboard')
     else:
         form = PressureDataForm()
@@ -49,14 +63,21 @@ def dashboard(request):
 def pressure_data(request):
     if request.user.role != 'patient':
         return render(request, '403.html')  # Forbidden
-    data = PressureData.objects.filter(patient=request.user).order_by('-timestamp')[:100]  # Limit for graph
-    labels = [d.timestamp.strftime('%Y-%m-%d %H:%M') for d in reversed(data)]
-    values = [d.pressure_value for d in reversed(data)]
-    return render(request, 'patients/pressure_data.html', {
-        'data': data,
-        'labels': labels,
-        'values': values,
-    })
+    # The chart loads its range from pressure_history_json; this lists the latest rows
+    data = PressureData.objects.filter(patient=request.user).order_by('-timestamp')[:100]
+    return render(request, 'patients/pressure_data.html', {'data': data})
+
+
+@login_required
+def pressure_history_json(request):
+    # Downsampled pressure history over ?start=&end= (see patients.history)
+    if request.user.role != 'patient':
+        return JsonResponse({'error': 'forbidden'}, status=403)
+    try:
+        params = params_from_query(request.GET, request.user)
+    except ValueError as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+    return JsonResponse(history(request.user, **params))
 
 @login_required
 def comments(request):
@@ -94,83 +115,41 @@ def live_grid_json(request):
     # Return latest grid for the current patient as JSON
     if request.user.role != 'patient':
         return JsonResponse({'error': 'forbidden'}, status=403)
-    # find latest timestamp for this patient
-    latest = PressureData.objects.filter(patient=request.user).order_by('-timestamp').values_list('timestamp', flat=True).first()
-    if not latest:
-        return JsonResponse({'cells': []})
-    rows = PressureData.objects.filter(patient=request.user, timestamp=latest)
-    cells = []
-    coord_re = re.compile(r'^r(\d+)_c(\d+)$')
-    for p in rows:
-        m = coord_re.match(p.sensor_location)
-        if m:
-            r = int(m.group(1))
-            c = int(m.group(2))
-            cells.append({'r': r, 'c': c, 'value': p.pressure_value})
-        else:
-            cells.append({'label': p.sensor_location, 'value': p.pressure_value})
-    # Simple repositioning heuristic: check persistence across recent timestamps
-    reposition = None
-    try:
-        recent_timestamps = PressureData.objects.filter(patient=request.user).order_by('-timestamp').values_list('timestamp', flat=True).distinct()[:3]
-        top_locations = []
-        for ts in recent_timestamps:
-            rows_ts = PressureData.objects.filter(patient=request.user, timestamp=ts)
-            if not rows_ts:
-                continue
-            # find location with max pressure
-            top = max(rows_ts, key=lambda p: p.pressure_value)
-            top_locations.append(top.sensor_location)
-        if top_locations:
-            # if most common top location repeats, consider it persistent
-            from collections import Counter
-            cnt = Counter(top_locations)
-            loc, count = cnt.most_common(1)[0]
-            # get current top value
-            current_top = max(rows, key=lambda p: p.pressure_value)
-            if count >= 2 and current_top.pressure_value > 80:
-                # derive simple direction from coordinate if possible
-                import re
-                m = re.match(r'^r(\d+)_c(\d+)$', loc)
-                if m:
-                    c = int(m.group(2))
-                    max_c = max([p.sensor_location for p in rows if re.match(r'^r(\d+)_c(\d+)$', p.sensor_location)] or [loc])
-                # compute cols by inspecting numeric cells
-                coord_re = re.compile(r'^r(\d+)_c(\d+)$')
-                numeric_cells = [p for p in rows if coord_re.match(p.sensor_location)]
-                if numeric_cells:
-                    maxC = max([int(coord_re.match(p.sensor_location).group(2)) for p in numeric_cells])
-                    mm = coord_re.match(loc)
-                    if mm:
-                        col = int(mm.group(2))
-                        if col < (maxC / 2.0):
-                            action = 'roll_right'
-                            message = f"Suggest roll to the right — persistent high pressure at {loc}"
-                        elif col > (maxC / 2.0):
-                            action = 'roll_left'
-                            message = f"Suggest roll to the left — persistent high pressure at {loc}"
-                        else:
-                            action = 'adjust_position'
-                            message = f"Suggest adjust position — persistent high pressure at {loc}"
-                    else:
-                        action = 'adjust_position'
-                        message = f"Suggest adjust position — persistent high pressure at {loc}"
-                else:
-                    action = 'adjust_position'
-                    message = f"Suggest adjust position — persistent high pressure at {loc}"
-                reposition = {'action': action, 'reason': message, 'location': loc, 'confidence': round(min(0.95, 0.5 + (count-1)*0.2), 2)}
-    except Exception:
-        reposition = None
-
-    return JsonResponse({'cells': cells, 'timestamp': latest.isoformat(), 'reposition': reposition})
+    # Served from the live cache; ingest invalidates it (see patients.cache).
+    # ?format=binary (or Accept) selects the packed encoding of patients.wire
+    return live_cache.respond(request, live_cache.get('grid', request.user, negotiate(request)))
 
 
 @login_required
 def live_graph_json(request):
-    # Return recent time-series pressure values for charting (JSON)
+    # Return recent time-series pressure values for charting (JSON), oldest first
     if request.user.role != 'patient':
         return JsonResponse({'error': 'forbidden'}, status=403)
-    # get last 100 entries ordered oldest->newest
-    qs = PressureData.objects.filter(patient=request.user).order_by('-timestamp')[:100]
-    data = list(reversed([{'timestamp': p.timestamp.isoformat(), 'value': p.pressure_value} for p in qs]))
-    return JsonResponse({'data': data})
+    return live_cache.respond(request, live_cache.get('series', request.user, negotiate(request)))
+
+
+@login_required
+async def live_stream(request):
+    # Server-Sent Events: push each new grid/series payload for the current patient
+    user = await request.auser()
+    if user.role != 'patient':
+        return JsonResponse({'error': 'forbidden'}, status=403)
+    return stream_response(request, user)
+
+
+@csrf_exempt
+@require_POST
+def ingest_frames(request):
+    # Binary frame records from a bedside device, acknowledged one by one (see patients.devices)
+    device = devices.authenticate(request)
+    if device is None:
+        return JsonResponse({'error': 'invalid device token'}, status=401)
+    if int(request.META.get('CONTENT_LENGTH') or 0) > settings.DEVICE_MAX_REQUEST_BYTES:
+        return JsonResponse({'error': 'request too large'}, status=413)
+    try:
+        records = decode_frames(request.read())
+    except ValueError as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+    acks = devices.store(records, devices.allowed_patients(device))
+    counts = {status: sum(ack['status'] == status for ack in acks) for status in ('stored', 'duplicate', 'rejected')}
+    return JsonResponse({**counts, 'frames': acks})
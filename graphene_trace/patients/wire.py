@@ -0,0 +1,126 @@
+"""
+Compact binary encoding of the live grid and series payloads.
+
+A payload is a little-endian uint32 header length, a UTF-8 JSON header, zero
+padding to an 8-byte boundary, then the arrays the header describes:
+
+- grid: rows * cols float32 values, row-major, NaN where a cell has no
+  reading. The header holds rows, cols, timestamp and reposition. Named-sensor
+  readings have no grid position and stay in the header as 'cells'.
+- series: count float64 epoch milliseconds, then count float32 values.
+
+Frames are stored in the grid layout already (see patients.frames), so a grid
+is sent without unpacking it. static/js/live_stream.js decodes payloads into
+typed arrays.
+
+Devices send frames the other way as frame records (patients.devices): a
+FRAME_HEADER (patient id, epoch milliseconds, rows, cols, cell type, scale)
+followed by rows * cols cells, either float32 (NaN = no reading) or uint16
+holding value / scale (0xFFFF = no reading). An ingest request body is any
+number of records back to back.
+"""
+import json
+import struct
+
+import numpy as np
+
+from .frames import DTYPE
+
+CONTENT_TYPE = 'application/vnd.graphene.columnar'
+FORMATS = ('json', 'binary')
+ALIGN = 8
+EPOCH_MS = np.dtype('<f8')
+
+FRAME_CONTENT_TYPE = 'application/vnd.graphene.frames'
+FRAME_HEADER = struct.Struct('<IqHHBxxxf')
+FLOAT32, UINT16 = 0, 1
+CELL_DTYPES = {FLOAT32: DTYPE, UINT16: np.dtype('<u2')}
+UINT16_MISSING = 0xFFFF
+
+
+def negotiate(request):
+    """Return 'binary' for ?format=binary or an Accept naming CONTENT_TYPE, else 'json'."""
+    wanted = request.GET.get('format')
+    if wanted in FORMATS:
+        return wanted
+    return 'binary' if CONTENT_TYPE in request.headers.get('Accept', '') else 'json'
+
+
+def _envelope(header, *buffers):
+    head = json.dumps(header, separators=(',', ':')).encode()
+    padding = -(4 + len(head)) % ALIGN
+    return b''.join((struct.pack('<I', len(head) + padding), head, b' ' * padding, *buffers))
+
+
+def encode_grid(timestamp, frame, cells=(), reposition=None):
+    """Encode a frame's packed buffer, or named-sensor cells when frame is None."""
+    if timestamp is None:
+        return _envelope({'rows': 0, 'cols': 0, 'cells': []})
+    header = {'timestamp': timestamp.isoformat(), 'reposition': reposition}
+    if frame is None:
+        header.update(rows=0, cols=0, cells=list(cells))
+        return _envelope(header)
+    header.update(rows=frame.rows, cols=frame.cols)
+    return _envelope(header, bytes(frame.data))
+
+
+def encode_series(points):
+    """Encode (timestamp, value) pairs as parallel epoch-ms and value arrays."""
+    times = np.fromiter((ts.timestamp() * 1000 for ts, _ in points), dtype=EPOCH_MS, count=len(points))
+    values = np.fromiter((value for _, value in points), dtype=DTYPE, count=len(points))
+    return _envelope({'count': len(points)}, times.tobytes(), values.tobytes())
+
+
+def decode(content):
+    """Return (header, buffer) for a payload; the inverse of the encoders, for tests and tools."""
+    (length,) = struct.unpack_from('<I', content)
+    header = json.loads(content[4:4 + length])
+    return header, memoryview(content)[4 + length:]
+
+
+def encode_cells(grid, cell_type=FLOAT32, scale=1.0):
+    """Return a frame record's cell bytes; uint16 cells are rounded to multiples of `scale`."""
+    grid = np.asarray(grid, dtype=DTYPE)
+    if cell_type != UINT16:
+        return grid.tobytes()
+    missing = np.isnan(grid)
+    steps = np.clip(np.rint(np.where(missing, 0, grid) / scale), 0, UINT16_MISSING - 1)
+    return np.where(missing, UINT16_MISSING, steps).astype(CELL_DTYPES[UINT16]).tobytes()
+
+
+def encode_frame(patient_id, epoch_ms, grid, cell_type=FLOAT32, scale=1.0):
+    """Encode one frame record."""
+    rows, cols = np.shape(grid)
+    return FRAME_HEADER.pack(patient_id, epoch_ms, rows, cols, cell_type, scale) + encode_cells(grid, cell_type, scale)
+
+
+def decode_frames(body):
+    """
+    Split back-to-back frame records into (patient id, epoch ms, grid) tuples.
+
+    Cells are converted to a float32 grid with array operations. Raises
+    ValueError on a truncated record or an unknown cell type.
+    """
+    body = memoryview(body)
+    records = []
+    offset = 0
+    while offset < len(body):
+        if len(body) - offset < FRAME_HEADER.size:
+            raise ValueError(f'frame {len(records)}: truncated header')
+        patient_id, epoch_ms, rows, cols, cell_type, scale = FRAME_HEADER.unpack_from(body, offset)
+        dtype = CELL_DTYPES.get(cell_type)
+        if dtype is None:
+            raise ValueError(f'frame {len(records)}: unknown cell type {cell_type}')
+        offset += FRAME_HEADER.size
+        end = offset + rows * cols * dtype.itemsize
+        if end > len(body):
+            raise ValueError(f'frame {len(records)}: truncated cells')
+        cells = np.frombuffer(body[offset:end], dtype=dtype)
+        if cell_type == UINT16:
+            grid = cells.astype(DTYPE) * DTYPE.type(scale)
+            grid[cells == UINT16_MISSING] = np.nan
+        else:
+            grid = cells
+        records.append((patient_id, epoch_ms, grid.reshape(rows, cols)))
+        offset = end
+    return records
@@ -0,0 +1,83 @@
+// Shared live-update channel: one EventSource per page (window.LIVE_STREAM_URL)
+// carrying 'grid' and 'series' events, with 2s polling as a fallback when
+// EventSource is unavailable or the server can't stream (e.g. under WSGI).
+// Polls ask for the binary format of patients/wire.py and decode it into
+// typed arrays: grids as {rows, cols, values: Float32Array (row-major, NaN =
+// no reading)}, series as {times: Float64Array (epoch ms), values: Float32Array}.
+(function(){
+  var POLL_MS = 2000;
+  var BINARY_TYPE = 'application/vnd.graphene.columnar';
+  var subscribers = {};   // kind -> [{pollUrl, onData}]
+  var last = {};          // kind -> latest payload, replayed to late subscribers
+  var source = null, polling = false;
+
+  function deliver(kind, data){
+    last[kind] = data;
+    (subscribers[kind] || []).forEach(function(s){ s.onData(data); });
+  }
+
+  function decode(buffer){
+    var headerLen = new DataView(buffer).getUint32(0, true);
+    var data = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 4, headerLen)));
+    var offset = 4 + headerLen;
+    if(data.count !== undefined){
+      data.times = new Float64Array(buffer, offset, data.count);
+      data.values = new Float32Array(buffer, offset + 8 * data.count, data.count);
+    } else if(data.rows && data.cols){
+      data.values = new Float32Array(buffer, offset, data.rows * data.cols);
+    }
+    return data;
+  }
+
+  function poll(sub){
+    fetch(sub.pollUrl, { credentials: 'same-origin', cache: 'no-cache', headers: { 'Accept': BINARY_TYPE + ', application/json;q=0.9' } })
+      .then(function(r){
+        if(!r.ok) throw new Error('Network error');
+        if((r.headers.get('Content-Type') || '').indexOf(BINARY_TYPE) === 0) return r.arrayBuffer().then(decode);
+        return r.json();
+      })
+      .then(function(data){ sub.onData(data); })
+      .catch(function(e){ console.warn('live poll failed', e); });
+  }
+
+  function startPolling(sub){
+    poll(sub);
+    setInterval(function(){ poll(sub); }, POLL_MS);
+  }
+
+  function fallBackToPolling(){
+    if(polling) return;
+    polling = true;
+    if(source){ source.close(); source = null; }
+    Object.keys(subscribers).forEach(function(kind){ subscribers[kind].forEach(startPolling); });
+  }
+
+  function listen(kind){
+    source.addEventListener(kind, function(e){
+      try { deliver(kind, JSON.parse(e.data)); } catch(err){ console.warn('bad live event', err); }
+    });
+  }
+
+  function openStream(){
+    if(!window.EventSource || !window.LIVE_STREAM_URL) return false;
+    source = new EventSource(window.LIVE_STREAM_URL, { withCredentials: true });
+    source.onerror = function(){
+      // EventSource retries dropped connections itself; CLOSED means the server refused to stream
+      if(source && source.readyState === EventSource.CLOSED) fallBackToPolling();
+    };
+    return true;
+  }
+
+  window.GrapheneLive = {
+    decode: decode,
+    subscribe: function(kind, pollUrl, onData){
+      var sub = { pollUrl: pollUrl, onData: onData };
+      var isNewKind = !subscribers[kind];
+      (subscribers[kind] = subscribers[kind] || []).push(sub);
+      if(polling){ startPolling(sub); return; }
+      if(!source && !openStream()){ fallBackToPolling(); return; }
+      if(isNewKind) listen(kind);
+      if(last[kind]) onData(last[kind]);
+    }
+  };
+})();
@@ -26,29 +26,27 @@
     });
   }
 
-  function updateChart(data){
+  function updateChart(j){
     if(!chart) initChart();
-    var labels = data.map(function(d){ return new Date(d.timestamp).toLocaleTimeString(); });
-    var values = data.map(function(d){ return d.value; });
+    var labels, values;
+    if(j.times){
+      // Binary format: parallel epoch-ms / value typed arrays
+      labels = Array.prototype.map.call(j.times, function(t){ return new Date(t).toLocaleTimeString(); });
+      values = Array.from(j.values);
+    } else {
+      labels = j.data.map(function(d){ return new Date(d.timestamp).toLocaleTimeString(); });
+      values = j.data.map(function(d){ return d.value; });
+    }
     chart.data.labels = labels;
     chart.data.datasets[0].data = values;
     chart.update();
   }
 
-  function fetchAndUpdate(){
-    if(!window.LIVE_GRAPH_URL) return;
-    fetch(window.LIVE_GRAPH_URL, { credentials: 'same-origin' })
-      .then(function(r){ if(!r.ok) throw new Error('Network'); return r.json(); })
-      .then(function(j){ if(j.data) updateChart(j.data); })
-      .catch(function(e){ console.warn('graph fetch failed', e); });
-  }
-
   window.addEventListener('load', function(){
     // lazy init chart element exists
-    if(document.getElementById('pressureChart')){
+    if(document.getElementById('pressureChart') && window.LIVE_GRAPH_URL){
       initChart();
-      fetchAndUpdate();
-      setInterval(fetchAndUpdate, 2000);
+      window.GrapheneLive.subscribe('series', window.LIVE_GRAPH_URL, function(j){ if(j.data || j.times) updateChart(j); });
     }
   });
 })();
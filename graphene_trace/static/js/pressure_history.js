@@ -0,0 +1,117 @@
+// Pressure history chart with zoom and pan. Every change of range refetches a
+// downsampled series from window.HISTORY_URL, so any span (an hour, a night,
+// a week) is drawn from at most MAX_POINTS buckets. Each bucket carries its
+// min/max/mean; the max line keeps short pressure peaks visible.
+(function(){
+  var MAX_POINTS = 500;
+  var HIGH_PRESSURE = 100;
+  var chart, start, end, sensor = '', pending = 0;
+
+  function fmt(ms, span){
+    var d = new Date(ms);
+    return span > 2 * 86400000 ? d.toLocaleString([], { month: 'short', day: 'numeric', hour: '2-digit', minute: '2-digit' })
+                               : d.toLocaleTimeString();
+  }
+
+  function initChart(){
+    var ctx = document.getElementById('pressureChart').getContext('2d');
+    chart = new Chart(ctx, {
+      type: 'line',
+      data: {
+        labels: [],
+        datasets: [
+          { label: 'Peak (mmHg)', data: [], borderColor: '#ef4444', borderWidth: 1, pointRadius: 0 },
+          { label: 'Mean (mmHg)', data: [], borderColor: 'rgba(75, 192, 192, 1)', borderWidth: 1, pointRadius: 0 },
+          { label: 'Min (mmHg)', data: [], borderColor: 'rgba(148, 163, 184, 0.8)', borderWidth: 1, pointRadius: 0,
+            fill: 0, backgroundColor: 'rgba(239, 68, 68, 0.08)' }
+        ]
+      },
+      options: {
+        animation: false,
+        responsive: true,
+        interaction: { mode: 'index', intersect: false },
+        scales: { y: { beginAtZero: true } },
+        onClick: function(evt, elements){
+          // Zoom in around the clicked bucket
+          if(!elements.length) return;
+          var t = chart.data.times[elements[0].index];
+          zoom(0.25, t);
+        }
+      }
+    });
+  }
+
+  function render(j){
+    var span = end - start;
+    chart.data.times = j.t;
+    chart.data.labels = j.t.map(function(t){ return fmt(t, span); });
+    chart.data.datasets[0].data = j.max;
+    chart.data.datasets[0].pointBackgroundColor = j.max.map(function(v){ return v > HIGH_PRESSURE ? '#b91c1c' : '#ef4444'; });
+    chart.data.datasets[0].pointRadius = j.max.map(function(v){ return v > HIGH_PRESSURE ? 3 : 0; });
+    chart.data.datasets[1].data = j.mean;
+    chart.data.datasets[2].data = j.min;
+    chart.update();
+    var info = document.getElementById('historyInfo');
+    if(info){
+      info.textContent = new Date(start).toLocaleString() + ' – ' + new Date(end).toLocaleString() + ': ' +
+        j.total + ' readings' + (j.bucket_seconds ? ' in ' + j.t.length + ' buckets of ' + j.bucket_seconds + 's' : '');
+    }
+  }
+
+  function load(){
+    var params = new URLSearchParams({ max_points: MAX_POINTS });
+    if(start !== undefined){ params.set('start', Math.round(start)); params.set('end', Math.round(end)); }
+    if(sensor) params.set('sensor_location', sensor);
+    var seq = ++pending;
+    fetch(window.HISTORY_URL + '?' + params.toString(), { credentials: 'same-origin' })
+      .then(function(r){ return r.json().then(function(j){ if(!r.ok) throw new Error(j.error || 'Network error'); return j; }); })
+      .then(function(j){
+        if(seq !== pending) return;  // a newer range was requested meanwhile
+        start = Date.parse(j.start); end = Date.parse(j.end);
+        render(j);
+      })
+      .catch(function(e){ console.warn('history fetch failed', e); });
+  }
+
+  function zoom(factor, center){
+    if(end === undefined) return;  // first range not loaded yet
+    var span = end - start;
+    if(center === undefined) center = start + span / 2;
+    var next = Math.max(span * factor, 1000);
+    start = center - next / 2; end = center + next / 2;
+    load();
+  }
+
+  function pan(fraction){
+    if(end === undefined) return;
+    var shift = (end - start) * fraction;
+    start += shift; end += shift;
+    load();
+  }
+
+  function setSpan(ms){
+    if(end === undefined) return;
+    start = end - ms;
+    load();
+  }
+
+  window.addEventListener('load', function(){
+    if(!document.getElementById('pressureChart') || !window.HISTORY_URL) return;
+    initChart();
+    var bind = function(id, fn){ var el = document.getElementById(id); if(el) el.addEventListener('click', fn); };
+    bind('historyZoomIn', function(){ zoom(0.5); });
+    bind('historyZoomOut', function(){ zoom(2); });
+    bind('historyPanLeft', function(){ pan(-0.5); });
+    bind('historyPanRight', function(){ pan(0.5); });
+    document.querySelectorAll('[data-history-span]').forEach(function(el){
+      el.addEventListener('click', function(){ setSpan(Number(el.getAttribute('data-history-span')) * 1000); });
+    });
+    var form = document.getElementById('historyLocation');
+    if(form) form.addEventListener('submit', function(e){
+      e.preventDefault();
+      sensor = form.elements.sensor_location.value.trim();
+      load();
+    });
+    load();
+  });
+})();
@@ -21,6 +21,20 @@
     heatmapInstance._renderer.setDimensions(container.offsetWidth, container.offsetHeight);
   }
 
+  function valuesToPoints(rows, cols, values){
+    // values: row-major Float32Array from the binary format, NaN = no reading
+    var container = document.getElementById('heatmapContainer');
+    var cellW = container.offsetWidth/cols, cellH = container.offsetHeight/rows;
+    var points = [];
+    for(var i=0; i<values.length; i++){
+      var v = values[i];
+      if(v !== v) continue;
+      var r = Math.floor(i/cols), c = i - r*cols;
+      points.push({ x: Math.floor((c + 0.5) * cellW), y: Math.floor((r + 0.5) * cellH), value: v, r: r, c: c });
+    }
+    return points;
+  }
+
   function gridToPoints(cells){
     // cells: [{r,c,value},...]
     if(cells.length===0) return [];
@@ -42,7 +56,7 @@
 
   function updateHeatmap(data){
     if(!heatmapInstance) initHeatmap();
-    var points = gridToPoints(data.cells || []);
+    var points = data.values ? valuesToPoints(data.rows, data.cols, data.values) : gridToPoints(data.cells || []);
     var maxVal = points.reduce(function(m,p){ return Math.max(m,p.value); }, 0);
     heatmapInstance.setData({ max: Math.max(100, Math.ceil(maxVal)), min: 0, data: points });
     var last = document.getElementById('last-update');
@@ -59,6 +73,9 @@
           sug.className = 'alert';
         }
       }
+    } else {
+      var cleared = document.getElementById('reposition-suggestion');
+      if(cleared){ cleared.textContent = ''; cleared.className = ''; }
     }
 
     // update recent list
@@ -83,17 +100,10 @@
     }
   }
 
-  function fetchAndUpdate(){
-    fetch(window.LIVE_GRID_URL, { credentials: 'same-origin' })
-      .then(function(r){ if(!r.ok) throw new Error('Network error'); return r.json(); })
-      .then(function(data){ updateHeatmap(data); })
-      .catch(function(e){ console.warn('heatmap fetch failed', e); });
-  }
-
   window.addEventListener('load', function(){
     initHeatmap();
-    fetchAndUpdate();
-    setInterval(fetchAndUpdate, 2000);
+    // Pushed over Server-Sent Events, or polled if streaming is unavailable
+    window.GrapheneLive.subscribe('grid', window.LIVE_GRID_URL, updateHeatmap);
     window.addEventListener('resize', function(){ setTimeout(resizeHeatmap,120); });
   });
 })();
@@ -1,5 +1,8 @@
+import re
+
 from django import forms
 from django.contrib.auth.forms import UserCreationForm
+from patients.models import ProfileRule
 from .models import User
 
 class CustomUserCreationForm(UserCreationForm):
@@ -12,4 +15,24 @@ class CustomUserCreationForm(UserCreationForm):
 class CSVUploadForm(forms.Form):
     patient = forms.ModelChoiceField(queryset=User.objects.filter(role='patient'), label='Select Patient')
     csv_file = forms.FileField(label='Select CSV file')
-    date = forms.DateField(label='Date for the data', widget=forms.DateInput(attrs={'type': 'date'}))
\ No newline at end of file
+    date = forms.DateField(label='Date for the data', widget=forms.DateInput(attrs={'type': 'date'}))
+
+class ProfileRuleForm(forms.ModelForm):
+    class Meta:
+        model = ProfileRule
+        fields = ('pattern', 'user', 'remaining')
+        labels = {'pattern': 'URL name or path regex', 'user': 'Only for user', 'remaining': 'Requests to profile'}
+
+    def clean_pattern(self):
+        pattern = self.cleaned_data['pattern'].strip()
+        try:
+            re.compile(pattern)
+        except re.error as e:
+            raise forms.ValidationError(f'Not a valid regular expression: {e}')
+        return pattern
+
+    def clean(self):
+        cleaned = super().clean()
+        if not cleaned.get('pattern') and not cleaned.get('user'):
+            raise forms.ValidationError('Give a URL pattern, a user, or both.')
+        return cleaned
@@ -0,0 +1,131 @@
+import csv
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime, time as dtime
+
+import django
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+from patients import batches
+from patients.importer import CHUNK_BYTES, DuplicateUpload, ImportFormatError, open_batch, parse_file, write_parsed
+
+User = get_user_model()
+
+MANIFEST_COLUMNS = ('file', 'username', 'date')
+
+
+def read_manifest(path, directory):
+    """Return [(file path, username, date)] from a manifest CSV with file, username and date columns."""
+    try:
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            reader = csv.DictReader(f)
+            missing = set(MANIFEST_COLUMNS) - set(reader.fieldnames or [])
+            if missing:
+                raise CommandError(f"Manifest needs columns {', '.join(MANIFEST_COLUMNS)} (missing {', '.join(sorted(missing))})")
+            rows = list(reader)
+    except OSError as e:
+        raise CommandError(f'Cannot read manifest: {e}')
+
+    entries, problems = [], []
+    for line, row in enumerate(rows, start=2):
+        file_path = os.path.join(directory, row['file'].strip())
+        try:
+            date = datetime.strptime(row['date'].strip(), '%Y-%m-%d').date()
+        except ValueError:
+            problems.append(f"line {line}: invalid date '{row['date']}', use YYYY-MM-DD")
+            continue
+        if not os.path.isfile(file_path):
+            problems.append(f'line {line}: {file_path} not found')
+            continue
+        entries.append((file_path, row['username'].strip(), date))
+    if problems:
+        raise CommandError('Manifest errors:\n  ' + '\n  '.join(problems))
+    return entries
+
+
+class Command(BaseCommand):
+    help = 'Import a directory of CSV files listed in a manifest (file, username, date), parsing them in parallel'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='Directory holding the CSV files')
+        parser.add_argument('--manifest', default=None, help='Manifest CSV (default: DIRECTORY/manifest.csv)')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Parser processes')
+        parser.add_argument('--chunk-bytes', type=int, default=CHUNK_BYTES, help='Bytes read and parsed per chunk')
+
+    def handle(self, *args, **options):
+        directory = options['directory']
+        entries = read_manifest(options['manifest'] or os.path.join(directory, 'manifest.csv'), directory)
+        patients = User.objects.in_bulk({username for _, username, _ in entries}, field_name='username')
+        unknown = sorted({username for _, username, _ in entries if getattr(patients.get(username), 'role', None) != 'patient'})
+        if unknown:
+            raise CommandError(f"Patient users not found: {', '.join(unknown)}")
+
+        workers = max(1, options['workers'])
+        totals = {'imported': 0, 'skipped': 0, 'failed': 0, 'rows': 0, 'values': 0, 'bytes': 0}
+        parse_seconds = write_seconds = 0.0
+        began = time.perf_counter()
+        # Workers only parse; forked children must not share the parent's connections
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as pool:
+            queue = list(reversed(entries))
+            running = {}
+            while queue or running:
+                # Keep a couple of files per worker in flight so parsed files don't pile up in memory
+                while queue and len(running) < 2 * workers:
+                    path, username, date = queue.pop()
+                    timestamp = datetime.combine(date, dtime.min).replace(tzinfo=timezone.get_current_timezone())
+                    future = pool.submit(parse_file, path, timestamp, options['chunk_bytes'])
+                    running[future] = (path, patients[username], timestamp)
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path, patient, timestamp = running.pop(future)
+                    name = os.path.basename(path)
+                    try:
+                        parsed = future.result()
+                    except ImportFormatError as e:
+                        totals['failed'] += 1
+                        self.stdout.write(self.style.WARNING(f'{name}: {e}'))
+                        continue
+                    except Exception as e:
+                        # Undecodable text, unreadable file, a crashed worker...: the other files go on
+                        totals['failed'] += 1
+                        self.stdout.write(self.style.WARNING(f'{name}: could not parse ({type(e).__name__}: {e})'))
+                        continue
+                    # The single writer: every database write happens here, one file at a time
+                    started = time.perf_counter()
+                    try:
+                        batch = open_batch(patient, timestamp, parsed.file_hash, name)
+                    except DuplicateUpload as e:
+                        totals['skipped'] += 1
+                        self.stdout.write(f'{name}: {e}')
+                        continue
+                    try:
+                        stats = write_parsed(parsed, patient, batch)
+                    except Exception as e:
+                        # Chunks written before the failure are committed: take the partial batch back out
+                        batches.undo(batch)
+                        totals['failed'] += 1
+                        self.stdout.write(self.style.WARNING(f'{name}: import failed and was undone ({type(e).__name__}: {e})'))
+                        continue
+                    write_seconds += time.perf_counter() - started
+                    parse_seconds += stats.seconds
+                    totals['imported'] += 1
+                    totals['rows'] += stats.rows
+                    totals['values'] += stats.readings + stats.cells
+                    totals['bytes'] += os.path.getsize(path)
+                    self.stdout.write(
+                        f'{name}: batch {batch.pk} for {patient.username}, {stats.readings} PressureData rows, '
+                        f'{stats.frames} PressureFrames ({stats.cells} cells), {stats.skipped} skipped'
+                    )
+
+        elapsed = time.perf_counter() - began
+        self.stdout.write(self.style.SUCCESS(
+            f"{totals['imported']} files imported, {totals['skipped']} already imported, {totals['failed']} failed "
+            f"in {elapsed:.2f}s with {workers} workers: {totals['rows']:,} rows, {totals['values']:,} values, "
+            f"{totals['bytes'] / 2**20:.1f} MiB = {totals['values'] / elapsed if elapsed else 0:,.0f} values/s, "
+            f"{totals['bytes'] / 2**20 / elapsed if elapsed else 0:.1f} MiB/s "
+            f"(parse {parse_seconds:.2f}s summed over workers, write {write_seconds:.2f}s)"
+        ))
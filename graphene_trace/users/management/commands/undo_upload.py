@@ -1,19 +1,40 @@
+import re
+import time
+
 from django.core.management.base import BaseCommand, CommandError
 from django.contrib.auth import get_user_model
-from patients.models import PressureData
+from patients.batches import CHUNK_SIZE, delete_in_chunks, undo
+from patients.models import PressureData, PressureFrame, UploadBatch
+from patients import cache as live_cache
+from patients import reposition, rollups
 
 User = get_user_model()
 
+# Prefixes that select only some cells of the mat ('r3', 'r3_c'); grid cells
+# are packed into PressureFrames, which are deleted whole
+PARTIAL_GRID_PREFIX = re.compile(r'^r\d+(_(c\d*)?)?$')
+
 
 class Command(BaseCommand):
-    help = 'Undo uploads by deleting PressureData matching a sensor prefix for a user and optional date'
+    help = (
+        'Undo an upload batch, or delete readings matching a sensor prefix for a user and optional date '
+        '(mat frames are deleted when the prefix is empty or "r")'
+    )
 
     def add_arguments(self, parser):
-        parser.add_argument('--username', required=True, help='Patient username')
+        parser.add_argument('--batch', type=int, required=False, help='UploadBatch id to undo (shown after each upload)', default=None)
+        parser.add_argument('--username', required=False, help='Patient username (required without --batch)')
         parser.add_argument('--prefix', required=False, help="Sensor_location prefix to match (e.g., 'r')", default=None)
         parser.add_argument('--date', required=False, help='Date (YYYY-MM-DD) to filter timestamp', default=None)
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Rows deleted per transaction')
+        parser.add_argument('--pause', type=float, default=0.05, help='Seconds to sleep between chunks')
 
     def handle(self, *args, **options):
+        if options['batch'] is not None:
+            return self.undo_batch(options['batch'], options['chunk_size'], options['pause'])
+        if not options['username']:
+            raise CommandError('Give --batch, or --username with an optional --prefix/--date')
+
         username = options['username']
         prefix = options['prefix']
         date_str = options['date']
@@ -23,11 +44,19 @@ class Command(BaseCommand):
         except User.DoesNotExist:
             raise CommandError(f"Patient user '{username}' not found")
 
+        if prefix and PARTIAL_GRID_PREFIX.match(prefix):
+            raise CommandError(
+                f"'{prefix}' matches only some mat cells, which are stored as whole frames; "
+                "use --prefix r to delete the frames, or --batch"
+            )
         qs = PressureData.objects.filter(patient=patient)
+        frames = PressureFrame.objects.filter(patient=patient)
         if prefix:
             qs = qs.filter(sensor_location__startswith=prefix)
+            if prefix != 'r':
+                frames = frames.none()
         if date_str:
-            from datetime import datetime, timezone as _tz
+            from datetime import datetime
             try:
                 d = datetime.strptime(date_str, '%Y-%m-%d').date()
             except ValueError:
@@ -36,29 +65,31 @@ class Command(BaseCommand):
             start = timezone.datetime.combine(d, timezone.datetime.min.time()).replace(tzinfo=timezone.get_current_timezone())
             end = timezone.datetime.combine(d, timezone.datetime.max.time()).replace(tzinfo=timezone.get_current_timezone())
             qs = qs.filter(timestamp__range=(start, end))
+            frames = frames.filter(timestamp__range=(start, end))
+        else:
+            start = end = None
 
-        count = qs.count()
-        if count == 0:
+        count = delete_in_chunks(qs, options['chunk_size'], options['pause'])
+        frame_count = delete_in_chunks(frames, options['chunk_size'], options['pause'])
+        if count == 0 and frame_count == 0:
             self.stdout.write(self.style.WARNING('No matching rows found'))
             return
+        rollups.rebuild(patient, start, end)
+        if frame_count:
+            reposition.rebuild(patient)
+        live_cache.invalidate(patient.id)
+        self.stdout.write(self.style.SUCCESS(f'Deleted {count} PressureData rows and {frame_count} PressureFrames for {username}'))
 
-        # For very large deletes, perform raw SQL to avoid instantiating large querysets
-        if count > 100000:
-            from django.db import connection
-            sql = 'DELETE FROM patients_pressuredata WHERE patient_id = %s'
-            params = [patient.id]
-            if prefix:
-                sql += ' AND sensor_location LIKE %s'
-                params.append(prefix + '%')
-            if date_str:
-                from django.utils import timezone
-                start = timezone.datetime.combine(d, timezone.datetime.min.time()).replace(tzinfo=timezone.get_current_timezone())
-                end = timezone.datetime.combine(d, timezone.datetime.max.time()).replace(tzinfo=timezone.get_current_timezone())
-                sql += ' AND timestamp BETWEEN %s AND %s'
-                params.extend([start, end])
-            with connection.cursor() as cur:
-                cur.execute(sql, params)
-            self.stdout.write(self.style.SUCCESS(f'Deleted {count} PressureData rows for {username} (raw SQL)'))
-        else:
-            qs.delete()
-            self.stdout.write(self.style.SUCCESS(f'Deleted {count} PressureData rows for {username}'))
+    def undo_batch(self, batch_id, chunk_size, pause):
+        try:
+            batch = UploadBatch.objects.select_related('patient').get(pk=batch_id)
+        except UploadBatch.DoesNotExist:
+            raise CommandError(f'Upload batch {batch_id} not found')
+
+        began = time.perf_counter()
+        readings, frames = undo(batch, chunk_size, pause)
+        elapsed = time.perf_counter() - began
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted batch {batch_id}: {readings} PressureData rows and {frames} PressureFrames '
+            f'for {batch.patient.username} in {elapsed:.1f}s'
+        ))
@@ -0,0 +1,67 @@
+"""
+Authentication with a per-process user cache.
+
+AuthenticationMiddleware loads request.user from the database on every
+request. For a dashboard polling every 2 seconds that SELECT is the only
+database work left once the session comes from the session cache
+(cached_db) and the payload from the live cache. CachedAuthenticationMiddleware keeps users in
+memory for USER_CACHE_TIMEOUT seconds instead.
+
+Entries are keyed by the session's user id, backend and auth hash, so only
+sessions that Django itself verified for that user share an entry. Saving or
+deleting a user drops it here at once. Other processes see role, active-flag
+and password changes within the timeout.
+"""
+import copy
+import threading
+import time
+
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.functional import SimpleLazyObject
+from patients import metrics
+
+_users = {}  # (user id, backend, session hash) -> (expires, user)
+_lock = threading.Lock()  # ASGI and threaded WSGI workers share _users
+
+
+def get_user(request):
+    session = request.session
+    try:
+        key = (session[SESSION_KEY], session[BACKEND_SESSION_KEY], session.get(HASH_SESSION_KEY))
+    except KeyError:
+        return auth.get_user(request)  # anonymous
+    now = time.monotonic()
+    hit = _users.get(key)
+    metrics.count_cache('user', bool(hit and hit[0] > now))
+    if hit and hit[0] > now:
+        # A copy, so a view changing request.user can't leak into other requests
+        return copy.copy(hit[1])
+    user = auth.get_user(request)
+    if user.is_authenticated:
+        with _lock:
+            if len(_users) >= settings.USER_CACHE_MAX:
+                for stale in [k for k, (expires, _) in _users.items() if expires <= now]:
+                    del _users[stale]
+            if len(_users) < settings.USER_CACHE_MAX:
+                _users[key] = (now + settings.USER_CACHE_TIMEOUT, copy.copy(user))
+    return user
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def forget_user(sender, instance, **kwargs):
+    user_id = str(instance.pk)
+    with _lock:
+        for key in [key for key in _users if str(key[0]) == user_id]:
+            del _users[key]
+
+
+class CachedAuthenticationMiddleware(AuthenticationMiddleware):
+    def process_request(self, request):
+        super().process_request(request)
+        request.user = SimpleLazyObject(lambda: get_user(request))
@@ -1,3 +1,305 @@
-from django.test import TestCase
+import os
+import subprocess
+import sys
+import tempfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.backends.cached_db import SessionStore
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from patients import importer, jobs, reposition, rollups
+from patients.models import (
+    FrameLayer, ImportJob, PressureData, PressureFrame, PressureRollupMinute, ReadingLayer, RepositionState, UploadBatch,
+)
+
+User = get_user_model()
+
+
+@override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cache', IMPORT_IN_PROCESS=False)
+class UploadCsvTests(TestCase):
+
+    def setUp(self):
+        spool = tempfile.TemporaryDirectory()
+        self.addCleanup(spool.cleanup)
+        self.enterContext(override_settings(IMPORT_SPOOL_DIR=spool.name))
+        self.admin = User.objects.create_user('admin', password='pw', role='admin')
+        self.patient = User.objects.create_user('pat', password='pw', role='patient')
+        self.client.force_login(self.admin)
+
+    def upload(self, content):
+        csv_file = SimpleUploadedFile('data.csv', content.encode(), content_type='text/csv')
+        return self.client.post(reverse('upload_csv'), {'patient': self.patient.id, 'date': '2024-05-01', 'csv_file': csv_file})
+
+    def test_upload_is_queued_then_imported(self):
+        response = self.upload('sensor_location,pressure_value\nleft_hip,40\nr0_c0,10\n')
+        job = ImportJob.objects.get()
+        self.assertRedirects(response, reverse('import_job', args=[job.id]))
+        self.assertEqual(job.status, ImportJob.QUEUED)
+        self.assertTrue(os.path.exists(job.path))
+        self.assertFalse(PressureData.objects.exists())  # nothing imported inside the request
+
+        self.assertEqual(jobs.run_next().status, ImportJob.DONE)
+        self.assertFalse(os.path.exists(job.path))
+        progress = self.client.get(reverse('import_job_json', args=[job.id])).json()
+        self.assertEqual((progress['status'], progress['rows'], progress['readings'], progress['frames']), ('done', 2, 1, 1))
+        self.assertEqual(progress['percent'], 100.0)
+        self.assertEqual(PressureFrame.objects.get().patient, self.patient)
+        self.assertContains(self.client.get(reverse('import_job', args=[job.id])), 'data.csv')
+
+    def test_bad_file_fails_the_job(self):
+        self.upload('name,value\nleft_hip,4\n')
+        call_command('run_import_worker', '--once', stdout=StringIO())
+        job = ImportJob.objects.get()
+        self.assertEqual(job.status, ImportJob.FAILED)
+        self.assertIn('numeric matrix', job.error)
+        self.assertIsNone(jobs.run_next())
+
+    def test_failed_job_undoes_its_partial_import(self):
+        self.upload('sensor_location,pressure_value\nleft_hip,40\nr0_c0,10\n')
+
+        def fail_midway(f, patient, timestamp, progress=None, batch=None):
+            PressureData.objects.create(patient=patient, timestamp=timestamp, sensor_location='left_hip', pressure_value=40, batch=batch)
+            raise RuntimeError('disk full')
+
+        with mock.patch('patients.jobs.import_csv', side_effect=fail_midway):
+            job = jobs.run_next()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.batch), (ImportJob.FAILED, None))
+        self.assertEqual(job.error, 'Error processing CSV: disk full; the partial import was undone')
+        self.assertFalse(PressureData.objects.exists())
+        self.assertFalse(UploadBatch.objects.exists())
+
+    def test_job_of_a_dead_worker_is_requeued(self):
+        self.upload('sensor_location,pressure_value\nleft_hip,40\nr0_c0,10\n')
+        job = jobs.claim()
+        # The worker committed part of the file, then died
+        with open(job.path, 'rb') as f:
+            batch = importer.start_batch(f, job.patient, job.timestamp, job.file_name)
+        PressureData.objects.create(patient=self.patient, timestamp=job.timestamp, sensor_location='left_hip', pressure_value=40, batch=batch)
+        ImportJob.objects.filter(pk=job.pk).update(batch=batch)
+
+        self.assertEqual(jobs.requeue_stale(), 0)  # still beating
+        ImportJob.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(seconds=settings.IMPORT_JOB_TIMEOUT + 1))
+        self.assertEqual(jobs.requeue_stale(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.batch), (ImportJob.QUEUED, None))
+        self.assertFalse(UploadBatch.objects.filter(pk=batch.pk).exists())
+
+        call_command('run_import_worker', '--once', stdout=StringIO())
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.DONE)
+        self.assertEqual(PressureData.objects.count(), 1)
+
+    def test_progress_is_admin_only(self):
+        self.upload('1,2\n3,4\n')
+        self.client.force_login(self.patient)
+        response = self.client.get(reverse('import_job_json', args=[ImportJob.objects.get().id]))
+        self.assertEqual(response.status_code, 403)
+
+
+class UndoUploadTests(TestCase):
+
+    def setUp(self):
+        self.patient = User.objects.create_user('pat', password='pw', role='patient')
+        self.timestamp = timezone.now().replace(second=0, microsecond=0)
+
+    def upload(self, text):
+        stream = BytesIO(text.encode())
+        batch = importer.start_batch(stream, self.patient, self.timestamp, 'day.csv')
+        importer.import_csv(stream, self.patient, self.timestamp, batch=batch)
+        batch.refresh_from_db()
+        return batch
+
+    def test_undo_one_of_two_uploads_for_the_same_day(self):
+        first = self.upload('sensor_location,pressure_value\nleft_hip,40\nsacrum,50\nheel,60\nr0_c0,5\n')
+        second = self.upload('sensor_location,pressure_value\nleft_hip,70\n')
+        self.assertEqual((first.row_count, first.frame_count), (3, 1))
+        self.assertEqual(len(first.file_hash), 64)
+
+        out = StringIO()
+        call_command('undo_upload', '--batch', str(first.id), '--chunk-size', '2', '--pause', '0', stdout=out)
+        # left_hip was re-sent by the second upload, which keeps it
+        self.assertIn('2 PressureData rows and 1 PressureFrames', out.getvalue())
+        self.assertEqual(list(PressureData.objects.values_list('batch', 'pressure_value')), [(second.id, 70.0)])
+        self.assertFalse(PressureFrame.objects.exists())
+        self.assertFalse(UploadBatch.objects.filter(pk=first.id).exists())
+        rollup = PressureRollupMinute.objects.get(sensor_location='left_hip')
+        self.assertEqual((rollup.count, rollup.max_value), (1, 70.0))
+
+    def test_undo_either_of_two_overlapping_uploads(self):
+        earlier = 'sensor_location,pressure_value\nr0_c0,10\nr0_c1,20\nleft_hip,40\n'
+        later = 'sensor_location,pressure_value\nr0_c1,25\nr1_c0,30\nleft_hip,45\n'
+        first = self.upload(earlier)
+        second = self.upload(later)
+        self.assertEqual(PressureData.objects.get().pressure_value, 45.0)
+
+        call_command('undo_upload', '--batch', str(second.id), '--pause', '0', stdout=StringIO())
+        frame = PressureFrame.objects.get()
+        np.testing.assert_array_equal(frame.grid, [[10, 20]])
+        self.assertEqual(frame.batch_id, first.id)
+        self.assertEqual(list(PressureData.objects.values_list('batch', 'pressure_value')), [(first.id, 40.0)])
+        self.assertFalse(FrameLayer.objects.exists() or ReadingLayer.objects.exists())
+
+        second = self.upload(later)
+        call_command('undo_upload', '--batch', str(first.id), '--pause', '0', stdout=StringIO())
+        frame = PressureFrame.objects.get()
+        np.testing.assert_array_equal(frame.grid, [[np.nan, 25], [30, np.nan]])
+        self.assertEqual((frame.batch_id, frame.peak_value), (second.id, 30.0))
+        self.assertEqual(list(PressureData.objects.values_list('batch', 'pressure_value')), [(second.id, 45.0)])
+        self.assertEqual(PressureRollupMinute.objects.get(sensor_location='left_hip').max_value, 45.0)
+
+    def test_undo_recomputes_the_reposition_suggestion(self):
+        self.timestamp -= timedelta(minutes=1)
+        self.upload('200,10\n10,10\n')
+        self.timestamp += timedelta(seconds=30)
+        batch = self.upload('200,10\n10,10\n')
+        self.assertIsNotNone(reposition.current_suggestion(self.patient))
+        call_command('undo_upload', '--batch', str(batch.id), '--pause', '0', stdout=StringIO())
+        self.assertIsNone(reposition.current_suggestion(self.patient))
+        self.assertEqual(RepositionState.objects.get(patient=self.patient).persistence_count, 1)
+
+    def test_prefix_undo_deletes_grid_frames(self):
+        self.upload('sensor_location,pressure_value\nright_hip,40\nleft_hip,50\nr0_c0,150\nr0_c1,150\n')
+        self.timestamp += timedelta(seconds=1)
+        self.upload('sensor_location,pressure_value\nr0_c0,150\n')
+        self.assertIsNotNone(reposition.current_suggestion(self.patient))
+        with self.assertRaisesMessage(CommandError, 'some mat cells'):
+            call_command('undo_upload', '--username', 'pat', '--prefix', 'r0_c', stdout=StringIO())
+
+        out = StringIO()
+        call_command('undo_upload', '--username', 'pat', '--prefix', 'r', '--pause', '0', stdout=out)
+        self.assertIn('1 PressureData rows and 2 PressureFrames', out.getvalue())
+        self.assertEqual(list(PressureData.objects.values_list('sensor_location', flat=True)), ['left_hip'])
+        self.assertFalse(PressureFrame.objects.exists())
+        self.assertIsNone(reposition.current_suggestion(self.patient))
+        self.assertFalse(PressureRollupMinute.objects.filter(sensor_location=rollups.MAT_PEAK).exists())
+
+    def test_unknown_batch(self):
+        with self.assertRaises(CommandError):
+            call_command('undo_upload', '--batch', '999', stdout=StringIO())
+
+    def test_reupload_of_the_same_file_is_skipped(self):
+        text = 'sensor_location,pressure_value\nleft_hip,40\n'
+        first = self.upload(text)
+        with self.assertRaises(importer.DuplicateUpload) as raised:
+            self.upload(text)
+        self.assertEqual(raised.exception.batch, first)
+        self.assertEqual((UploadBatch.objects.count(), PressureData.objects.count()), (1, 1))
+
+
+class BulkIngestTests(TestCase):
+
+    def setUp(self):
+        for name in ('pat', 'pat2'):
+            User.objects.create_user(name, password='pw', role='patient')
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        files = {
+            'a.csv': 'sensor_location,pressure_value\nleft_hip,40\nr0_c0,5\n',
+            'b.csv': '1,2\n3,4\n',
+            'bad.csv': 'name,value\nleft_hip,4\n',
+        }
+        for name, text in files.items():
+            with open(os.path.join(self.dir, name), 'w') as f:
+                f.write(text)
+        with open(os.path.join(self.dir, 'manifest.csv'), 'w') as f:
+            f.write('file,username,date\na.csv,pat,2024-05-01\nb.csv,pat2,2024-05-01\nbad.csv,pat,2024-05-02\n')
+
+    def test_directory_is_imported_once(self):
+        out = StringIO()
+        call_command('bulk_ingest', self.dir, '--workers', '2', stdout=out)
+        self.assertIn('2 files imported, 0 already imported, 1 failed', out.getvalue())
+        self.assertEqual(PressureData.objects.get().patient.username, 'pat')
+        self.assertEqual(sorted(PressureFrame.objects.values_list('patient__username', 'cols')), [('pat', 1), ('pat2', 2)])
+        self.assertEqual(UploadBatch.objects.filter(complete=True).count(), 2)
+
+        out = StringIO()
+        call_command('bulk_ingest', self.dir, '--workers', '1', stdout=out)
+        self.assertIn('0 files imported, 2 already imported, 1 failed', out.getvalue())
+        self.assertEqual(PressureFrame.objects.count(), 2)
+
+    def test_failing_files_are_reported_and_the_rest_imported(self):
+        with open(os.path.join(self.dir, 'latin1.csv'), 'wb') as f:
+            f.write('sensor_location,pressure_value\ntalon_gauche_é,40\n'.encode('latin-1'))
+        with open(os.path.join(self.dir, 'manifest.csv'), 'a') as f:
+            f.write('latin1.csv,pat,2024-05-03\n')
+        out = StringIO()
+        call_command('bulk_ingest', self.dir, '--workers', '1', stdout=out)
+        self.assertIn('latin1.csv: could not parse (UnicodeDecodeError', out.getvalue())
+        self.assertIn('2 files imported, 0 already imported, 2 failed', out.getvalue())
+
+    def test_a_failed_write_is_undone(self):
+        with mock.patch.object(importer._Writer, 'flush', side_effect=RuntimeError('disk full')):
+            out = StringIO()
+            call_command('bulk_ingest', self.dir, '--workers', '1', stdout=out)
+        self.assertIn('a.csv: import failed and was undone (RuntimeError: disk full)', out.getvalue())
+        self.assertIn('0 files imported, 0 already imported, 3 failed', out.getvalue())
+        self.assertFalse(PressureData.objects.exists() or UploadBatch.objects.exists())
+
+    def test_manifest_is_checked_before_importing(self):
+        with open(os.path.join(self.dir, 'manifest.csv'), 'a') as f:
+            f.write('a.csv,nobody,2024-05-01\n')
+        with self.assertRaisesMessage(CommandError, 'nobody'):
+            call_command('bulk_ingest', self.dir, stdout=StringIO())
+        self.assertFalse(UploadBatch.objects.exists())
+
+
+class CachedAuthenticationTests(TestCase):
+
+    def setUp(self):
+        self.patient = User.objects.create_user('pat', password='pw', role='patient')
+        self.client.force_login(self.patient)
+
+    def test_polls_need_no_queries_once_warm(self):
+        self.client.get(reverse('live_grid_json'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('live_grid_json'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_saving_the_user_drops_the_cached_copy(self):
+        self.client.get(reverse('live_grid_json'))
+        self.patient.role = 'clinician'
+        self.patient.save()
+        self.assertEqual(self.client.get(reverse('live_grid_json')).status_code, 403)
+
+    def test_password_change_signs_out(self):
+        self.client.get(reverse('live_grid_json'))
+        self.patient.set_password('new')
+        self.patient.save()
+        self.assertEqual(self.client.get(reverse('live_grid_json')).status_code, 302)
+
+    @skipUnless(settings.REDIS_URL, 'sessions are only shared between processes through Redis')
+    def test_logout_reaches_other_processes(self):
+        self.client.get(reverse('live_grid_json'))
+        cache_key = SessionStore(self.client.session.session_key).cache_key
+
+        def cached_elsewhere():
+            script = (
+                'import sys, django; django.setup(); from django.conf import settings; '
+                'from django.core.cache import caches; '
+                'print(caches[settings.SESSION_CACHE_ALIAS].get(sys.argv[1]) is not None)'
+            )
+            return subprocess.run(
+                [sys.executable, '-c', script, cache_key], cwd=settings.BASE_DIR,
+                capture_output=True, text=True, check=True,
+            ).stdout.strip() == 'True'
+
+        self.assertTrue(cached_elsewhere())
+        self.client.logout()
+        self.assertFalse(cached_elsewhere())
+
+    @override_settings(USER_CACHE_TIMEOUT=0)
+    def test_changes_from_other_processes_apply_after_the_timeout(self):
+        self.client.get(reverse('live_grid_json'))
+        User.objects.filter(pk=self.patient.pk).update(is_active=False)  # no post_save, as in another process
+        self.assertEqual(self.client.get(reverse('live_grid_json')).status_code, 302)
@@ -9,4 +9,9 @@ urlpatterns = [
     path('reset_password/<int:user_id>/', views.reset_password, name='reset_password'),
     path('assign_clinician/<int:user_id>/', views.assign_clinician, name='assign_clinician'),
     path('upload_csv/', views.upload_csv, name='upload_csv'),
+    path('upload_csv/jobs/<int:job_id>/', views.import_job, name='import_job'),
+    path('upload_csv/jobs/<int:job_id>/progress/', views.import_job_json, name='import_job_json'),
+    path('metrics/', views.metrics, name='metrics'),
+    path('profiles/', views.profiles, name='profiles'),
+    path('profiles/<str:name>.<str:ext>', views.profile_download, name='profile_download'),
 ]
\ No newline at end of file
@@ -1,13 +1,15 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import login
-from .forms import CustomUserCreationForm, CSVUploadForm
+from .forms import CustomUserCreationForm, CSVUploadForm, ProfileRuleForm
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import get_user_model
-from patients.models import PressureData
-import csv
-from io import TextIOWrapper
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse
+from patients import jobs, metrics as request_metrics, profiling
+from patients.models import ImportJob, ProfileRule
+from datetime import datetime, time
 from django.utils import timezone
+from django.conf import settings
 from django.contrib import messages
 import tempfile
 import os
@@ -98,83 +100,70 @@ def upload_csv(request):
             patient = form.cleaned_data['patient']
             csv_file = request.FILES['csv_file']
             date = form.cleaned_data['date']
-            # Process CSV immediately and show success message
-            try:
-                # Wrap uploaded file stream for csv parsing
-                file_stream = getattr(csv_file, 'file', csv_file)
-                text_wrapper = TextIOWrapper(file_stream, encoding='utf-8', newline='')
-                reader = csv.DictReader(text_wrapper)
-                fieldnames = reader.fieldnames or []
+            timestamp = datetime.combine(date, time.min).replace(tzinfo=timezone.get_current_timezone())
+            # The file is spooled to disk and imported in the background
+            job = jobs.enqueue(csv_file, patient, timestamp, request.user)
+            return redirect('import_job', job_id=job.id)
+    else:
+        form = CSVUploadForm()
+    return render(request, 'users/upload_csv.html', {'form': form})
 
-                def looks_like_numeric_header(names):
-                    if not names:
-                        return True
-                    for n in names:
-                        s = n.strip()
-                        if s == '':
-                            return True
-                        try:
-                            float(s)
-                        except ValueError:
-                            return False
-                    return True
+@login_required
+def import_job(request, job_id):
+    if not (request.user.is_superuser or request.user.role == 'admin'):
+        return render(request, '403.html')
+    job = get_object_or_404(ImportJob.objects.select_related('patient'), pk=job_id)
+    return render(request, 'users/upload_confirm.html', {'job': job, 'progress': jobs.progress(job)})
 
-                required_headers = {'sensor_location', 'pressure_value'}
+@login_required
+def import_job_json(request, job_id):
+    if not (request.user.is_superuser or request.user.role == 'admin'):
+        return JsonResponse({'error': 'forbidden'}, status=403)
+    job = get_object_or_404(ImportJob, pk=job_id)
+    return JsonResponse(jobs.progress(job))
 
-                if required_headers.issubset({f.strip() for f in fieldnames}):
-                    text_wrapper.seek(0)
-                    reader = csv.DictReader(text_wrapper)
-                    from datetime import datetime as _dt, time as _time
-                    timestamp = _dt.combine(date, _time.min).replace(tzinfo=timezone.get_current_timezone())
-                    for row in reader:
-                        try:
-                            sensor_location = row.get('sensor_location')
-                            pressure_value = float(row.get('pressure_value'))
-                        except (TypeError, ValueError):
-                            continue
-                        PressureData.objects.create(
-                            patient=patient,
-                            sensor_location=sensor_location,
-                            pressure_value=pressure_value,
-                            timestamp=timestamp
-                        )
-                elif looks_like_numeric_header(fieldnames):
-                    text_wrapper.seek(0)
-                    matrix_reader = csv.reader(text_wrapper)
-                    from datetime import datetime as _dt, time as _time
-                    timestamp = _dt.combine(date, _time.min).replace(tzinfo=timezone.get_current_timezone())
-                    objs = []
-                    batch_size = 2000
-                    for r_idx, row in enumerate(matrix_reader):
-                        for c_idx, cell in enumerate(row):
-                            cell = cell.strip()
-                            if cell == '':
-                                continue
-                            try:
-                                pressure_value = float(cell)
-                            except ValueError:
-                                continue
-                            sensor_location = f"r{r_idx}_c{c_idx}"
-                            objs.append(PressureData(
-                                patient=patient,
-                                sensor_location=sensor_location,
-                                pressure_value=pressure_value,
-                                timestamp=timestamp
-                            ))
-                            if len(objs) >= batch_size:
-                                PressureData.objects.bulk_create(objs)
-                                objs = []
-                    if objs:
-                        PressureData.objects.bulk_create(objs)
-                else:
-                    form.add_error('csv_file', 'CSV must include headers or be a numeric matrix')
-                    return render(request, 'users/upload_csv.html', {'form': form})
-            except Exception as e:
-                form.add_error('csv_file', f'Error processing CSV: {e}')
-                return render(request, 'users/upload_csv.html', {'form': form})
+@login_required
+def metrics(request):
+    """This process's per-view request metrics: JSON, or Prometheus text with ?format=prometheus."""
+    if not (request.user.is_superuser or request.user.role == 'admin'):
+        return JsonResponse({'error': 'forbidden'}, status=403)
+    wanted = request.GET.get('format') or ('prometheus' if 'text/plain' in request.headers.get('Accept', '') else 'json')
+    if wanted == 'prometheus':
+        return HttpResponse(request_metrics.as_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+    return JsonResponse(request_metrics.as_json())
 
-            messages.success(request, 'CSV uploaded and imported successfully')
-            return redirect('user_list')
-    else:
-        form = CSVUploadForm()
-    return render(request, 'users/upload_csv.html', {'form': form})
+@login_required
+def profiles(request):
+    if not (request.user.is_superuser or request.user.role == 'admin'):
+        return render(request, '403.html')
+    form = ProfileRuleForm()
+    if request.method == 'POST':
+        if 'delete' in request.POST:
+            try:
+                rule_id = int(request.POST['delete'])
+            except ValueError:
+                return HttpResponse('Invalid rule id', status=400, content_type='text/plain')
+            ProfileRule.objects.filter(pk=rule_id).delete()
+            return redirect('profiles')
+        form = ProfileRuleForm(request.POST)
+        if form.is_valid():
+            rule = form.save(commit=False)
+            rule.created_by = request.user
+            rule.save()
+            return redirect('profiles')
+    return render(request, 'users/profiles.html', {
+        'form': form,
+        'rules': ProfileRule.objects.select_related('user').filter(remaining__gt=0),
+        'profiles': profiling.profiles(),
+        'header': settings.PROFILE_HEADER,
+        'token': profiling.header_token(request.user),
+    })
+
+@login_required
+def profile_download(request, name, ext):
+    if not (request.user.is_superuser or request.user.role == 'admin'):
+        return render(request, '403.html')
+    path = profiling.profile_path(name, ext)
+    if path is None:
+        raise Http404('No such profile')
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=f'{name}.{ext}')